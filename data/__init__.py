@@ -1,11 +1,38 @@
 import os
 import glob
+import importlib
 from collections import namedtuple
 
 _INIT_FILE_PATH = os.path.realpath(__file__)
 _DATA_DIR_PATH = os.path.dirname(_INIT_FILE_PATH)
 
-DataSource = namedtuple("DataSource", ["description", "path", "columns"])
+# Schema kind for ODS-style YYYYMMDD date columns
+DATE = "date"
+
+# pandas and pyarrow are only imported when something is loaded, so importing
+# data (or one of its lighter submodules) stays cheap
+_LAZY_EXPORTS = {
+    "load_transfers": "data.transfers",
+    "load_transfer_files": "data.transfers",
+    "transfer_paths": "data.transfers",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        return getattr(importlib.import_module(_LAZY_EXPORTS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class DataSource(namedtuple("DataSource", ["description", "path", "columns", "schema"], defaults=[None])):
+    def load(self):
+        from data.instrumentation import stage
+        from data.sidecar import load_with_sidecar
+
+        with stage("DataSource.load") as run:
+            loaded = load_with_sidecar(self.path, self.columns, self.schema)
+            run.rows_out = len(loaded)
+        return loaded
 
 PRMT_365_Requestor_transfers = DataSource(
   description="",
@@ -132,7 +159,22 @@ GP_ODS_Data = DataSource(
       "ProviderOrPurchaser",
       "Null5",
       "PrescribingSetting",
-      "Null6"]
+      "Null6"],
+  schema={
+      "ODSCode": "category",
+      "NationalGrouping": "category",
+      "HighLevelHealthGeography": "category",
+      "OpenDate": DATE,
+      "CloseDate": DATE,
+      "StatusCode": "category",
+      "OrganisationSubTypeCode": "category",
+      "Commissioner": "category",
+      "JoinProviderOrPurchaserDate": DATE,
+      "LeftProviderOrPurchaserDate": DATE,
+      "AmendedRecordIndicator": "Int8",
+      "ProviderOrPurchaser": "category",
+      "PrescribingSetting": "Int8",
+  }
 )
 
 GP_CCG_Mapping = DataSource(
@@ -142,7 +184,15 @@ GP_CCG_Mapping = DataSource(
   on a quarterly basis; this was generated on 20190830.
   """,
   path=os.path.join(_DATA_DIR_PATH, "epcmem.csv"),
-  columns=["ODSCode", "ParentODSCode", "ParentOrganisationType", "JoinParentDate", "LeftParentDate", "AmendedRecordIndicator"]
+  columns=["ODSCode", "ParentODSCode", "ParentOrganisationType", "JoinParentDate", "LeftParentDate", "AmendedRecordIndicator"],
+  schema={
+      "ODSCode": "category",
+      "ParentODSCode": "category",
+      "ParentOrganisationType": "category",
+      "JoinParentDate": DATE,
+      "LeftParentDate": DATE,
+      "AmendedRecordIndicator": "Int8",
+  }
 )
 
 PRMT_1192_large_message_errors = DataSource(
@@ -194,5 +244,6 @@ PRMT_1145_attachment_sizes = DataSource(
 gp2gp_response_codes = DataSource(
   description="GP2GP response codes",
   path=os.path.join(_DATA_DIR_PATH, "gp2gp_response_codes.csv"),
-  columns=None
-)
\ No newline at end of file
+  columns=None,
+  schema={"ErrorCode": "Int64"}
+)
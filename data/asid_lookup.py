@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+LOOKUP_COLUMNS = ["practice_ods_code", "practice_name", "ccg_ods_code", "ccg_name"]
+ENRICH_PREFIXES = {
+    "requesting_": "requesting_practice_asid",
+    "sending_": "sending_practice_asid",
+}
+MISSING = -1
+_DAY = np.timedelta64(1, "D")
+# Day numbers for a missing date, and for a membership with no LeftParentDate.
+# Neither is ever put in a key.
+NO_DAY = np.iinfo(np.int64).min
+STILL_CURRENT = np.iinfo(np.int64).max
+# Days are offset into the unsigned low 32 bits of a key, so dates before the
+# epoch don't borrow from the practice code above them
+_DAY_OFFSET = 1 << 31
+
+
+def _asids_as_int64(asids):
+    return pd.to_numeric(pd.Series(asids), errors="coerce").fillna(MISSING).values.astype(np.int64)
+
+
+def _days(dates, missing=NO_DAY):
+    # Days since the epoch. NaT would otherwise come out as int64 min, so it is
+    # replaced with missing explicitly.
+    dates = pd.to_datetime(pd.Series(dates))
+    days = dates.values.astype("datetime64[D]").astype(np.int64)
+    return np.where(dates.isna().values, missing, days)
+
+
+class AsidLookup:
+    # Sorted integer ASIDs with parallel categorical columns. Lookups are a binary
+    # search, so enriching transfers never copies the transfers frame.
+    def __init__(self, asids, columns):
+        self.asids = asids
+        self.columns = columns
+
+    @classmethod
+    def from_asid_metadata(cls, asid_lookup):
+        frame = asid_lookup.reset_index()
+        asids = _asids_as_int64(frame["asid"])
+        order = np.argsort(asids, kind="stable")
+        columns = {
+            column: pd.Categorical(frame[column].values[order])
+            for column in LOOKUP_COLUMNS
+        }
+        return cls(asids[order], columns)
+
+    def __len__(self):
+        return len(self.asids)
+
+    def positions(self, asids):
+        asids = _asids_as_int64(asids)
+        positions = np.searchsorted(self.asids, asids)
+        positions = np.minimum(positions, len(self.asids) - 1)
+        found = (len(self.asids) > 0) & (self.asids[positions] == asids) & (asids != MISSING)
+        return np.where(found, positions, MISSING)
+
+    def column_at(self, column, positions):
+        values = self.columns[column]
+        codes = np.where(positions == MISSING, MISSING, values.codes[positions])
+        return pd.Categorical.from_codes(codes, categories=values.categories)
+
+    def enrich(self, transfers, ccg_membership=None, date_column="date_requested"):
+        for prefix, asid_column in ENRICH_PREFIXES.items():
+            positions = self.positions(transfers[asid_column])
+            for column in LOOKUP_COLUMNS:
+                transfers[prefix + column] = self.column_at(column, positions)
+            if ccg_membership is not None:
+                transfers[prefix + "ccg_ods_code_at_request"] = ccg_membership.parent_at(
+                    transfers[prefix + "practice_ods_code"], transfers[date_column]
+                )
+        return transfers
+
+
+class CcgMembership:
+    # Point-in-time practice -> parent organisation lookup built from epcmem.csv
+    # (data.GP_CCG_Mapping). A membership covers JoinParentDate to LeftParentDate
+    # inclusive; an empty LeftParentDate means it is still current.
+    def __init__(self, practice_ods_codes, keys, left_days, parent_ods_codes):
+        self.practice_ods_codes = practice_ods_codes
+        self.keys = keys
+        self.left_days = left_days
+        self.parent_ods_codes = parent_ods_codes
+
+    @classmethod
+    def from_gp_ccg_mapping(cls, mapping):
+        # A membership with no JoinParentDate can't be placed in time, so it is
+        # left out rather than sorted ahead of every other practice's
+        join_days = _days(mapping["JoinParentDate"])
+        mapping, join_days = mapping[join_days != NO_DAY], join_days[join_days != NO_DAY]
+        practice_ods_codes = pd.Index(mapping["ODSCode"].astype(str).unique())
+        practice_codes = practice_ods_codes.get_indexer(mapping["ODSCode"].astype(str))
+        keys = cls._keys(practice_codes, join_days)
+        left_days = _days(mapping["LeftParentDate"], missing=STILL_CURRENT)
+        order = np.argsort(keys, kind="stable")
+        parents = pd.Categorical(mapping["ParentODSCode"].astype(str).values[order])
+        return cls(practice_ods_codes, keys[order], left_days[order], parents)
+
+    @staticmethod
+    def _keys(practice_codes, days):
+        # Dates pandas can represent are within about 106,000 days of the epoch, so
+        # offset days fit comfortably in the low 32 bits
+        return (practice_codes.astype(np.int64) << 32) + (days + _DAY_OFFSET)
+
+    def parent_at(self, practice_ods_codes, dates):
+        if len(self.keys) == 0:
+            return pd.Categorical.from_codes(np.full(len(practice_ods_codes), MISSING), categories=self.parent_ods_codes.categories)
+        practice_codes = self.practice_ods_codes.get_indexer(pd.Series(practice_ods_codes).astype(str))
+        days = _days(dates)
+        has_date = days != NO_DAY
+        days = np.where(has_date, days, 0)
+        positions = np.searchsorted(self.keys, self._keys(practice_codes, days), side="right") - 1
+        safe_positions = np.maximum(positions, 0)
+        same_practice = (self.keys[safe_positions] >> 32) == practice_codes
+        found = (practice_codes != MISSING) & has_date & (positions >= 0) & same_practice
+        found &= days <= self.left_days[safe_positions]
+        codes = np.where(found, self.parent_ods_codes.codes[safe_positions], MISSING)
+        return pd.Categorical.from_codes(codes, categories=self.parent_ods_codes.categories)
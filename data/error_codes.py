@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import data
+
+# Transfer error code columns by stage, labelled as in the error code combination
+# notebooks. Older transfers datasets have a single sender_error_code instead.
+TRANSFER_ERROR_CODE_STAGES = {
+    "Sender": "sender_error_codes",
+    "COPC": "intermediate_error_codes",
+    "Final": "final_error_codes",
+}
+NO_ERROR_CODE = "No Error Code"
+
+# GP2GP error codes are all below 100, so two 64 bit words cover every code
+BITSET_WORDS = 2
+MAX_ERROR_CODE = BITSET_WORDS * 64 - 1
+
+
+def _flatten_error_codes(values):
+    # Returns (row, code) pairs for a column of error code lists or single codes,
+    # without visiting rows in Python.
+    array = values if isinstance(values, (pa.Array, pa.ChunkedArray)) else pa.array(values, from_pandas=True)
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    if pa.types.is_list(array.type) or pa.types.is_large_list(array.type):
+        rows = pc.list_parent_indices(array).to_numpy()
+        codes = pc.list_flatten(array)
+    else:
+        rows = np.arange(len(array))
+        codes = array
+    codes = codes.cast(pa.float64()).to_numpy(zero_copy_only=False)
+    present = ~np.isnan(codes)
+    return rows[present], codes[present].astype(np.int64)
+
+
+def encode_error_codes(values):
+    rows, codes = _flatten_error_codes(values)
+    unsupported = (codes < 0) | (codes > MAX_ERROR_CODE)
+    if unsupported.any():
+        raise ValueError(f"Error codes outside 0-{MAX_ERROR_CODE}: {sorted(set(codes[unsupported]))}")
+
+    bitsets = np.zeros((len(values), BITSET_WORDS), dtype=np.uint64)
+    bits = np.left_shift(np.uint64(1), (codes & 63).astype(np.uint64))
+    np.bitwise_or.at(bitsets, (rows, codes >> 6), bits)
+    return bitsets
+
+
+def code_mask(codes):
+    mask = np.zeros(BITSET_WORDS, dtype=np.uint64)
+    for code in codes:
+        mask[code >> 6] |= np.uint64(1) << np.uint64(code & 63)
+    return mask
+
+
+def decode_bitset(words):
+    bits = np.unpackbits(np.ascontiguousarray(words, dtype="<u8").view(np.uint8), bitorder="little")
+    return np.flatnonzero(bits).tolist()
+
+
+def _factorize_rows(words):
+    # Hash-based equivalent of np.unique(words, axis=0, return_inverse=True), which
+    # sorts the rows and is far slower. Codes are in order of first appearance.
+    codes = np.zeros(len(words), dtype=np.int64)
+    for column in words.T:
+        column_codes, uniques = pd.factorize(column)
+        codes, _ = pd.factorize(codes * len(uniques) + column_codes)
+    _, first_rows = np.unique(codes, return_index=True)
+    return codes, words[first_rows]
+
+
+def error_code_descriptions():
+    response_codes = data.gp2gp_response_codes.load().dropna(subset=["ErrorCode"])
+    return pd.Series(response_codes["ErrorName"].values, index=response_codes["ErrorCode"].astype(int).values)
+
+
+class ErrorCodeBitsets:
+    # One (rows x BITSET_WORDS) uint64 array per stage, aligned with the transfers
+    # frame it was built from. Membership tests and combinations are bitwise
+    # operations over these arrays rather than per-row list scans.
+    def __init__(self, stages, index):
+        self.stages = stages
+        self.index = index
+
+    @classmethod
+    def from_transfers(cls, transfers, stages=TRANSFER_ERROR_CODE_STAGES):
+        return cls(
+            {stage: encode_error_codes(transfers[column]) for stage, column in stages.items() if column in transfers},
+            transfers.index,
+        )
+
+    @classmethod
+    def from_columns(cls, columns):
+        stages = {}
+        for column in columns.columns:
+            stage, word = column.rsplit("_bits_", 1)
+            stages.setdefault(stage, np.zeros((len(columns), BITSET_WORDS), dtype=np.uint64))
+            stages[stage][:, int(word)] = columns[column].values
+        return cls(stages, columns.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def to_columns(self):
+        # Flat uint64 columns, e.g. to store next to transfers in parquet
+        return pd.DataFrame(
+            {
+                f"{stage}_bits_{word}": bitsets[:, word]
+                for stage, bitsets in self.stages.items()
+                for word in range(BITSET_WORDS)
+            },
+            index=self.index,
+        )
+
+    def bits(self, stage=None):
+        if stage is not None:
+            return self.stages[stage]
+        combined = np.zeros((len(self), BITSET_WORDS), dtype=np.uint64)
+        for bitsets in self.stages.values():
+            combined |= bitsets
+        return combined
+
+    def has_any(self, codes, stage=None):
+        return (self.bits(stage) & code_mask(codes)).any(axis=1)
+
+    def has_all(self, codes, stage=None):
+        mask = code_mask(codes)
+        return ((self.bits(stage) & mask) == mask).all(axis=1)
+
+    def has(self, code, stage=None):
+        return self.has_any([code], stage)
+
+    def one_hot(self, stage=None):
+        # Same layout as MultiLabelBinarizer: one column per code that occurs
+        bits = self.bits(stage)
+        present = decode_bitset(np.bitwise_or.reduce(bits, axis=0))
+        return pd.DataFrame(
+            {code: (bits[:, code >> 6] >> np.uint64(code & 63)) & np.uint64(1) for code in present},
+            index=self.index,
+            dtype=np.uint8,
+        )
+
+    def _signature_label(self, words, descriptions):
+        labels = []
+        for stage_number, stage in enumerate(self.stages):
+            for code in decode_bitset(words[stage_number * BITSET_WORDS:(stage_number + 1) * BITSET_WORDS]):
+                label = f"{stage}:{code}"
+                if descriptions is not None:
+                    label += f" ({descriptions.get(code, 'Unknown')})"
+                labels.append(label)
+        return ", ".join(labels) if labels else NO_ERROR_CODE
+
+    def signatures(self, describe=False):
+        # Only the distinct combinations are decoded into labels
+        if not self.stages:
+            return pd.Categorical([NO_ERROR_CODE] * len(self))
+        words = np.hstack(list(self.stages.values()))
+        codes, unique_words = _factorize_rows(words)
+        descriptions = error_code_descriptions() if describe else None
+        labels = [self._signature_label(row, descriptions) for row in unique_words]
+        return pd.Categorical.from_codes(codes, categories=pd.Index(labels))
+
+    def combinations(self, transfers=None, by=(), describe=False):
+        # Transfer counts per error code combination, optionally split by columns
+        # of the transfers frame, e.g. by=["sending_supplier", "requesting_supplier"]
+        frame = pd.DataFrame({"error_code_combination": self.signatures(describe)}, index=self.index)
+        for column in by:
+            frame[column] = transfers[column].values
+        keys = list(by) + ["error_code_combination"]
+        counts = frame.groupby(keys, observed=True, dropna=False).size().rename("number_of_transfers")
+        return counts.reset_index().sort_values("number_of_transfers", ascending=False, ignore_index=True)
@@ -0,0 +1,265 @@
+import atexit
+import cProfile
+import functools
+import json
+import os
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Set PRM_SANDBOX_INSTRUMENT to a file path to write a JSON stage report there
+# when the process exits. PRM_SANDBOX_PROFILE_STAGE names one stage to run under
+# cProfile (dumped to PRM_SANDBOX_PROFILE_FILE, default <stage>.prof), and
+# PRM_SANDBOX_TRACEMALLOC=1 adds Python allocation peaks, which is much slower.
+REPORT_PATH_VARIABLE = "PRM_SANDBOX_INSTRUMENT"
+PROFILE_STAGE_VARIABLE = "PRM_SANDBOX_PROFILE_STAGE"
+PROFILE_FILE_VARIABLE = "PRM_SANDBOX_PROFILE_FILE"
+TRACEMALLOC_VARIABLE = "PRM_SANDBOX_TRACEMALLOC"
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_MB = 1024 * 1024
+
+
+def _current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return None
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageStats:
+    # Totals for every run of one named stage. Stages called once per conversation
+    # are aggregated rather than reported per call.
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.child_wall_seconds = 0.0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.rss_delta_bytes = 0
+        self.peak_rss_bytes = 0
+        self.traced_peak_bytes = 0
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "calls": self.calls,
+            "wall_seconds": self.wall_seconds,
+            # Time not spent in other instrumented stages called from this one
+            "exclusive_wall_seconds": self.wall_seconds - self.child_wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rss_delta_mb": self.rss_delta_bytes / _MB,
+            "peak_rss_mb": self.peak_rss_bytes / _MB,
+            "traced_peak_mb": self.traced_peak_bytes / _MB if tracemalloc.is_tracing() else None,
+        }
+
+
+class StageRun:
+    def __init__(self, stats, rows_in, memory):
+        self.stats = stats
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.memory = memory
+        self.child_wall_seconds = 0.0
+
+
+class _NoOpRun:
+    # Handed out when instrumentation is off, so stage bodies can set rows_out freely
+    rows_in = None
+    rows_out = None
+
+
+_NO_OP_RUN = _NoOpRun()
+
+
+class Instrumentation:
+    def __init__(self, report_path=None, profile_stage=None, profile_path=None, trace_allocations=False):
+        self.report_path = report_path
+        self.profile_stage = profile_stage
+        self.profile_path = profile_path or (f"{profile_stage}.prof" if profile_stage else None)
+        self.profiler = cProfile.Profile() if profile_stage else None
+        self.stats = {}
+        self.active = []
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _stats(self, name):
+        if name not in self.stats:
+            self.stats[name] = StageStats(name)
+        return self.stats[name]
+
+    def start(self, name, rows_in=None, memory=True):
+        run = StageRun(self._stats(name), rows_in, memory)
+        run.rss_start = _current_rss_bytes() if memory else None
+        if memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        if self.profiler is not None and name == self.profile_stage:
+            self.profiler.enable()
+        self.active.append(run)
+        run.wall_start = time.perf_counter()
+        run.cpu_start = time.process_time()
+        return run
+
+    def stop(self, run):
+        wall = time.perf_counter() - run.wall_start
+        cpu = time.process_time() - run.cpu_start
+        if self.profiler is not None and run.stats.name == self.profile_stage:
+            self.profiler.disable()
+        self.active.pop()
+        if self.active:
+            self.active[-1].child_wall_seconds += wall
+
+        stats = run.stats
+        stats.calls += 1
+        stats.wall_seconds += wall
+        stats.cpu_seconds += cpu
+        stats.child_wall_seconds += run.child_wall_seconds
+        stats.rows_in += run.rows_in or 0
+        stats.rows_out += run.rows_out or 0
+        if run.memory:
+            rss_end = _current_rss_bytes()
+            if rss_end is not None and run.rss_start is not None:
+                stats.rss_delta_bytes += rss_end - run.rss_start
+            stats.peak_rss_bytes = max(stats.peak_rss_bytes, _peak_rss_bytes())
+            if tracemalloc.is_tracing():
+                stats.traced_peak_bytes = max(stats.traced_peak_bytes, tracemalloc.get_traced_memory()[1])
+
+    def report(self):
+        return [stats.as_dict() for stats in self.stats.values()]
+
+    def write_report(self, path=None):
+        path = path or self.report_path
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.profile_path)
+        return path
+
+
+_instrumentation = None
+
+
+def enable(report_path=None, profile_stage=None, profile_path=None, trace_allocations=False):
+    global _instrumentation
+    _instrumentation = Instrumentation(report_path, profile_stage, profile_path, trace_allocations)
+    return _instrumentation
+
+
+def disable():
+    global _instrumentation
+    _instrumentation = None
+
+
+def current():
+    return _instrumentation
+
+
+def _write_report_at_exit():
+    if _instrumentation is not None and _instrumentation.report_path:
+        _instrumentation.write_report()
+
+
+if os.environ.get(REPORT_PATH_VARIABLE):
+    enable(
+        report_path=os.environ[REPORT_PATH_VARIABLE],
+        profile_stage=os.environ.get(PROFILE_STAGE_VARIABLE),
+        profile_path=os.environ.get(PROFILE_FILE_VARIABLE),
+        trace_allocations=os.environ.get(TRACEMALLOC_VARIABLE) == "1",
+    )
+    atexit.register(_write_report_at_exit)
+
+
+@contextmanager
+def _stage(instrumentation, name, rows_in, memory):
+    run = instrumentation.start(name, rows_in, memory)
+    try:
+        yield run
+    finally:
+        instrumentation.stop(run)
+
+
+class _NoOpStage:
+    def __enter__(self):
+        return _NO_OP_RUN
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_OP_STAGE = _NoOpStage()
+
+
+def stage(name, rows_in=None, memory=True):
+    # with stage("parse") as run: ...; run.rows_out = len(parsed)
+    # Pass memory=False for stages run once per conversation, where reading RSS
+    # on every call would cost more than the stage itself.
+    if _instrumentation is None:
+        return _NO_OP_STAGE
+    return _stage(_instrumentation, name, rows_in, memory)
+
+
+def instrumented(name=None):
+    # Decorator form of stage(); rows_out is len(result) where that exists
+    def decorator(function):
+        stage_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _instrumentation is None:
+                return function(*args, **kwargs)
+            with _stage(_instrumentation, stage_name, None, True) as run:
+                result = function(*args, **kwargs)
+                try:
+                    run.rows_out = len(result)
+                except TypeError:
+                    pass
+                return result
+        return wrapper
+    return decorator
+
+
+def instrument_iterable(name, iterable):
+    # Lazy pipeline stages (read -> construct -> group) only do their work when
+    # pulled, so time is measured inside each next() and items are counted as
+    # rows out. Time spent pulling from an instrumented upstream stage is
+    # recorded against that stage, not this one.
+    if _instrumentation is None:
+        return iterable
+    return _instrumented_iterator(_instrumentation, name, iter(iterable))
+
+
+def _instrumented_iterator(instrumentation, name, iterator):
+    stats = instrumentation._stats(name)
+    rss_start = _current_rss_bytes()
+    rows, pulls = 0, 0
+    try:
+        while True:
+            pulls += 1
+            run = instrumentation.start(name, memory=False)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                instrumentation.stop(run)
+            rows += 1
+            yield item
+    finally:
+        # The whole iteration counts as one call of the stage
+        stats.calls += 1 - pulls
+        stats.rows_out += rows
+        rss_end = _current_rss_bytes()
+        if rss_start is not None and rss_end is not None:
+            stats.rss_delta_bytes += rss_end - rss_start
+        stats.peak_rss_bytes = max(stats.peak_rss_bytes, _peak_rss_bytes())
@@ -0,0 +1,89 @@
+import codecs
+import json
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+_WHITESPACE = " \t\n\r"
+# Characters that can follow a complete number
+_NUMBER_DELIMITERS = _WHITESPACE + ",]}:"
+
+
+class _StreamReader:
+    def __init__(self, stream, block_size):
+        self.stream = stream
+        self.block_size = block_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.exhausted = False
+
+    def _fill(self):
+        block = self.stream.read(self.block_size)
+        if not block:
+            self.exhausted = True
+        self.buffer = self.buffer[self.position:] + self.decoder.decode(block, final=self.exhausted)
+        self.position = 0
+
+    def peek(self):
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in _WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer) or self.exhausted:
+                break
+            self._fill()
+        return self.buffer[self.position] if self.position < len(self.buffer) else ""
+
+    def expect(self, *characters):
+        character = self.peek()
+        if character not in characters:
+            raise json.JSONDecodeError(f"Expected one of {characters}", self.buffer, self.position)
+        self.position += 1
+        return character
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.position)
+                # A number is only complete once the character after it has been
+                # read, as "1." at the end of a block may continue as "1.5e10"
+                complete = not isinstance(value, (int, float)) or isinstance(value, bool) or (
+                    end < len(self.buffer) and self.buffer[end] in _NUMBER_DELIMITERS
+                )
+                if complete or self.exhausted:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.exhausted:
+                    raise
+            self._fill()
+
+
+def stream_object_arrays(stream, handlers, block_size=DEFAULT_BLOCK_SIZE):
+    # Parses a top-level JSON object from a binary stream. Elements of arrays under
+    # the keys in handlers are passed to the handler one at a time instead of being
+    # collected; every other member is decoded normally and returned in a dict.
+    reader = _StreamReader(stream, block_size)
+    other_members = {}
+
+    reader.expect("{")
+    if reader.peek() == "}":
+        return other_members
+
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key in handlers and reader.peek() == "[":
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.expect("]")
+            else:
+                while True:
+                    handlers[key](reader.value())
+                    if reader.expect(",", "]") == "]":
+                        break
+        else:
+            other_members[key] = reader.value()
+
+        if reader.expect(",", "}") == "}":
+            return other_members
@@ -0,0 +1,241 @@
+import datetime
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import re
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from data.s3_cache import DEFAULT_CACHE_DIR, default_cache, evict_least_recently_used, parse_s3_url
+
+# Results of memoized functions are kept under <cache dir>/memoize, separately
+# from the S3 file cache so the two don't evict each other. Set
+# PRM_SANDBOX_MEMOIZE=0 to always recompute.
+DEFAULT_MEMO_DIR = os.path.join(DEFAULT_CACHE_DIR, "memoize")
+DEFAULT_MAX_MEMO_BYTES = int(os.environ.get("PRM_SANDBOX_MEMO_MAX_BYTES", 5 * 1024 ** 3))
+ENABLED_VARIABLE = "PRM_SANDBOX_MEMOIZE"
+
+PARQUET_SUFFIX = ".parquet"
+PICKLE_SUFFIX = ".pickle"
+
+
+def _enabled():
+    return os.environ.get(ENABLED_VARIABLE, "1") != "0"
+
+
+def input_fingerprint(path):
+    # What a cached result depends on for one input: S3 objects by ETag, local
+    # files by size and modification time, directories by all the files in them
+    path = str(path)
+    if path.startswith("s3://"):
+        bucket, key = parse_s3_url(path)
+        return [path, default_cache().s3_client.head_object(Bucket=bucket, Key=key)["ETag"]]
+    if os.path.isdir(path):
+        return [path] + [input_fingerprint(file) for file in sorted(Path(path).rglob("*")) if file.is_file()]
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def _update_digest(digest, value):
+    # Hashes the value rather than its pickle where pickles aren't stable, e.g.
+    # frames, whose pickles change with memory layout
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        digest.update(b"frame")
+        digest.update(pd.util.hash_pandas_object(value).values.tobytes())
+        digest.update(repr(list(getattr(value, "columns", [value.name]))).encode("utf-8"))
+    elif isinstance(value, np.ndarray):
+        digest.update(b"array")
+        digest.update(repr((value.dtype.str, value.shape)).encode("utf-8"))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}{len(value)}".encode("utf-8"))
+        for item in value:
+            _update_digest(digest, item)
+    elif isinstance(value, dict):
+        digest.update(f"dict{len(value)}".encode("utf-8"))
+        for key in sorted(value, key=repr):
+            _update_digest(digest, key)
+            _update_digest(digest, value[key])
+    elif value is None or isinstance(value, (str, bytes, int, float, bool, Path, datetime.date, datetime.timedelta)):
+        digest.update(repr(value).encode("utf-8"))
+    else:
+        digest.update(pickle.dumps(value, protocol=4))
+
+
+def function_source(function):
+    try:
+        return inspect.getsource(function)
+    except (OSError, TypeError):
+        return inspect.unwrap(function).__code__.co_code.hex()
+
+
+def module_source(function):
+    # The whole module the function is defined in, so a change to a helper next to
+    # it (or to a class it runs) also changes the key
+    try:
+        return inspect.getsource(inspect.getmodule(inspect.unwrap(function)))
+    except (OSError, TypeError):
+        return function_source(function)
+
+
+def _function_name(function):
+    return re.sub(r"[^A-Za-z0-9_.]", "_", f"{function.__module__}.{function.__qualname__}")
+
+
+class MemoStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+_stats = {}
+
+
+def memo_stats():
+    # Hits and misses per memoized function in this process
+    return pd.DataFrame.from_dict(
+        {name: stats.as_dict() for name, stats in _stats.items()},
+        orient="index",
+        columns=["hits", "misses", "evictions"],
+    )
+
+
+def _write_result(result, path_without_suffix, cache_dir):
+    # Frames go to parquet where Arrow can represent them, everything else is pickled
+    with tempfile.NamedTemporaryFile(dir=cache_dir, prefix=".memo-", delete=False) as temporary:
+        temporary_path = temporary.name
+    try:
+        if isinstance(result, pd.DataFrame):
+            try:
+                result.to_parquet(temporary_path)
+                suffix = PARQUET_SUFFIX
+            except (pa.ArrowException, TypeError, ValueError):
+                suffix = None
+        else:
+            suffix = None
+        if suffix is None:
+            with open(temporary_path, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            suffix = PICKLE_SUFFIX
+        path = path_without_suffix + suffix
+        os.replace(temporary_path, path)
+        return path
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def _read_result(path):
+    if path.endswith(PARQUET_SUFFIX):
+        return pd.read_parquet(path)
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def memoize(inputs=(), ignore=(), version=None, cache_dir=None, max_bytes=DEFAULT_MAX_MEMO_BYTES):
+    # Caches a function's result on disk, keyed on the source of its module, its
+    # arguments and the fingerprints of the files it reads. inputs names the
+    # parameters holding input paths/URLs (or lists of them), or is a function of
+    # the bound arguments returning the paths. ignore names arguments that don't
+    # affect the result. Only the defining module's source is hashed, so bump
+    # version when code in another module changes what the function returns.
+    #
+    #   @memoize(inputs=["month_file_name", "next_month_file_name"])
+    #   def calculate_counts(month_file_name, next_month_file_name, time_range): ...
+    #
+    #   calculate_counts.invalidate(...same arguments...)  # forget one result
+    #   calculate_counts.clear()                           # forget all of them
+    def decorator(function):
+        name = _function_name(function)
+        signature = inspect.signature(function)
+        source = module_source(function)
+        stats = _stats.setdefault(name, MemoStats())
+
+        def directory():
+            path = cache_dir or DEFAULT_MEMO_DIR
+            os.makedirs(path, exist_ok=True)
+            return path
+
+        def input_paths(arguments):
+            if callable(inputs):
+                return list(inputs(arguments))
+            paths = []
+            for parameter in inputs:
+                value = arguments[parameter]
+                paths.extend(value if isinstance(value, (list, tuple)) else [value])
+            return paths
+
+        def key(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            digest = hashlib.sha256()
+            _update_digest(digest, [name, source, version])
+            _update_digest(digest, {parameter: value for parameter, value in arguments.items() if parameter not in ignore})
+            _update_digest(digest, [input_fingerprint(path) for path in input_paths(arguments)])
+            return os.path.join(directory(), f"{name}-{digest.hexdigest()}")
+
+        def cached_path(path_without_suffix):
+            for suffix in [PARQUET_SUFFIX, PICKLE_SUFFIX]:
+                if os.path.exists(path_without_suffix + suffix):
+                    return path_without_suffix + suffix
+            return None
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled():
+                return function(*args, **kwargs)
+            path_without_suffix = key(args, kwargs)
+            path = cached_path(path_without_suffix)
+            if path is not None:
+                try:
+                    result = _read_result(path)
+                except (OSError, EOFError, pickle.UnpicklingError, pa.ArrowException):
+                    pass
+                else:
+                    os.utime(path)
+                    stats.hits += 1
+                    return result
+
+            stats.misses += 1
+            result = function(*args, **kwargs)
+            path = _write_result(result, path_without_suffix, directory())
+            stats.evictions += len(evict_least_recently_used(directory(), max_bytes, keep={path}))
+            return result
+
+        def invalidate(*args, **kwargs):
+            path = cached_path(key(args, kwargs))
+            if path is not None:
+                os.remove(path)
+            return path is not None
+
+        def clear():
+            removed = 0
+            for entry in os.scandir(directory()):
+                if entry.name.startswith(f"{name}-"):
+                    os.remove(entry.path)
+                    removed += 1
+            return removed
+
+        wrapper.uncached = function
+        wrapper.invalidate = invalidate
+        wrapper.clear = clear
+        wrapper.stats = stats
+        return wrapper
+    return decorator
+
+
+def clear_memo_cache(cache_dir=None):
+    cache_dir = cache_dir or DEFAULT_MEMO_DIR
+    if os.path.isdir(cache_dir):
+        evict_least_recently_used(cache_dir, 0)
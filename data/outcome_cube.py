@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data.error_codes import NO_ERROR_CODE, TRANSFER_ERROR_CODE_STAGES, ErrorCodeBitsets
+from data.s3_cache import default_cache
+from data.transfers import load_transfer_files
+
+DEFAULT_DIMENSIONS = [
+    "month",
+    "requesting_supplier",
+    "sending_supplier",
+    "status",
+    "failure_reason",
+    "requesting_ccg_ods_code",
+    "error_code_combination",
+]
+MEASURES = ["number_of_transfers", "sla_duration_seconds_sum", "sla_duration_count"]
+MISSING_VALUE = "N/A"
+INTEGRATED_ON_TIME = "INTEGRATED_ON_TIME"
+
+CUBE_SUFFIX = ".outcome_cube.parquet"
+_FINGERPRINT_METADATA_KEY = b"sandbox_cube_fingerprint"
+
+
+def sla_seconds(sla_duration):
+    # SLA durations as float seconds, whether stored as timedeltas or numbers
+    if pd.api.types.is_timedelta64_dtype(sla_duration):
+        return sla_duration.dt.total_seconds()
+    return pd.to_numeric(sla_duration, errors="coerce")
+
+
+def _dimension_values(transfers, dimension, date_column):
+    if dimension == "month":
+        # Formatting only the distinct months is much cheaper than strftime per row
+        months = pd.to_datetime(transfers[date_column]).dt.tz_localize(None).values.astype("datetime64[M]")
+        codes, uniques = pd.factorize(months)
+        labels = pd.Index(uniques).strftime("%Y-%m")
+        return pd.Categorical.from_codes(codes, categories=labels).add_categories([MISSING_VALUE]).fillna(MISSING_VALUE)
+    if dimension == "error_code_combination":
+        return ErrorCodeBitsets.from_transfers(transfers).signatures()
+    values = transfers[dimension]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.add_categories([MISSING_VALUE]) if MISSING_VALUE not in values.cat.categories else values
+        return values.fillna(MISSING_VALUE)
+    return values.astype(object).fillna(MISSING_VALUE)
+
+
+def _available(transfers, dimension, date_column):
+    if dimension == "month":
+        return date_column in transfers
+    if dimension == "error_code_combination":
+        return any(column in transfers for column in TRANSFER_ERROR_CODE_STAGES.values())
+    return dimension in transfers
+
+
+def _percentage(counts, totals):
+    return counts.div(totals.where(totals != 0)).multiply(100)
+
+
+class OutcomeCube:
+    # Transfer counts and SLA sums for every combination of the dimension values
+    # that occurs. Cubes are additive, so monthly cubes can be combined and any
+    # roll-up over a subset of the dimensions is a groupby over the cells alone.
+    def __init__(self, cells, dimensions):
+        self.cells = cells
+        self.dimensions = dimensions
+
+    @classmethod
+    def from_transfers(cls, transfers, dimensions=DEFAULT_DIMENSIONS, date_column="date_requested"):
+        dimensions = [dimension for dimension in dimensions if _available(transfers, dimension, date_column)]
+        frame = pd.DataFrame(
+            {dimension: _dimension_values(transfers, dimension, date_column) for dimension in dimensions},
+            index=transfers.index,
+        )
+        frame["number_of_transfers"] = 1
+        sla_duration_seconds = sla_seconds(transfers["sla_duration"]) if "sla_duration" in transfers else np.nan
+        frame["sla_duration_seconds_sum"] = sla_duration_seconds
+        frame["sla_duration_count"] = pd.notna(sla_duration_seconds).astype(np.int64) if "sla_duration" in transfers else 0
+        return cls(cls._aggregate(frame, dimensions), dimensions)
+
+    @classmethod
+    def combine(cls, cubes):
+        cubes = list(cubes)
+        dimensions = [dimension for dimension in cubes[0].dimensions if all(dimension in cube.dimensions for cube in cubes)]
+        cells = pd.concat([cube.cells for cube in cubes], ignore_index=True)
+        return cls(cls._aggregate(cells, dimensions), dimensions)
+
+    @staticmethod
+    def _aggregate(frame, dimensions):
+        if not dimensions:
+            return frame[MEASURES].sum().to_frame().T
+        cells = frame.groupby(dimensions, observed=True, sort=False)[MEASURES].sum().reset_index()
+        for dimension in dimensions:
+            cells[dimension] = cells[dimension].astype("category")
+        return cells
+
+    def __len__(self):
+        return len(self.cells)
+
+    def where(self, **values):
+        # e.g. cube.where(month=["2021-08", "2021-09"], sending_supplier="EMIS")
+        mask = np.ones(len(self.cells), dtype=bool)
+        for dimension, value in values.items():
+            accepted = value if isinstance(value, (list, tuple, set)) else [value]
+            mask &= self.cells[dimension].isin(accepted).values
+        return OutcomeCube(self.cells[mask].reset_index(drop=True), self.dimensions)
+
+    def rollup(self, by=()):
+        by = list(by)
+        if by:
+            table = self.cells.groupby(by, observed=True)[MEASURES].sum().reset_index()
+        else:
+            table = self.cells[MEASURES].sum().to_frame().T
+        table["mean_sla_duration_seconds"] = table["sla_duration_seconds_sum"] / table["sla_duration_count"].where(
+            table["sla_duration_count"] != 0
+        )
+        return table.sort_values("number_of_transfers", ascending=False, ignore_index=True)
+
+    def percentages(self, by, within=()):
+        # Share of transfers in each `by` group, as a percentage of its `within` group
+        # (or of all transfers when within is empty)
+        by, within = list(by), list(within)
+        table = self.rollup(by)
+        if within:
+            totals = table.groupby(within, observed=True)["number_of_transfers"].transform("sum")
+        else:
+            totals = pd.Series(table["number_of_transfers"].sum(), index=table.index)
+        table["percentage"] = _percentage(table["number_of_transfers"], totals)
+        return table
+
+    def top_n(self, n, by, within=(), measure="number_of_transfers"):
+        table = self.percentages(by, within)
+        table = table.sort_values(measure, ascending=False, ignore_index=True)
+        if within:
+            return table.groupby(list(within), observed=True, sort=False).head(n).reset_index(drop=True)
+        return table.head(n)
+
+    def high_level_table(self, by=("requesting_supplier", "sending_supplier", "status", "failure_reason", "error_code_combination")):
+        # The table generate_high_level_table builds in the high level table notebooks
+        by = [dimension for dimension in by if dimension in self.dimensions]
+        table = self.rollup(by).rename(columns={"number_of_transfers": "Number of Transfers"})
+        count = table["Number of Transfers"]
+        table["% of Transfers"] = _percentage(count, pd.Series(count.sum(), index=table.index))
+
+        pathway = ["sending_supplier", "requesting_supplier"]
+        if all(dimension in by for dimension in pathway):
+            table["% Supplier Pathway Transfers"] = _percentage(
+                count, table.groupby(pathway, observed=True)["Number of Transfers"].transform("sum")
+            )
+
+        if "failure_reason" in by:
+            total_fallback = count[table["failure_reason"].astype(str) != MISSING_VALUE].sum()
+            if "status" in by:
+                fallback = table["status"].astype(str).str.upper().str.replace(" ", "_") != INTEGRATED_ON_TIME
+            else:
+                fallback = table["failure_reason"].astype(str) != MISSING_VALUE
+            table["% Paper Fallback"] = _percentage(count[fallback], pd.Series(total_fallback, index=table.index))
+
+        if "error_code_combination" in by:
+            has_error = table["error_code_combination"].astype(str) != NO_ERROR_CODE
+            table["% of error codes"] = _percentage(count[has_error], pd.Series(count[has_error].sum(), index=table.index))
+
+        return table.sort_values("Number of Transfers", ascending=False, ignore_index=True)
+
+    def save(self, path, fingerprint=""):
+        table = pa.Table.from_pandas(self.cells, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[_FINGERPRINT_METADATA_KEY] = json.dumps(
+            {"fingerprint": fingerprint, "dimensions": self.dimensions}
+        ).encode("utf-8")
+        pq.write_table(table.replace_schema_metadata(metadata), path)
+
+    @classmethod
+    def load(cls, path, fingerprint=""):
+        # Returns None if there is no cube at path or it was built from other inputs
+        try:
+            table = pq.read_table(path)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        stored = json.loads((table.schema.metadata or {}).get(_FINGERPRINT_METADATA_KEY, b"{}"))
+        if stored.get("fingerprint") != fingerprint:
+            return None
+        return cls(table.to_pandas(), stored["dimensions"])
+
+
+def _asid_lookup_fingerprint(asid_lookup):
+    if asid_lookup is None:
+        return None
+    digest = hashlib.sha256(asid_lookup.asids.tobytes())
+    ccgs = asid_lookup.columns["ccg_ods_code"]
+    digest.update(ccgs.codes.tobytes())
+    digest.update("\0".join(map(str, ccgs.categories)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _is_cached(path, use_cache):
+    return use_cache and str(path).startswith("s3://")
+
+
+def _local_transfers_path(path, use_cache):
+    if _is_cached(path, use_cache):
+        return default_cache().local_path(str(path))
+    return str(path)
+
+
+def _cube_fingerprint(local_path, cached, dimensions, date_column, asid_lookup):
+    # Cached copies are named after the object's ETag, so a new upload gets a new
+    # path. Their modification time is left out, as the cache touches it on every
+    # read to track recent use; local files are identified by it as well.
+    stat = os.stat(local_path)
+    file_state = [os.path.realpath(local_path), stat.st_size] + ([] if cached else [stat.st_mtime_ns])
+    return json.dumps(file_state + [list(dimensions), date_column, _asid_lookup_fingerprint(asid_lookup)])
+
+
+def outcome_cube_for_file(path, dimensions=DEFAULT_DIMENSIONS, date_column="date_requested", asid_lookup=None, use_cache=True):
+    # Builds the cube for one transfers file on first use and keeps it next to the
+    # (cached) file, so later roll-ups never rescan the transfers themselves.
+    local_path = _local_transfers_path(path, use_cache)
+    cube_path = local_path + CUBE_SUFFIX
+    fingerprint = _cube_fingerprint(local_path, _is_cached(path, use_cache), dimensions, date_column, asid_lookup)
+    cube = OutcomeCube.load(cube_path, fingerprint)
+    if cube is not None:
+        return cube
+
+    transfers = load_transfer_files([local_path], use_cache=False)
+    if asid_lookup is not None:
+        transfers = asid_lookup.enrich(transfers)
+    cube = OutcomeCube.from_transfers(transfers, dimensions, date_column)
+    try:
+        cube.save(cube_path, fingerprint)
+    except OSError:
+        pass
+    return cube
+
+
+def load_outcome_cube(paths, dimensions=DEFAULT_DIMENSIONS, date_column="date_requested", asid_lookup=None, use_cache=True):
+    return OutcomeCube.combine(
+        outcome_cube_for_file(path, dimensions, date_column, asid_lookup, use_cache)
+        for path in paths
+    )
@@ -1,6 +1,11 @@
 import boto3, json, sys
 import pandas as pd
 
+from data.asid_lookup import AsidLookup
+from data.instrumentation import instrumented
+from data.memoize import memoize
+from data.json_stream import stream_object_arrays
+
 
 def warn(message):
     print(f"Warning: {message}", file=sys.stderr)
@@ -54,9 +59,76 @@ def build_asid_lookup(practice_asids, practice_ccgs):
     return asids.join(ccgs, on='practice_ods_code', how='left')
 
 
-def read_asid_metadata(bucket_name, key):
+class PracticeMetadataColumns:
+    def __init__(self):
+        self.asid = []
+        self.asid_practice_ods_code = []
+        self.practice_name = []
+        self.ccg_practice_ods_code = []
+        self.ccg_ods_code = []
+        self.ccg_name = []
+        self._seen_asids = set()
+        self._seen_practices = set()
+        self.has_duplicate_asid = False
+        self.has_duplicate_practice = False
+
+    def add_practice(self, practice):
+        for asid in practice['asids']:
+            self.has_duplicate_asid |= asid in self._seen_asids
+            self._seen_asids.add(asid)
+            self.asid.append(asid)
+            self.asid_practice_ods_code.append(practice['ods_code'])
+            self.practice_name.append(practice['name'])
+
+    def add_ccg(self, ccg):
+        for practice_ods_code in ccg['practices']:
+            self.has_duplicate_practice |= practice_ods_code in self._seen_practices
+            self._seen_practices.add(practice_ods_code)
+            self.ccg_practice_ods_code.append(practice_ods_code)
+            self.ccg_ods_code.append(ccg['ods_code'])
+            self.ccg_name.append(ccg['name'])
+
+    def practice_asids(self):
+        return pd.DataFrame({
+            'asid': self.asid,
+            'practice_ods_code': self.asid_practice_ods_code,
+            'practice_name': self.practice_name,
+        })
+
+    def practice_ccgs(self):
+        return pd.DataFrame({
+            'practice_ods_code': self.ccg_practice_ods_code,
+            'ccg_ods_code': self.ccg_ods_code,
+            'ccg_name': self.ccg_name,
+        })
+
+
+def read_asid_metadata_from_stream(stream):
+    columns = PracticeMetadataColumns()
+    stream_object_arrays(stream, {
+        'practices': columns.add_practice,
+        'ccgs': columns.add_ccg,
+    })
+
+    if columns.has_duplicate_asid:
+        warn("At least one asid appears to have more than one practice")
+    if columns.has_duplicate_practice:
+        warn("At least one practice appears to have more than one CCG")
+
+    asid_lookup = build_asid_lookup(columns.practice_asids(), columns.practice_ccgs())
+    check_all_asids_have_ccg_metadata(asid_lookup)
+
+    return asid_lookup
+
+
+@memoize(inputs=lambda arguments: [f"s3://{arguments['bucket_name']}/{arguments['key']}"], ignore=["streaming"])
+@instrumented()
+def read_asid_metadata(bucket_name, key, streaming=False):
     s3 = boto3.resource("s3")
     ods_s3_object = s3.Object(bucket_name, key)
+    if streaming:
+        return read_asid_metadata_from_stream(ods_s3_object.get()['Body'])
+
     ods_metadata = read_json(ods_s3_object)
     practice_asids = flatten_practice_asids(ods_metadata)
     practice_ccgs = flatten_practice_ccgs(ods_metadata)
@@ -68,3 +140,7 @@ def read_asid_metadata(bucket_name, key):
     check_all_asids_have_ccg_metadata(asid_lookup) 
     
     return asid_lookup
+
+
+def read_indexed_asid_lookup(bucket_name, key):
+    return AsidLookup.from_asid_metadata(read_asid_metadata(bucket_name, key))
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from urllib.parse import urlparse
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from data.instrumentation import instrumented
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "PRM_SANDBOX_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "prm-gp2gp-data-sandbox"),
+)
+DEFAULT_MAX_CACHE_BYTES = int(os.environ.get("PRM_SANDBOX_CACHE_MAX_BYTES", 20 * 1024 ** 3))
+
+CSV_ROW_GROUP_SIZE = 100_000
+
+
+def parse_s3_url(url):
+    parsed = urlparse(url)
+    if parsed.scheme != "s3":
+        raise ValueError(f"Not an S3 URL: {url}")
+    return parsed.netloc, parsed.path.lstrip("/")
+
+
+def evict_least_recently_used(directory, max_bytes, keep=()):
+    # Entries are touched on every read, so mtime order is least recently used first.
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and not entry.name.startswith("."):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        if path in keep:
+            continue
+        os.remove(path)
+        total_bytes -= size
+        evicted.append(path)
+    return evicted
+
+
+class LocalS3Client:
+    # Directory-backed stand-in for the parts of the boto3 S3 client used here.
+    # Objects live at <root>/<bucket>/<key>; the ETag is the MD5 of the content,
+    # which is what S3 reports for objects uploaded in a single part.
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                md5.update(block)
+        return {"ETag": f'"{md5.hexdigest()}"', "ContentLength": os.path.getsize(path)}
+
+    def download_file(self, Bucket, Key, Filename):
+        shutil.copyfile(self._path(Bucket, Key), Filename)
+
+
+class S3Cache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_CACHE_BYTES, s3_client=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._s3_client = s3_client
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def s3_client(self):
+        if self._s3_client is None:
+            import boto3
+            self._s3_client = boto3.client("s3")
+        return self._s3_client
+
+    def _cache_path(self, bucket, key, etag):
+        digest = hashlib.sha256(f"{bucket}/{key}/{etag}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.parquet")
+
+    def _download_as_parquet(self, bucket, key, cache_path):
+        with tempfile.TemporaryDirectory(dir=self.cache_dir, prefix=".download-") as download_dir:
+            downloaded = os.path.join(download_dir, os.path.basename(key))
+            self.s3_client.download_file(Bucket=bucket, Key=key, Filename=downloaded)
+            if key.endswith(".parquet"):
+                converted = downloaded
+            else:
+                converted = os.path.join(download_dir, "converted.parquet")
+                pd.read_csv(downloaded).to_parquet(converted, index=False, row_group_size=CSV_ROW_GROUP_SIZE)
+            os.replace(converted, cache_path)
+
+    @instrumented("s3_cache")
+    def local_path(self, url):
+        bucket, key = parse_s3_url(url)
+        etag = self.s3_client.head_object(Bucket=bucket, Key=key)["ETag"]
+        cache_path = self._cache_path(bucket, key, etag)
+
+        if os.path.exists(cache_path):
+            os.utime(cache_path)
+        else:
+            self._download_as_parquet(bucket, key, cache_path)
+            evict_least_recently_used(self.cache_dir, self.max_bytes, keep={cache_path})
+        return cache_path
+
+    def read_table(self, url, columns=None, filters=None):
+        return pq.read_table(self.local_path(url), columns=columns, filters=filters)
+
+    def read(self, url, columns=None, filters=None):
+        return self.read_table(url, columns=columns, filters=filters).to_pandas()
+
+    def clear(self):
+        evict_least_recently_used(self.cache_dir, 0)
+
+
+_default_cache = None
+
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = S3Cache()
+    return _default_cache
+
+
+def read_cached(url, columns=None, filters=None):
+    return default_cache().read(url, columns=columns, filters=filters)
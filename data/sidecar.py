@@ -0,0 +1,70 @@
+import hashlib
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from data import DATE
+
+ODS_DATE_FORMAT = "%Y%m%d"
+
+SIDECAR_SUFFIX = ".feather"
+_FINGERPRINT_METADATA_KEY = b"sandbox_source_fingerprint"
+
+
+def source_fingerprint(path, columns, schema):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    digest.update(json.dumps([columns, schema], sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def read_csv_with_schema(path, columns=None, schema=None):
+    schema = schema or {}
+    dtypes = {column: (str if kind == DATE else kind) for column, kind in schema.items()}
+    frame = pd.read_csv(
+        path,
+        names=columns,
+        header=None if columns else "infer",
+        dtype=dtypes,
+    )
+    for column, kind in schema.items():
+        if kind == DATE:
+            frame[column] = pd.to_datetime(frame[column], format=ODS_DATE_FORMAT)
+    return frame
+
+
+def _read_sidecar(sidecar_path, fingerprint):
+    try:
+        with pa.memory_map(sidecar_path) as source:
+            table = pa.ipc.open_file(source).read_all()
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    metadata = table.schema.metadata or {}
+    if metadata.get(_FINGERPRINT_METADATA_KEY) != fingerprint.encode("utf-8"):
+        return None
+    return table.to_pandas()
+
+
+def _write_sidecar(sidecar_path, frame, fingerprint):
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_FINGERPRINT_METADATA_KEY] = fingerprint.encode("utf-8")
+    try:
+        # Uncompressed so the file can be memory-mapped rather than decoded
+        feather.write_feather(table.replace_schema_metadata(metadata), sidecar_path, compression="uncompressed")
+    except OSError:
+        pass
+
+
+def load_with_sidecar(path, columns=None, schema=None):
+    sidecar_path = path + SIDECAR_SUFFIX
+    fingerprint = source_fingerprint(path, columns, schema)
+    frame = _read_sidecar(sidecar_path, fingerprint)
+    if frame is None:
+        frame = read_csv_with_schema(path, columns, schema)
+        _write_sidecar(sidecar_path, frame, fingerprint)
+    return frame
@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data.instrumentation import instrumented
+from data.s3_cache import default_cache
+
+TRANSFERS_PATH_TEMPLATE = (
+    "s3://prm-gp2gp-transfer-data-{environment}/{version}/{year}/{month}/{year}-{month}-transfers.parquet"
+)
+DEFAULT_ENVIRONMENT = "prod"
+DEFAULT_VERSION = "v6"
+DEFAULT_MAX_WORKERS = 8
+
+
+def transfer_paths(months, path_template=TRANSFERS_PATH_TEMPLATE, environment=DEFAULT_ENVIRONMENT, version=DEFAULT_VERSION):
+    return [
+        path_template.format(environment=environment, version=version, year=year, month=month)
+        for year, month in months
+    ]
+
+
+def _read_transfers_file(path, columns, filters, use_cache):
+    if use_cache and path.startswith("s3://"):
+        return default_cache().read_table(path, columns=columns, filters=filters)
+    return pq.read_table(path, columns=columns, filters=filters)
+
+
+@instrumented("load_transfers")
+def load_transfer_files(paths, columns=None, filters=None, max_workers=DEFAULT_MAX_WORKERS, use_cache=True):
+    # Filters use the pyarrow DNF form, e.g. [("status", "=", "TECHNICAL_FAILURE")],
+    # and are checked against row group statistics before any rows are decoded.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        tables = list(executor.map(
+            lambda path: _read_transfers_file(path, columns, filters, use_cache),
+            paths,
+        ))
+
+    # concat_tables only stitches the chunk lists together, and self_destruct releases
+    # each Arrow column as it is converted, so there is no second full copy.
+    transfers = pa.concat_tables(tables, promote=True)
+    del tables
+    return transfers.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def load_transfers(
+        months,
+        columns=None,
+        filters=None,
+        path_template=TRANSFERS_PATH_TEMPLATE,
+        environment=DEFAULT_ENVIRONMENT,
+        version=DEFAULT_VERSION,
+        max_workers=DEFAULT_MAX_WORKERS,
+        use_cache=True,
+):
+    paths = transfer_paths(months, path_template=path_template, environment=environment, version=version)
+    return load_transfer_files(paths, columns=columns, filters=filters, max_workers=max_workers, use_cache=use_cache)
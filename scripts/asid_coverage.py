@@ -1,9 +1,18 @@
+import re
+from glob import glob
 from pathlib import Path
 from datetime import datetime, date
 from dateutil.tz import tzutc
 from sys import argv
+import numpy as np
 import pandas as pd
 
+ASID_CHUNK_SIZE = 1_000_000
+# Month in an export file name, as 2021-03 or as Mar-2021 / March_2021
+NUMERIC_MONTH_PATTERN = re.compile(r"(?<!\d)(\d{4})[-_](\d{2})(?!\d)")
+NAMED_MONTH_PATTERN = re.compile(r"(?<![a-z])([a-z]{3,9})[-_ ]?(\d{4})(?!\d)", re.IGNORECASE)
+
+
 def main(asid_lookup_file_path, message_senders_file_path):
     message_senders_df = pd.read_csv(message_senders_file_path, names=["ASID"], header=0)
     asid_lookup_df = pd.read_csv(asid_lookup_file_path)
@@ -17,10 +26,103 @@ def main(asid_lookup_file_path, message_senders_file_path):
     print(f"{round(percent_in_mapping, 2)}% of the ASIDs from the Splunk query are covered by the ASID lookup CSV")
 
 
-if __name__ == "__main__":
-    asid_lookup_file_path = argv[1]
-    message_senders_file_path = argv[2]
-    main(asid_lookup_file_path, message_senders_file_path)
+def read_sorted_asids(file_path, column=0, chunk_size=ASID_CHUNK_SIZE):
+    # Distinct ASIDs as a sorted int64 array, read one chunk of the one column at a
+    # time. column is a header name or position (sender exports have one column).
+    asids = np.array([], dtype=np.int64)
+    chunks = pd.read_csv(file_path, usecols=[column], dtype=str, chunksize=chunk_size)
+    for chunk in chunks:
+        values = pd.to_numeric(chunk.iloc[:, 0], errors="coerce").dropna().values.astype(np.int64)
+        asids = np.union1d(asids, values)
+    return asids
+
+
+def parse_month(text):
+    # The month named in text as a monthly pd.Period, so months compare in
+    # calendar order whichever way they were written. None if there isn't one.
+    match = NUMERIC_MONTH_PATTERN.search(text)
+    if match and 1 <= int(match.group(2)) <= 12:
+        return pd.Period(year=int(match.group(1)), month=int(match.group(2)), freq="M")
+    for match in NAMED_MONTH_PATTERN.finditer(text):
+        for month_format in ["%b", "%B"]:
+            try:
+                month = datetime.strptime(match.group(1), month_format).month
+            except ValueError:
+                continue
+            return pd.Period(year=int(match.group(2)), month=month, freq="M")
+    return None
+
+
+def file_month(file_path):
+    month = parse_month(Path(file_path).name)
+    if month is None:
+        raise ValueError(f"No month in file name: {file_path}")
+    return month
+
+
+def read_monthly_asids(file_paths, column=0):
+    # Keyed and ordered by the month in each file name
+    paths_by_month = {file_month(file_path): file_path for file_path in file_paths}
+    return {month: read_sorted_asids(paths_by_month[month], column) for month in sorted(paths_by_month)}
+
+
+def coverage_percentage(senders, lookup):
+    if len(senders) == 0:
+        return np.nan
+    return np.isin(senders, lookup, assume_unique=True).sum() / len(senders) * 100
 
 
+def coverage_matrix(senders_by_month, lookups_by_version):
+    # Rows are sender export months, columns are ASID lookup versions
+    return pd.DataFrame(
+        {
+            version: [coverage_percentage(senders, lookup) for senders in senders_by_month.values()]
+            for version, lookup in lookups_by_version.items()
+        },
+        index=pd.Index(list(senders_by_month), name="month"),
+    )
 
+
+def lookup_for_month(month, lookups_by_version):
+    # The latest lookup version published on or before the month, else the
+    # earliest. month is a pd.Period or a string parse_month understands.
+    if isinstance(month, str):
+        month = parse_month(month)
+    versions = sorted(lookups_by_version)
+    earlier = [version for version in versions if version <= month]
+    return lookups_by_version[earlier[-1] if earlier else versions[0]]
+
+
+def newly_uncovered_asids(senders_by_month, lookups_by_version):
+    # ASIDs sending in a month with no entry in that month's lookup, that were
+    # either covered or not sending the month before
+    newly_uncovered = {}
+    previously_uncovered = np.array([], dtype=np.int64)
+    for month in sorted(senders_by_month):
+        senders = senders_by_month[month]
+        uncovered = np.setdiff1d(senders, lookup_for_month(month, lookups_by_version), assume_unique=True)
+        newly_uncovered[month] = np.setdiff1d(uncovered, previously_uncovered, assume_unique=True)
+        previously_uncovered = uncovered
+    return newly_uncovered
+
+
+def main_matrix(asid_lookup_files_glob, message_senders_files_glob):
+    lookups_by_version = read_monthly_asids(glob(asid_lookup_files_glob), column="ASID")
+    senders_by_month = read_monthly_asids(glob(message_senders_files_glob))
+
+    print("% of sending ASIDs covered, by sender month (rows) and ASID lookup version (columns)")
+    print(coverage_matrix(senders_by_month, lookups_by_version).round(2).to_string())
+
+    for month, asids in newly_uncovered_asids(senders_by_month, lookups_by_version).items():
+        print(f"{month}: {len(asids)} newly uncovered ASIDs")
+        for asid in asids:
+            print(asid)
+
+
+if __name__ == "__main__":
+    if argv[1] == "--matrix":
+        main_matrix(argv[2], argv[3])
+    else:
+        asid_lookup_file_path = argv[1]
+        message_senders_file_path = argv[2]
+        main(asid_lookup_file_path, message_senders_file_path)
@@ -0,0 +1,269 @@
+import re
+from pathlib import Path
+from sys import argv
+import duckdb
+
+from scripts.attachments import (
+    ATTACHMENT_METADATA_FILE_PATTERN,
+    GP2GP_MESSAGES_FILE_PATTERN,
+    SPLUNK_LOCAL_TIMESTAMP_FORMAT,
+)
+
+ATHENA_SQL_DIR = Path(__file__).resolve().parent.parent / "athena"
+
+MI_VIEW_SQL_FILES = [
+    "create_fr_view.sql",
+    "create_hr_view.sql",
+    "create_rr_view.sql",
+    "create_sr_view.sql",
+]
+
+# The widest MI record type (SR) has 33 fields
+MI_COLUMN_COUNT = 33
+
+CREATE_REGEXP_LIKE_MACRO_STATEMENT = """
+    CREATE OR REPLACE MACRO regexp_like(field, pattern) AS regexp_matches(field, pattern)
+"""
+
+# DuckDB equivalents of athena/create_deduplicated_attachment_metadata.sql and
+# athena/create_gp2gp_ehr_attachment_summary.sql, over the typed tables built by
+# scripts/attachments.py rather than the raw all-varchar Athena tables.
+CREATE_EHR_MESSAGE_IDS_VIEW_STATEMENT = """
+    CREATE OR REPLACE VIEW gp2gp_attachment_ehr_message_ids AS
+    SELECT DISTINCT internal_id
+    FROM gp2gp_messages
+    WHERE interaction_id='urn:nhs:names:services:gp2gp/RCMR_IN030000UK06';
+"""
+
+CREATE_ATTACHMENTS_VIEW_STATEMENT = """
+    CREATE OR REPLACE VIEW gp2gp_attachments AS
+    SELECT
+        gp2gp_attachment_ehr_message_ids.internal_id,
+        time,
+        attachment_id,
+        conversation_id,
+        from_system,
+        to_system,
+        attachment_type,
+        compressed,
+        content_type,
+        large_attachment,
+        length,
+        original_base64
+    FROM gp2gp_attachment_ehr_message_ids
+    JOIN attachment_metadata
+        ON attachment_metadata.internal_id = gp2gp_attachment_ehr_message_ids.internal_id;
+"""
+
+CREATE_EHR_ATTACHMENT_SUMMARY_VIEW_STATEMENT = """
+    CREATE OR REPLACE VIEW gp2gp_ehr_attachment_summary AS
+    SELECT
+        ids.internal_id,
+        coalesce(attachment_count, 0) AS attachment_count
+    FROM gp2gp_attachment_ehr_message_ids AS ids
+    LEFT JOIN (
+        SELECT internal_id, count(*) AS attachment_count
+        FROM attachment_metadata
+        GROUP BY internal_id
+    ) counts
+        ON ids.internal_id = counts.internal_id;
+"""
+
+ATTACHMENT_OUTPUT_VIEWS = ["gp2gp_attachments", "gp2gp_ehr_attachment_summary"]
+
+# The Athena attachment SQL reads raw all-varchar tables of the Splunk exports.
+# Those keep every row of every export, including rows resent in more than one
+# export, whereas scripts/attachments.py keeps one row per (internal_id,
+# attachment_id) and per message internal_id. So attachment counts from Athena
+# are higher by the number of resent rows. The parity check deduplicates the raw
+# tables the same way before running the Athena SQL, and reports how many rows
+# that removed.
+ATHENA_ATTACHMENT_SQL_FILES = [
+    "create_deduplicated_attachment_metadata.sql",
+    "create_gp2gp_ehr_attachment_summary.sql",
+]
+RAW_ATTACHMENT_TABLES = {
+    "gp2gp_attachment_metadata": (
+        ATTACHMENT_METADATA_FILE_PATTERN,
+        {
+            "_time": "time",
+            "attachmentId": "attachment_id",
+            "conversationID": "conversation_id",
+            "FromSystem": "from_system",
+            "ToSystem": "to_system",
+            "attachmentType": "attachment_type",
+            "compressed": "compressed",
+            "contentType": "content_type",
+            "largeAttachment": "large_attachment",
+            "length": "length",
+            "originalBase64": "original_base64",
+            "internalID": "internal_id",
+        },
+        ["internal_id", "attachment_id"],
+    ),
+    "gp2gp_attachment_messages": (
+        GP2GP_MESSAGES_FILE_PATTERN,
+        {
+            "_time": "time",
+            "conversationID": "conversation_id",
+            "internalID": "internal_id",
+            "interactionID": "interaction_id",
+        },
+        ["internal_id"],
+    ),
+}
+
+# Athena's cast(from_iso8601_timestamp(time) as timestamp) drops the zone and
+# keeps the local wall-clock time, as scripts/attachments.py does, whereas
+# DuckDB's strptime with %z would convert to UTC. So the offset is dropped here.
+CREATE_FROM_ISO8601_TIMESTAMP_MACRO_STATEMENT = f"""
+    CREATE OR REPLACE MACRO from_iso8601_timestamp(field) AS
+    strptime(left(field, 23), '{SPLUNK_LOCAL_TIMESTAMP_FORMAT}')
+"""
+
+
+def create_attachment_views(cursor):
+    cursor.execute(CREATE_EHR_MESSAGE_IDS_VIEW_STATEMENT)
+    cursor.execute(CREATE_ATTACHMENTS_VIEW_STATEMENT)
+    cursor.execute(CREATE_EHR_ATTACHMENT_SUMMARY_VIEW_STATEMENT)
+
+
+def export_bucketed_by_internal_id(cursor, view_name, output_dir):
+    # Athena wrote these with bucket_count = 1 and bucketed_by internal_id, i.e. a
+    # single file per table; sorting keeps each internal_id's rows together as well.
+    output_path = Path(output_dir) / view_name
+    output_path.mkdir(parents=True, exist_ok=True)
+    output_file = output_path / "000000.parquet"
+    cursor.execute(f"""
+        COPY (SELECT * FROM {view_name} ORDER BY internal_id)
+        TO '{output_file}' (FORMAT PARQUET, COMPRESSION SNAPPY);
+    """)
+    return output_file
+
+
+def export_attachment_outputs(cursor, output_dir):
+    create_attachment_views(cursor)
+    return [
+        export_bucketed_by_internal_id(cursor, view_name, output_dir)
+        for view_name in ATTACHMENT_OUTPUT_VIEWS
+    ]
+
+
+def athena_view_statements(sql_file):
+    # The CREATE VIEW statements of an Athena SQL file; the CREATE TABLE ... WITH
+    # statements that write them to S3 are Athena only
+    statements = (ATHENA_SQL_DIR / sql_file).read_text().split(";")
+    return [
+        statement for statement in statements
+        if re.match(r"\s*create\s+or\s+replace\s+view", statement, re.IGNORECASE)
+    ]
+
+
+def load_raw_attachment_tables(cursor, input_data_dirs, deduplicate=True):
+    # The all-varchar tables the Athena SQL reads, from the same export files
+    # scripts/attachments.py ingests. Returns the rows removed per table.
+    removed = {}
+    for table_name, (file_pattern, columns, key) in RAW_ATTACHMENT_TABLES.items():
+        paths = sorted(path for input_data_dir in input_data_dirs for path in Path(input_data_dir).glob(file_pattern))
+        selects = [
+            f"""
+            SELECT {", ".join(f'"{column}" AS {name}' for column, name in columns.items())}
+            FROM read_csv_auto('{path}', all_varchar=TRUE, header=TRUE)
+            """
+            for path in paths
+        ]
+        cursor.execute(f"CREATE OR REPLACE TABLE {table_name} AS {' UNION ALL '.join(selects)}")
+        rows = cursor.execute(f"SELECT count(*) FROM {table_name}").fetchone()[0]
+        if deduplicate:
+            cursor.execute(f"""
+                CREATE OR REPLACE TABLE {table_name} AS
+                SELECT DISTINCT ON ({", ".join(key)}) * FROM {table_name}
+            """)
+        removed[table_name] = rows - cursor.execute(f"SELECT count(*) FROM {table_name}").fetchone()[0]
+    return removed
+
+
+def create_athena_attachment_views(cursor):
+    cursor.execute(CREATE_FROM_ISO8601_TIMESTAMP_MACRO_STATEMENT)
+    for sql_file in ATHENA_ATTACHMENT_SQL_FILES:
+        for statement in athena_view_statements(sql_file):
+            cursor.execute(statement)
+
+
+def attachment_parity(cursor, input_data_dirs):
+    # Runs the Athena attachment SQL unchanged over the raw exports in a separate
+    # in-memory database, and counts the rows of each output view found on only
+    # one side. Every count is zero when the local views match Athena.
+    athena = duckdb.connect()
+    removed = load_raw_attachment_tables(athena, input_data_dirs)
+    create_athena_attachment_views(athena)
+    create_attachment_views(cursor)
+
+    parity = {}
+    for view_name in ATTACHMENT_OUTPUT_VIEWS:
+        cursor.register("athena_rows", athena.execute(f"SELECT * FROM {view_name}").df())
+        only_local, only_athena = [
+            cursor.execute(f"SELECT count(*) FROM (SELECT * FROM {left} EXCEPT ALL SELECT * FROM {right})").fetchone()[0]
+            for left, right in [(view_name, "athena_rows"), ("athena_rows", view_name)]
+        ]
+        cursor.unregister("athena_rows")
+        parity[view_name] = {"only_local": only_local, "only_athena": only_athena}
+    athena.close()
+    return parity, removed
+
+
+def load_raw_mi_statement(mi_files_glob, delimiter=","):
+    columns = ",\n".join(
+        f"list_extract(fields, {i}) AS col{i}" for i in range(1, MI_COLUMN_COUNT + 1)
+    )
+    # MI records have a different number of fields per record type, so each line
+    # is read whole and split, as the Athena raw_mi table does.
+    return f"""
+        CREATE OR REPLACE TABLE raw_mi AS
+        SELECT
+            {columns},
+            filename AS "$path"
+        FROM (
+            SELECT string_split(line, '{delimiter}') AS fields, filename
+            FROM read_csv('{mi_files_glob}', columns={{'line': 'VARCHAR'}},
+                          delim='\x1f', quote='', escape='', header=FALSE, filename=TRUE)
+        );
+    """
+
+
+def create_mi_views(cursor, mi_files_glob):
+    cursor.execute(CREATE_REGEXP_LIKE_MACRO_STATEMENT)
+    cursor.execute(load_raw_mi_statement(mi_files_glob))
+    for sql_file in MI_VIEW_SQL_FILES:
+        cursor.execute((ATHENA_SQL_DIR / sql_file).read_text())
+
+
+def run_athena_sql_file(cursor, sql_file):
+    cursor.execute(CREATE_REGEXP_LIKE_MACRO_STATEMENT)
+    return cursor.execute((ATHENA_SQL_DIR / sql_file).read_text()).df()
+
+
+def main():
+    # <database file> <output dir> | parity <database file> <attachment data dirs...>
+    if argv[1] == "parity":
+        cursor = duckdb.connect(argv[2])
+        parity, removed = attachment_parity(cursor, argv[3:])
+        for table_name, rows in removed.items():
+            print(f"{rows} resent rows in the raw {table_name} exports, counted by Athena but not locally")
+        for view_name, counts in parity.items():
+            print(f"{view_name}: {counts['only_local']} rows only local, {counts['only_athena']} rows only in Athena SQL")
+        cursor.close()
+        if any(any(counts.values()) for counts in parity.values()):
+            raise SystemExit(1)
+        return
+
+    database_file = argv[1]
+    output_dir = argv[2]
+    cursor = duckdb.connect(database_file)
+    for output_file in export_attachment_outputs(cursor, output_dir):
+        print(f"Written {output_file}")
+    cursor.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import math
+from sys import argv
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from data.instrumentation import stage
+from scripts.attachments import create_attachments_schema
+
+# Sizes are counted in logarithmic buckets (as in DDSketch), so any quantile
+# read back is within RELATIVE_ACCURACY of a true attachment size, and the
+# sketches for two months merge by adding bucket counts. Unlike t-digest or KLL,
+# that merge is a SQL SUM, so merged sketches never leave DuckDB.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+# Zero-byte attachments have no logarithm and get a bucket of their own
+ZERO_BUCKET = -1
+
+# Exact counts of attachments over each limit: large messaging, and the TPP
+# attachment limit before and after it was raised
+SIZE_LIMITS_MB = [5, 60, 100]
+DEFAULT_QUANTILES = [0.5, 0.9, 0.99]
+STATS_DIMENSIONS = ["from_system", "to_system", "content_type"]
+
+_MB = 1024 * 1024
+
+
+def limit_column(limit_mb):
+    return f"over_{limit_mb}mb"
+
+
+def bucket_expression(column):
+    return f"CASE WHEN {column} <= 0 THEN {ZERO_BUCKET} ELSE CAST(ceil(ln({column}) / {math.log(GAMMA)!r}) AS INTEGER) END"
+
+
+def bucket_values(buckets):
+    # The size each bucket stands for, within RELATIVE_ACCURACY of every size in it
+    buckets = np.asarray(buckets, dtype=np.float64)
+    return np.where(buckets == ZERO_BUCKET, 0.0, 2 * GAMMA ** buckets / (GAMMA + 1))
+
+
+CREATE_SIZE_STATS_TABLE_STATEMENT = f"""
+    CREATE TABLE IF NOT EXISTS attachment_size_stats (
+            month DATE,
+            from_system VARCHAR,
+            to_system VARCHAR,
+            content_type VARCHAR,
+            attachments BIGINT,
+            unknown_length BIGINT,
+            total_bytes HUGEINT,
+            min_bytes BIGINT,
+            max_bytes BIGINT,
+            large_attachments BIGINT,
+            {", ".join(f"{limit_column(limit)} BIGINT" for limit in SIZE_LIMITS_MB)}
+    );
+"""
+
+CREATE_SIZE_SKETCH_TABLE_STATEMENT = """
+    CREATE TABLE IF NOT EXISTS attachment_size_sketch (
+            month DATE,
+            from_system VARCHAR,
+            to_system VARCHAR,
+            content_type VARCHAR,
+            bucket INTEGER,
+            count BIGINT
+    );
+"""
+
+ATTACHMENT_MONTHS_STATEMENT = """
+    SELECT DISTINCT strftime(date_trunc('month', time), '%Y-%m') AS month
+    FROM attachment_metadata
+    WHERE time IS NOT NULL
+    ORDER BY month
+"""
+
+
+def _month_filter(month):
+    return f"date_trunc('month', time) = strptime('{month}', '%Y-%m')"
+
+
+def insert_size_stats_statement(month):
+    return f"""
+        INSERT INTO attachment_size_stats
+        SELECT
+            date_trunc('month', time) AS month,
+            from_system,
+            to_system,
+            content_type,
+            count(*) AS attachments,
+            count(*) - count(length) AS unknown_length,
+            sum(length) AS total_bytes,
+            min(length) AS min_bytes,
+            max(length) AS max_bytes,
+            count(*) FILTER (WHERE large_attachment) AS large_attachments,
+            {", ".join(
+                f"count(*) FILTER (WHERE length > {limit * _MB}) AS {limit_column(limit)}"
+                for limit in SIZE_LIMITS_MB
+            )}
+        FROM attachment_metadata
+        WHERE {_month_filter(month)}
+        GROUP BY ALL;
+    """
+
+
+def insert_size_sketch_statement(month):
+    return f"""
+        INSERT INTO attachment_size_sketch
+        SELECT
+            date_trunc('month', time) AS month,
+            from_system,
+            to_system,
+            content_type,
+            {bucket_expression("length")} AS bucket,
+            count(*) AS count
+        FROM attachment_metadata
+        WHERE {_month_filter(month)} AND length IS NOT NULL
+        GROUP BY ALL;
+    """
+
+
+def create_size_stats_schema(cursor):
+    create_attachments_schema(cursor)
+    cursor.execute(CREATE_SIZE_STATS_TABLE_STATEMENT)
+    cursor.execute(CREATE_SIZE_SKETCH_TABLE_STATEMENT)
+
+
+def attachment_months(cursor):
+    return [month for (month,) in cursor.execute(ATTACHMENT_MONTHS_STATEMENT).fetchall()]
+
+
+def summarised_months(cursor):
+    return [
+        month for (month,) in cursor.execute(
+            "SELECT DISTINCT strftime(month, '%Y-%m') AS month FROM attachment_size_stats ORDER BY month"
+        ).fetchall()
+    ]
+
+
+def summarise_month(cursor, month):
+    # Replaces the month's counters and sketches, so re-running after more
+    # attachment files for the month are ingested is safe
+    with stage("summarise_attachment_sizes"):
+        cursor.execute("BEGIN TRANSACTION")
+        try:
+            for table in ["attachment_size_stats", "attachment_size_sketch"]:
+                cursor.execute(f"DELETE FROM {table} WHERE month = strptime('{month}', '%Y-%m')")
+            cursor.execute(insert_size_stats_statement(month))
+            cursor.execute(insert_size_sketch_statement(month))
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+
+def summarise_attachment_sizes(cursor, months=None):
+    # months as YYYY-MM; by default every month in attachment_metadata
+    create_size_stats_schema(cursor)
+    months = attachment_months(cursor) if months is None else months
+    for month in months:
+        summarise_month(cursor, month)
+    return months
+
+
+def _where_clause(months, filters):
+    conditions, parameters = [], []
+    if months is not None:
+        conditions.append(f"strftime(month, '%Y-%m') IN ({', '.join('?' for _ in months)})")
+        parameters.extend(months)
+    for column, value in filters.items():
+        if column not in STATS_DIMENSIONS:
+            raise ValueError(f"Unknown attachment size dimension: {column}")
+        conditions.append(f"{column} = ?")
+        parameters.append(value)
+    return ("WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+
+def _group_columns(by):
+    for column in by:
+        if column not in STATS_DIMENSIONS + ["month"]:
+            raise ValueError(f"Unknown attachment size dimension: {column}")
+    return list(by)
+
+
+def size_counters(cursor, months=None, by=(), **filters):
+    # Exact counters merged over the chosen months and filters, e.g.
+    # size_counters(cursor, months, from_system="SystmOne", to_system="EMIS Web")
+    by = _group_columns(by)
+    where, parameters = _where_clause(months, filters)
+    select_by = "".join(f"{column}, " for column in by)
+    group_by = f"GROUP BY {', '.join(by)} ORDER BY {', '.join(by)}" if by else ""
+    counters = cursor.execute(
+        f"""
+        SELECT
+            {select_by}
+            sum(attachments) AS attachments,
+            sum(unknown_length) AS unknown_length,
+            CAST(sum(total_bytes) AS DOUBLE) AS total_bytes,
+            min(min_bytes) AS min_bytes,
+            max(max_bytes) AS max_bytes,
+            sum(large_attachments) AS large_attachments,
+            {", ".join(f"sum({limit_column(limit)}) AS {limit_column(limit)}" for limit in SIZE_LIMITS_MB)}
+        FROM attachment_size_stats
+        {where}
+        {group_by}
+        """,
+        parameters,
+    ).df()
+    known_length = counters["attachments"] - counters["unknown_length"]
+    counters["mean_bytes"] = counters["total_bytes"] / known_length.where(known_length > 0)
+    for limit in SIZE_LIMITS_MB:
+        counters[f"{limit_column(limit)}_rate"] = counters[limit_column(limit)] / known_length.where(known_length > 0)
+    return counters
+
+
+def _quantiles_from_buckets(buckets, counts, quantiles):
+    cumulative = np.cumsum(counts)
+    if len(cumulative) == 0 or cumulative[-1] == 0:
+        return [np.nan] * len(quantiles)
+    ranks = np.asarray(quantiles) * (cumulative[-1] - 1)
+    positions = np.searchsorted(cumulative, ranks, side="right")
+    return list(bucket_values(buckets[positions]))
+
+
+def size_quantiles(cursor, quantiles=DEFAULT_QUANTILES, months=None, by=(), **filters):
+    # Approximate attachment size quantiles in bytes, from the merged sketches
+    by = _group_columns(by)
+    where, parameters = _where_clause(months, filters)
+    select_by = "".join(f"{column}, " for column in by)
+    merged = cursor.execute(
+        f"""
+        SELECT {select_by} bucket, sum(count) AS count
+        FROM attachment_size_sketch
+        {where}
+        GROUP BY ALL
+        ORDER BY ALL
+        """,
+        parameters,
+    ).df()
+
+    columns = [f"p{round(quantile * 100, 3):g}" for quantile in quantiles]
+    # A single grouper is passed on its own, as pandas warns that iterating over a
+    # groupby on a one item list will change to yield 1-tuples
+    grouper = by[0] if len(by) == 1 else by
+    groups = merged.groupby(grouper, sort=True, dropna=False, observed=True, group_keys=False) if by else [((), merged)]
+    rows = []
+    for key, group in groups:
+        key = key if isinstance(key, tuple) else (key,)
+        values = _quantiles_from_buckets(group["bucket"].values, group["count"].values, quantiles)
+        rows.append(list(key) + values)
+    result = pd.DataFrame(rows, columns=by + columns)
+    return result.set_index(by) if by else result
+
+
+def size_stats(cursor, quantiles=DEFAULT_QUANTILES, months=None, by=(), **filters):
+    counters = size_counters(cursor, months, by, **filters)
+    sizes = size_quantiles(cursor, quantiles, months, by, **filters)
+    if by:
+        return counters.set_index(list(by)).join(sizes)
+    return pd.concat([counters, sizes], axis=1)
+
+
+def main():
+    database_file, months = argv[1], argv[2:] or None
+    cursor = duckdb.connect(database_file)
+    summarised = summarise_attachment_sizes(cursor, months)
+    print(f"Summarised attachment sizes for {len(summarised)} months")
+    print(size_stats(cursor, by=["from_system", "to_system"]).to_string())
+    cursor.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
+import gzip
+import hashlib
+import warnings
 from pathlib import Path
 from sys import argv
 import duckdb
 
+from data.instrumentation import stage
+
 CREATE_ATTACHMENT_METADATA_TABLE_STATEMENT = """
-    CREATE TABLE attachment_metadata (
+    CREATE TABLE IF NOT EXISTS attachment_metadata (
             time TIMESTAMP,
             attachment_id VARCHAR,
             conversation_id VARCHAR,
@@ -13,14 +18,14 @@ CREATE_ATTACHMENT_METADATA_TABLE_STATEMENT = """
             compressed BOOLEAN,
             content_type VARCHAR,
             large_attachment BOOLEAN,
-            length INT,
+            length BIGINT,
             original_base64 BOOLEAN,
             internal_id VARCHAR
     );
 """
 
 CREATE_GP2GP_MESSAGES_TABLE_STATEMENT = """
-    CREATE TABLE gp2gp_messages (
+    CREATE TABLE IF NOT EXISTS gp2gp_messages (
             time TIMESTAMP,
             conversation_id VARCHAR,
             internal_id VARCHAR,
@@ -28,70 +33,231 @@ CREATE_GP2GP_MESSAGES_TABLE_STATEMENT = """
     );
 """
 
+CREATE_INGESTED_FILES_TABLE_STATEMENT = """
+    CREATE TABLE IF NOT EXISTS ingested_files (
+            path VARCHAR,
+            size BIGINT,
+            sha256 VARCHAR,
+            table_name VARCHAR,
+            loaded_at TIMESTAMP
+    );
+"""
+
 CREATE_YES_NO_MACRO_STATEMENT = """
-    CREATE MACRO yes_no_to_bool(field) AS
+    CREATE OR REPLACE MACRO yes_no_to_bool(field) AS
     CASE WHEN field='Yes' THEN TRUE WHEN field='No' THEN FALSE ELSE NULL END
 """
 
-CREATE_OPTIONAL_INT_MACRO_STATEMENT = """
-    CREATE MACRO optional_int(field) AS
-    CASE WHEN field='Unknown' THEN NULL ELSE CAST(field AS INT) END
+CREATE_CSV_TEXT_MACRO_STATEMENT = """
+    CREATE OR REPLACE MACRO csv_text(field) AS
+    CASE WHEN field IS NULL THEN 'Unknown' WHEN field='' THEN NULL ELSE field END
 """
 
+CREATE_INDEX_STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS attachment_metadata_conversation_id ON attachment_metadata (conversation_id);",
+    "CREATE INDEX IF NOT EXISTS attachment_metadata_internal_id ON attachment_metadata (internal_id);",
+    "CREATE INDEX IF NOT EXISTS gp2gp_messages_conversation_id ON gp2gp_messages (conversation_id);",
+    "CREATE INDEX IF NOT EXISTS gp2gp_messages_internal_id ON gp2gp_messages (internal_id);",
+]
+
+# Splunk export columns and the type each is parsed as on read. Exports write
+# Unknown for a missing value, so files are read with that as the null string and
+# csv_text gives text columns their literal Unknown back (and empty text is NULL,
+# as it was before columns were typed). DuckDB can't parse Yes/No as BOOLEAN, so
+# those are read as text and converted by yes_no_to_bool. _time is read as text
+# too: parsing its UTC offset would convert it to UTC, whereas time keeps
+# Splunk's local wall-clock time (so BST rows stay in the hour and month they
+# were exported in) by dropping the offset first.
+SPLUNK_LOCAL_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%g"
+CSV_NULL_STRING = "Unknown"
+
+ATTACHMENT_METADATA_CSV_COLUMNS = {
+    "_time": "VARCHAR",
+    "attachmentId": "VARCHAR",
+    "conversationID": "VARCHAR",
+    "FromSystem": "VARCHAR",
+    "ToSystem": "VARCHAR",
+    "attachmentType": "VARCHAR",
+    "compressed": "VARCHAR",
+    "contentType": "VARCHAR",
+    "largeAttachment": "VARCHAR",
+    "length": "BIGINT",
+    "originalBase64": "VARCHAR",
+    "internalID": "VARCHAR",
+}
+
+GP2GP_MESSAGES_CSV_COLUMNS = {
+    "_time": "VARCHAR",
+    "conversationID": "VARCHAR",
+    "internalID": "VARCHAR",
+    "interactionID": "VARCHAR",
+}
+
+ATTACHMENT_METADATA_FILE_PATTERN = "attachment_metadata*.csv*"
+GP2GP_MESSAGES_FILE_PATTERN = "gp2gp_messages*.csv*"
+
+
+def _read_header(filename):
+    opener = gzip.open if str(filename).endswith(".gz") else open
+    with opener(filename, "rt") as f:
+        return [column.strip().strip('"') for column in f.readline().rstrip("\r\n").split(",")]
+
+
+def read_csv_expression(filename, column_types):
+    # Columns are declared in the file's own header order, so no type sniffing pass
+    # is needed and an unexpected export layout fails on load rather than later.
+    columns = ", ".join(
+        f"'{column}': '{column_types.get(column, 'VARCHAR')}'"
+        for column in _read_header(filename)
+    )
+    return f"read_csv('{filename}', header=TRUE, nullstr='{CSV_NULL_STRING}', columns={{{columns}}})"
+
 
 # TODO: Rewrite using relation api?
 def load_attachment_metadata_statement(filename):
     return f"""
         INSERT INTO attachment_metadata
-        SELECT
-            strptime(left(_time, 23), '%Y-%m-%dT%H:%M:%S.%g') as time,
-            attachmentId as attachment_id,
-            conversationID as conversation_id,
-            FromSystem as from_system,
-            ToSystem as to_system,
-            attachmentType as attachment_type,
-            yes_no_to_bool(compressed) as compressed,
-            contentType as content_type,
-            yes_no_to_bool(largeAttachment) as large_attachment,
-            optional_int(length) as length,
-            yes_no_to_bool(originalBase64) as original_base64,
-            internalID as internal_id
-        FROM read_csv_auto('{filename}', all_varchar=TRUE);
+        SELECT DISTINCT ON (internal_id, attachment_id) *
+        FROM (
+            SELECT
+                strptime(left(_time, 23), '{SPLUNK_LOCAL_TIMESTAMP_FORMAT}') as time,
+                csv_text(attachmentId) as attachment_id,
+                csv_text(conversationID) as conversation_id,
+                csv_text(FromSystem) as from_system,
+                csv_text(ToSystem) as to_system,
+                csv_text(attachmentType) as attachment_type,
+                yes_no_to_bool(compressed) as compressed,
+                csv_text(contentType) as content_type,
+                yes_no_to_bool(largeAttachment) as large_attachment,
+                length,
+                yes_no_to_bool(originalBase64) as original_base64,
+                csv_text(internalID) as internal_id
+            FROM {read_csv_expression(filename, ATTACHMENT_METADATA_CSV_COLUMNS)}
+        ) new_rows
+        WHERE NOT EXISTS (
+            SELECT 1 FROM attachment_metadata existing
+            WHERE existing.internal_id IS NOT DISTINCT FROM new_rows.internal_id
+            AND existing.attachment_id IS NOT DISTINCT FROM new_rows.attachment_id
+        );
     """
 
 
 def load_gp2gp_messages_statement(filename):
     return f"""
         INSERT INTO gp2gp_messages
-        SELECT
-            strptime(left(_time, 23), '%Y-%m-%dT%H:%M:%S.%g') as time,
-            conversationID as conversation_id,
-            internalID as internal_id,
-            interactionID as interaction_id
-        FROM read_csv_auto('{filename}', all_varchar=TRUE, header=TRUE);
+        SELECT DISTINCT ON (internal_id) *
+        FROM (
+            SELECT
+                strptime(left(_time, 23), '{SPLUNK_LOCAL_TIMESTAMP_FORMAT}') as time,
+                csv_text(conversationID) as conversation_id,
+                csv_text(internalID) as internal_id,
+                csv_text(interactionID) as interaction_id
+            FROM {read_csv_expression(filename, GP2GP_MESSAGES_CSV_COLUMNS)}
+        ) new_rows
+        WHERE NOT EXISTS (
+            SELECT 1 FROM gp2gp_messages existing
+            WHERE existing.internal_id IS NOT DISTINCT FROM new_rows.internal_id
+        );
     """
 
 
-def construct_attachments_db(cursor, input_data_dir):
-    input_data_dir_path = Path(input_data_dir)
+def file_fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return path.stat().st_size, digest.hexdigest()
+
+
+def ingested_paths(cursor, sha256, table_name):
+    return [row[0] for row in cursor.execute(
+        "SELECT DISTINCT path FROM ingested_files WHERE sha256 = ? AND table_name = ?",
+        [sha256, table_name],
+    ).fetchall()]
 
+
+def previous_fingerprints(cursor, path, table_name):
+    return [row[0] for row in cursor.execute(
+        "SELECT DISTINCT sha256 FROM ingested_files WHERE path = ? AND table_name = ?",
+        [str(path), table_name],
+    ).fetchall()]
+
+
+def record_ingested_file(cursor, path, size, sha256, table_name):
+    cursor.execute(
+        "INSERT INTO ingested_files VALUES (?, ?, ?, ?, current_timestamp)",
+        [str(path), size, sha256, table_name],
+    )
+
+
+def ingest_file(cursor, path, table_name, load_statement):
+    # Files are skipped when their contents were loaded before under any path.
+    # Every path is recorded, so a path that comes back with new contents (e.g.
+    # a re-export) is reported and its new rows loaded; rows already in the table
+    # are left out by the load statement.
+    size, sha256 = file_fingerprint(path)
+    paths = ingested_paths(cursor, sha256, table_name)
+    if paths:
+        if str(path) not in paths:
+            record_ingested_file(cursor, path, size, sha256, table_name)
+        return False
+
+    if previous_fingerprints(cursor, path, table_name):
+        warnings.warn(f"{path} has changed since it was ingested into {table_name}; loading its new rows")
+
+    with stage(f"ingest_{table_name}"):
+        cursor.execute("BEGIN TRANSACTION")
+        try:
+            cursor.execute(load_statement(path))
+            record_ingested_file(cursor, path, size, sha256, table_name)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    return True
+
+
+def create_attachments_schema(cursor):
     cursor.execute(CREATE_YES_NO_MACRO_STATEMENT)
-    cursor.execute(CREATE_OPTIONAL_INT_MACRO_STATEMENT)
+    cursor.execute(CREATE_CSV_TEXT_MACRO_STATEMENT)
     cursor.execute(CREATE_ATTACHMENT_METADATA_TABLE_STATEMENT)
     cursor.execute(CREATE_GP2GP_MESSAGES_TABLE_STATEMENT)
+    cursor.execute(CREATE_INGESTED_FILES_TABLE_STATEMENT)
+
+
+def create_attachments_indexes(cursor):
+    for statement in CREATE_INDEX_STATEMENTS:
+        cursor.execute(statement)
+
 
-    attachments_data_file = input_data_dir_path / "attachment_metadata.csv"
-    cursor.execute(load_attachment_metadata_statement(attachments_data_file))
+def ingest_attachments_data(cursor, input_data_dirs):
+    create_attachments_schema(cursor)
 
-    gp2gp_messages_data_file = input_data_dir_path / "gp2gp_messages.csv"
-    cursor.execute(load_gp2gp_messages_statement(gp2gp_messages_data_file))
+    ingested = []
+    for input_data_dir in input_data_dirs:
+        input_data_dir_path = Path(input_data_dir)
+        for path in sorted(input_data_dir_path.glob(ATTACHMENT_METADATA_FILE_PATTERN)):
+            if ingest_file(cursor, path, "attachment_metadata", load_attachment_metadata_statement):
+                ingested.append(path)
+        for path in sorted(input_data_dir_path.glob(GP2GP_MESSAGES_FILE_PATTERN)):
+            if ingest_file(cursor, path, "gp2gp_messages", load_gp2gp_messages_statement):
+                ingested.append(path)
+
+    # Created once the first files are in, as maintaining them during a bulk load is slow
+    create_attachments_indexes(cursor)
+    return ingested
+
+
+def construct_attachments_db(cursor, input_data_dir):
+    return ingest_attachments_data(cursor, [input_data_dir])
 
 
 def main():
-    input_data_dir = argv[1]
-    database_file = argv[2]
+    input_data_dirs = argv[1:-1]
+    database_file = argv[-1]
     cursor = duckdb.connect(database_file)
-    construct_attachments_db(cursor, input_data_dir)
+    ingested = ingest_attachments_data(cursor, input_data_dirs)
+    print(f"Ingested {len(ingested)} new files")
     cursor.close()
 
 
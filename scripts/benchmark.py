@@ -0,0 +1,228 @@
+import argparse
+import json
+import multiprocessing
+import resource
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+
+from dateutil.relativedelta import relativedelta
+from dateutil.tz import tzutc
+
+from scripts.synthetic_data import (
+    DEFAULT_START,
+    SyntheticConfig,
+    expected_messages_per_conversation,
+    write_attachment_csv_files,
+    write_ods_metadata_json,
+    write_spine_csv_gz_files,
+)
+
+# Number of Spine messages to generate at each scale
+SCALES = {
+    "10k": 10_000,
+    "1M": 1_000_000,
+    "10M": 10_000_000,
+}
+
+DEFAULT_WORK_DIR = Path("benchmark-data")
+DEFAULT_RESULTS_FILE = Path("benchmark-results.json")
+REGRESSION_THRESHOLD = 1.1
+
+
+def _metric_month_range():
+    from prmdata.utils.date.range import DateTimeRange
+    return DateTimeRange(DEFAULT_START, DEFAULT_START + relativedelta(months=1))
+
+
+def run_calculate_counts(inputs):
+    from scripts.gp2gp_spine_outcomes import calculate_counts
+    month_file, next_month_file = inputs["spine_files"][:2]
+    calculate_counts.uncached(str(month_file), str(next_month_file), _metric_month_range())
+
+
+def run_gp2gp_variations(inputs):
+    from scripts.gp2gp_variations import count_patterns
+    count_patterns(inputs["spine_files"][:2], _metric_month_range())
+
+
+def run_transfers_exceeding_24h(inputs):
+    from scripts.transfers_exceeding_24h import find_transfers_exceeding_24h
+    find_transfers_exceeding_24h(inputs["spine_files"][:1])
+
+
+def run_spine_columnar(inputs):
+    from scripts.spine_columnar import conversation_metrics, pattern_counts, read_spine_table
+    table = read_spine_table(inputs["spine_files"][:2])
+    conversation_metrics(table)
+    pattern_counts(table, _metric_month_range())
+
+
+def run_construct_attachments_db(inputs):
+    import duckdb
+    from scripts.attachments import construct_attachments_db
+    cursor = duckdb.connect()
+    construct_attachments_db(cursor, inputs["attachments_dir"])
+    cursor.close()
+
+
+def run_read_asid_metadata(inputs):
+    from data.practice_metadata import read_asid_metadata_from_stream
+    with open(inputs["ods_metadata_file"], "rb") as f:
+        read_asid_metadata_from_stream(f)
+
+
+def _spine_messages_in(file_count):
+    return lambda inputs: sum(inputs["counts"]["spine_messages"][:file_count])
+
+
+# Entry point -> (function, number of items it processes for throughput)
+ENTRY_POINTS = {
+    "calculate_counts": (run_calculate_counts, _spine_messages_in(2)),
+    "gp2gp_variations": (run_gp2gp_variations, _spine_messages_in(2)),
+    "transfers_exceeding_24h": (run_transfers_exceeding_24h, _spine_messages_in(1)),
+    "spine_columnar": (run_spine_columnar, _spine_messages_in(2)),
+    "construct_attachments_db": (run_construct_attachments_db, lambda inputs: inputs["counts"]["attachments"]),
+    "read_asid_metadata": (run_read_asid_metadata, lambda inputs: inputs["counts"]["practices"]),
+}
+
+
+def prepare_inputs(scale, work_dir=DEFAULT_WORK_DIR, seed=0):
+    # Generated once per scale and seed, then reused by later runs
+    scale_dir = Path(work_dir) / f"{scale}-seed-{seed}"
+    manifest_path = scale_dir / "manifest.json"
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        # Inputs generated when scales counted conversations rather than messages
+        # are regenerated
+        if manifest.get("scale_messages") == SCALES[scale]:
+            return manifest
+
+    # Conversations are sized from the generator's mean messages per conversation,
+    # and the manifest records the number of messages actually generated
+    messages_per_conversation = expected_messages_per_conversation(SyntheticConfig(0, seed=seed))
+    conversation_count = round(SCALES[scale] / messages_per_conversation)
+    config = SyntheticConfig(conversation_count, seed=seed)
+    spine_files, spine_message_counts = write_spine_csv_gz_files(config, scale_dir / "spine")
+    attachments_dir, attachment_count = write_attachment_csv_files(config, scale_dir / "attachments")
+    practice_count = max(conversation_count // 50, 100)
+    ods_metadata_file = write_ods_metadata_json(scale_dir / "ods_metadata.json", practice_count=practice_count, seed=seed)
+
+    manifest = {
+        "scale_messages": SCALES[scale],
+        "spine_files": [str(path) for path in spine_files],
+        "attachments_dir": str(attachments_dir),
+        "ods_metadata_file": str(ods_metadata_file),
+        "counts": {
+            "spine_messages": spine_message_counts,
+            "attachments": attachment_count,
+            "practices": practice_count,
+        },
+    }
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def _measure(entry_point, inputs, results):
+    function, _ = ENTRY_POINTS[entry_point]
+    started = time.perf_counter()
+    function(inputs)
+    wall_seconds = time.perf_counter() - started
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    results.put({
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+    })
+
+
+def run_entry_point(entry_point, inputs):
+    # Each run gets a fresh interpreter so peak RSS belongs to that entry point alone
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(entry_point, inputs, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"{entry_point} failed with exit code {process.exitcode}")
+    measurement = results.get()
+
+    _, items = ENTRY_POINTS[entry_point]
+    item_count = items(inputs)
+    measurement["items"] = item_count
+    measurement["items_per_second"] = item_count / measurement["wall_seconds"]
+    return measurement
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(results_file):
+    results_file = Path(results_file)
+    return json.loads(results_file.read_text()) if results_file.exists() else []
+
+
+def save_results(results_file, runs):
+    Path(results_file).write_text(json.dumps(runs, indent=2))
+
+
+def previous_run(runs, entry_point, scale):
+    matching = [run for run in runs if run["entry_point"] == entry_point and run["scale"] == scale]
+    return matching[-1] if matching else None
+
+
+def compare(current, previous):
+    if previous is None:
+        return "no previous run"
+    ratio = current["wall_seconds"] / previous["wall_seconds"]
+    label = "REGRESSION" if ratio > REGRESSION_THRESHOLD else "ok"
+    return f"{ratio:.2f}x wall time vs {previous['revision'] or 'previous run'} ({label})"
+
+
+def run_benchmarks(entry_points, scales, work_dir=DEFAULT_WORK_DIR, results_file=DEFAULT_RESULTS_FILE, seed=0):
+    runs = load_results(results_file)
+    revision = _git_revision()
+
+    for scale in scales:
+        inputs = prepare_inputs(scale, work_dir, seed)
+        for entry_point in entry_points:
+            measurement = run_entry_point(entry_point, inputs)
+            run = {
+                "entry_point": entry_point,
+                "scale": scale,
+                "seed": seed,
+                "revision": revision,
+                "recorded_at": datetime.now(tzutc()).isoformat(),
+                **measurement,
+            }
+            comparison = compare(run, previous_run(runs, entry_point, scale))
+            print(
+                f"{entry_point} [{scale}]: {run['wall_seconds']:.2f}s, "
+                f"{run['peak_rss_mb']:.0f}MB peak RSS, {run['items_per_second']:.0f} items/s - {comparison}"
+            )
+            runs.append(run)
+            save_results(results_file, runs)
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sandbox pipelines on synthetic data")
+    parser.add_argument("--entry-points", nargs="+", default=list(ENTRY_POINTS), choices=list(ENTRY_POINTS))
+    parser.add_argument("--scales", nargs="+", default=["10k"], choices=list(SCALES))
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR)
+    parser.add_argument("--results-file", default=DEFAULT_RESULTS_FILE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run_benchmarks(args.entry_points, args.scales, args.work_dir, args.results_file, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import json
+from itertools import groupby
+from pathlib import Path
+from sys import argv
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from data.instrumentation import stage
+from scripts.spine_stream import SPINE_PARQUET_SCHEMA, _split_idle_conversation, _splunk_items_from_table
+
+# Kept at the root of a scripts/spine_to_parquet.py output directory. Part files
+# are sorted by conversation ID, so each conversation is one run of rows per part
+# and the index only records where each run starts and how long it is.
+INDEX_FILE_NAME = "_conversation_index.parquet"
+_FILES_METADATA_KEY = b"sandbox_indexed_files"
+
+INDEX_SCHEMA = pa.schema([
+    ("conversation_id", pa.string()),
+    ("file", pa.int32()),
+    ("start", pa.int64()),
+    ("length", pa.int64()),
+])
+
+
+class StaleConversationIndex(Exception):
+    pass
+
+
+def _part_files(parquet_dir):
+    return sorted(Path(parquet_dir).glob("month=*/bucket=*/*.parquet"))
+
+
+def _file_state(parquet_dir, path):
+    stat = path.stat()
+    return {"path": str(path.relative_to(parquet_dir)), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _conversation_runs(conversation_ids):
+    # Start and length of each run of equal IDs in a sorted column
+    ids = conversation_ids.to_numpy()
+    if len(ids) == 0:
+        return ids, np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]]))
+    lengths = np.diff(np.append(starts, len(ids)))
+    return ids[starts], starts, lengths
+
+
+def build_conversation_index(parquet_dir):
+    # Reads only the conversation_id column of every part file
+    parquet_dir = Path(parquet_dir)
+    files, tables = [], []
+    with stage("build_conversation_index") as run:
+        for file_number, path in enumerate(_part_files(parquet_dir)):
+            files.append(_file_state(parquet_dir, path))
+            ids, starts, lengths = _conversation_runs(pq.read_table(path, columns=["conversation_id"])["conversation_id"])
+            tables.append(pa.table({
+                "conversation_id": pa.array(ids, pa.string()),
+                "file": pa.array(np.full(len(ids), file_number, dtype=np.int32)),
+                "start": pa.array(starts, pa.int64()),
+                "length": pa.array(lengths, pa.int64()),
+            }, schema=INDEX_SCHEMA))
+        index = pa.concat_tables(tables) if tables else INDEX_SCHEMA.empty_table()
+        index = index.take(pc.sort_indices(index, [("conversation_id", "ascending"), ("file", "ascending")]))
+        run.rows_out = len(index)
+
+    index = index.replace_schema_metadata({_FILES_METADATA_KEY: json.dumps(files).encode("utf-8")})
+    index_path = parquet_dir / INDEX_FILE_NAME
+    pq.write_table(index, index_path.with_suffix(".tmp"))
+    index_path.with_suffix(".tmp").replace(index_path)
+    return ConversationIndex(parquet_dir, files, index)
+
+
+class ConversationIndex:
+    def __init__(self, parquet_dir, files, index):
+        self.parquet_dir = Path(parquet_dir)
+        self.files = files
+        self.conversation_ids = index["conversation_id"].to_numpy().astype(str)
+        self.file_numbers = index["file"].to_numpy()
+        self.starts = index["start"].to_numpy()
+        self.lengths = index["length"].to_numpy()
+        self._row_group_starts = {}
+
+    @classmethod
+    def load(cls, parquet_dir):
+        index = pq.read_table(Path(parquet_dir) / INDEX_FILE_NAME)
+        files = json.loads(index.schema.metadata[_FILES_METADATA_KEY])
+        return cls(parquet_dir, files, index)
+
+    def __len__(self):
+        return len(self.conversation_ids)
+
+    def check_current(self):
+        # A converted export that has been re-converted or removed, or a new one
+        # added, means the recorded row ranges can't be trusted
+        current = [_file_state(self.parquet_dir, path) for path in _part_files(self.parquet_dir)]
+        if current != self.files:
+            raise StaleConversationIndex(f"Conversation index for {self.parquet_dir} is out of date, rebuild it")
+
+    def locations(self, conversation_ids):
+        # Index entries for the IDs: a conversation has one per part file it is in
+        conversation_ids = np.unique(np.asarray(conversation_ids, dtype=str))
+        lefts = np.searchsorted(self.conversation_ids, conversation_ids, side="left")
+        rights = np.searchsorted(self.conversation_ids, conversation_ids, side="right")
+        entries = np.concatenate([np.arange(left, right) for left, right in zip(lefts, rights)] or [[]]).astype(np.int64)
+        return entries
+
+    def _row_group_bounds(self, file_number):
+        if file_number not in self._row_group_starts:
+            metadata = pq.ParquetFile(self.parquet_dir / self.files[file_number]["path"]).metadata
+            sizes = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+            self._row_group_starts[file_number] = np.concatenate([[0], np.cumsum(sizes)])
+        return self._row_group_starts[file_number]
+
+    def _read_file_rows(self, file_number, starts, lengths):
+        # Decodes only the row groups holding the wanted runs of rows
+        bounds = self._row_group_bounds(file_number)
+        first_groups = np.searchsorted(bounds, starts, side="right") - 1
+        last_groups = np.searchsorted(bounds, starts + lengths - 1, side="right") - 1
+        row_groups = sorted(set(
+            group for first, last in zip(first_groups, last_groups) for group in range(first, last + 1)
+        ))
+        parquet_file = pq.ParquetFile(self.parquet_dir / self.files[file_number]["path"])
+        table = parquet_file.read_row_groups(row_groups).cast(SPINE_PARQUET_SCHEMA)
+
+        # Row numbers in the file -> positions in the row groups that were read
+        offsets = np.zeros(len(bounds) - 1, dtype=np.int64)
+        position = 0
+        for group in row_groups:
+            offsets[group] = position - bounds[group]
+            position += bounds[group + 1] - bounds[group]
+        rows = np.concatenate([np.arange(start, start + length) for start, length in zip(starts, lengths)])
+        return table.take(pa.array(rows + offsets[np.searchsorted(bounds, rows, side="right") - 1]))
+
+    def read_messages(self, conversation_ids):
+        # Every message for the IDs as a table in the parquet layout, in
+        # conversation then time order. Unknown IDs are skipped.
+        entries = self.locations(conversation_ids)
+        with stage("read_indexed_conversations", rows_in=len(conversation_ids)) as run:
+            tables = []
+            for file_number in np.unique(self.file_numbers[entries]):
+                in_file = entries[self.file_numbers[entries] == file_number]
+                tables.append(self._read_file_rows(int(file_number), self.starts[in_file], self.lengths[in_file]))
+            messages = pa.concat_tables(tables) if tables else SPINE_PARQUET_SCHEMA.empty_table()
+            messages = messages.take(pc.sort_indices(messages, [("conversation_id", "ascending"), ("time", "ascending")]))
+            run.rows_out = len(messages)
+        return messages
+
+    def conversations(self, conversation_ids, construct_messages, idle_timeout=None):
+        # Conversation objects like read_spine_conversations returns. By default each
+        # holds its ID's whole message trail however far apart the messages are;
+        # pass the streaming idle timeout to split them the way it does.
+        items = _splunk_items_from_table(self.read_messages(conversation_ids))
+        return [
+            conversation
+            for conversation_id, messages in groupby(construct_messages(items), key=lambda message: message.conversation_id)
+            for conversation in _split_idle_conversation(conversation_id, list(messages), idle_timeout)
+        ]
+
+
+def load_conversation_index(parquet_dir, rebuild_if_stale=True):
+    parquet_dir = Path(parquet_dir)
+    if not (parquet_dir / INDEX_FILE_NAME).exists():
+        return build_conversation_index(parquet_dir)
+    index = ConversationIndex.load(parquet_dir)
+    try:
+        index.check_current()
+    except StaleConversationIndex:
+        if not rebuild_if_stale:
+            raise
+        index = build_conversation_index(parquet_dir)
+    return index
+
+
+def main():
+    # build <parquet dir> | lookup <parquet dir> <file of conversation IDs> <output csv>
+    command, parquet_dir = argv[1], argv[2]
+    if command == "build":
+        index = build_conversation_index(parquet_dir)
+        print(f"Indexed {len(index)} conversation runs in {len(index.files)} files")
+    elif command == "lookup":
+        ids_file, output_file = argv[3], argv[4]
+        with open(ids_file) as f:
+            conversation_ids = [line.strip() for line in f if line.strip()]
+        index = load_conversation_index(parquet_dir)
+        messages = index.read_messages(conversation_ids).to_pandas()
+        messages.to_csv(output_file, index=False)
+        print(f"Wrote {len(messages)} messages for {messages['conversation_id'].nunique()} conversations")
+    else:
+        raise ValueError(f"Unknown command: {command}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+from sys import argv
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from dateutil.tz import tzutc
+from gp2gp.service.transformers import derive_transfers
+from gp2gp.spine.sources import construct_messages_from_splunk_items
+from gp2gp.spine.transformers import parse_conversation, ConversationMissingStart
+from prmdata.utils.date.range import DateTimeRange
+
+from scripts.gp2gp_spine_outcomes import outcome
+from scripts.spine_stream import DEFAULT_IDLE_TIMEOUT, pop_idle_timeout, read_spine_conversations, run_analyses
+
+DEFAULT_CUTOFFS = [timedelta(days=2), timedelta(days=14), timedelta(days=28)]
+
+
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def _outcome(gp2gp_conversation):
+    [transfer] = derive_transfers([gp2gp_conversation])
+    return outcome(transfer)
+
+
+def message_offsets(messages, request_started):
+    # Microseconds from the request to each message, in time order
+    return np.array([(message.time - request_started) // ONE_MICROSECOND for message in messages], dtype=np.int64)
+
+
+def outcomes_at_cutoffs(conversation, cutoffs, gp2gp_conversation=None):
+    # The outcome of a conversation under a cutoff only depends on how many of its
+    # messages arrived by request start + cutoff. The conversation is parsed once
+    # and its sorted message times kept, so every cutoff's message count is one
+    # searchsorted over them. A prefix is only parsed for each distinct count short
+    # of the whole conversation, whose outcome comes from the one parse.
+    if gp2gp_conversation is None:
+        gp2gp_conversation = parse_conversation(conversation)
+    messages = sorted(conversation.messages, key=lambda message: message.time)
+    offsets = message_offsets(messages, gp2gp_conversation.request_started.time)
+    deadlines = np.array([cutoff // ONE_MICROSECOND for cutoff in cutoffs], dtype=np.int64)
+    message_counts = np.searchsorted(offsets, deadlines, side="right")
+
+    outcomes_by_count = {}
+    for message_count in np.unique(message_counts):
+        if message_count == len(messages):
+            outcomes_by_count[message_count] = _outcome(gp2gp_conversation)
+        else:
+            prefix = type(conversation)(conversation.id, messages[:message_count])
+            outcomes_by_count[message_count] = _outcome(parse_conversation(prefix))
+    return [outcomes_by_count[message_count] for message_count in message_counts]
+
+
+class CutoffOutcomes:
+    # Outcome codes for every conversation under every cutoff, one column per cutoff
+    def __init__(self, conversation_ids, cutoffs, outcome_codes, outcomes):
+        self.conversation_ids = conversation_ids
+        self.cutoffs = cutoffs
+        self.outcome_codes = outcome_codes
+        self.outcomes = outcomes
+
+    def outcome_codes_at(self, cutoff):
+        return self.outcome_codes[:, self.cutoffs.index(cutoff)]
+
+    def outcomes_by_conversation(self):
+        return pd.DataFrame(
+            {
+                cutoff: pd.Categorical.from_codes(self.outcome_codes_at(cutoff), categories=self.outcomes)
+                for cutoff in self.cutoffs
+            },
+            index=pd.Index(self.conversation_ids, name="conversation_id"),
+        )
+
+    def outcome_matrix(self):
+        # Outcome x cutoff table of transfer counts
+        return pd.DataFrame(
+            {
+                cutoff: np.bincount(self.outcome_codes_at(cutoff), minlength=len(self.outcomes))
+                for cutoff in self.cutoffs
+            },
+            index=pd.Index(self.outcomes, name="outcome"),
+        )
+
+
+class CutoffSweep:
+    def __init__(self, time_range, cutoffs=DEFAULT_CUTOFFS):
+        self.time_range = time_range
+        self.cutoffs = sorted(cutoffs)
+        self.outcomes = {}
+        self.conversation_ids = []
+        self.outcome_codes = []
+
+    def process(self, conversation):
+        try:
+            gp2gp_conversation = parse_conversation(conversation)
+        except ConversationMissingStart:
+            return
+        if not self.time_range.contains(gp2gp_conversation.request_started.time):
+            return
+
+        self.conversation_ids.append(conversation.id)
+        self.outcome_codes.append([
+            self.outcomes.setdefault(transfer_outcome, len(self.outcomes))
+            for transfer_outcome in outcomes_at_cutoffs(conversation, self.cutoffs, gp2gp_conversation)
+        ])
+
+    def result(self):
+        return CutoffOutcomes(
+            self.conversation_ids,
+            self.cutoffs,
+            np.array(self.outcome_codes, dtype=np.int64).reshape(len(self.conversation_ids), len(self.cutoffs)),
+            list(self.outcomes),
+        )
+
+
+def sweep_cutoffs(month_file_name, next_month_file_name, time_range, cutoffs=DEFAULT_CUTOFFS, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    # Conversations must not be released before the longest cutoff has passed
+    if idle_timeout is not None:
+        idle_timeout = max(idle_timeout, max(cutoffs))
+    conversations = read_spine_conversations(
+        [month_file_name, next_month_file_name], construct_messages_from_splunk_items, idle_timeout
+    )
+    [cutoff_outcomes] = run_analyses(conversations, [CutoffSweep(time_range, cutoffs)])
+    return cutoff_outcomes
+
+
+def main():
+    idle_timeout, args = pop_idle_timeout(argv[1:])
+    month_file_name, next_month_file_name, month = args[0], args[1], args[2]
+    cutoffs = [timedelta(days=int(days)) for days in args[3].split(",")] if len(args) > 3 else DEFAULT_CUTOFFS
+    metric_month = datetime.strptime(month, "%Y-%m").replace(tzinfo=tzutc())
+    time_range = DateTimeRange(metric_month, metric_month + relativedelta(months=1))
+
+    matrix = sweep_cutoffs(month_file_name, next_month_file_name, time_range, cutoffs, idle_timeout).outcome_matrix()
+    matrix.columns = [f"{cutoff.days} day cutoff" for cutoff in sorted(cutoffs)]
+    print(matrix.to_string())
+
+
+if __name__ == "__main__":
+    main()
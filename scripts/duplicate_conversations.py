@@ -0,0 +1,148 @@
+from datetime import timedelta
+from sys import argv
+
+import numpy as np
+import pandas as pd
+from gp2gp.spine.models import EHR_REQUEST_COMPLETED
+from gp2gp.spine.sources import construct_messages_from_splunk_items
+from gp2gp.spine.transformers import parse_conversation, ConversationMissingStart
+
+from scripts.spine_stream import DEFAULT_IDLE_TIMEOUT, pop_idle_timeout, read_spine_conversations, run_analyses
+
+# Requests for the same EHR this close together are treated as one transfer
+# being retried
+DEFAULT_DUPLICATE_WINDOW = timedelta(days=1)
+
+DUPLICATE_COLUMNS = [
+    "conversation_id",
+    "requesting_practice_asid",
+    "sending_practice_asid",
+    "request_started",
+    "duplicate_cluster_id",
+    "duplicate_cluster_size",
+    "is_latest_in_cluster",
+]
+
+
+class _ConversationLinks:
+    # Union-find over conversation numbers, so conversations linked through any
+    # chain of shared keys end up in the same bucket
+    def __init__(self):
+        self.parents = []
+
+    def add(self):
+        self.parents.append(len(self.parents))
+        return len(self.parents) - 1
+
+    def find(self, number):
+        parents = self.parents
+        while parents[number] != number:
+            parents[number] = parents[parents[number]]
+            number = parents[number]
+        return number
+
+    def union(self, number, other):
+        number, other = self.find(number), self.find(other)
+        if number != other:
+            parents = self.parents
+            parents[max(number, other)] = min(number, other)
+
+
+class DuplicateConversations:
+    # Fingerprints each conversation as it streams past, keeping only the
+    # fingerprint. A hash index from each key to the first conversation seen with
+    # it links conversations into buckets: every EHR message ID a conversation
+    # carries is a key, and so is its requesting/sending practice pair, which
+    # catches an EHR re-sent with new IDs. Links are transitive, so a conversation
+    # sharing keys with two buckets joins them. Within a bucket, each cluster is
+    # the earliest unclustered request and every request within window after it,
+    # so clusters never chain beyond the window. With match_practice_pair=False
+    # only shared EHR message IDs link conversations.
+    def __init__(self, window=DEFAULT_DUPLICATE_WINDOW, match_practice_pair=True):
+        self.window = window
+        self.match_practice_pair = match_practice_pair
+        self.conversation_ids = []
+        self.requesting_asids = []
+        self.sending_asids = []
+        self.request_started = []
+        self.links = _ConversationLinks()
+        self.first_with_key = {}
+
+    def process(self, conversation):
+        try:
+            request_started = parse_conversation(conversation).request_started
+        except ConversationMissingStart:
+            return
+
+        conversation_number = self.links.add()
+        self.conversation_ids.append(conversation.id)
+        self.requesting_asids.append(request_started.from_party_asid)
+        self.sending_asids.append(request_started.to_party_asid)
+        self.request_started.append(request_started.time)
+
+        keys = [
+            ("ehr", message.guid)
+            for message in conversation.messages
+            if message.interaction_id == EHR_REQUEST_COMPLETED and message.guid
+        ]
+        if self.match_practice_pair and request_started.from_party_asid and request_started.to_party_asid:
+            keys.append(("practices", request_started.from_party_asid, request_started.to_party_asid))
+        for key in keys:
+            self.links.union(conversation_number, self.first_with_key.setdefault(key, conversation_number))
+
+    def _cluster_anchors(self, buckets, started):
+        # buckets and started ordered by bucket then request time; returns the
+        # position of each row's cluster's first request
+        anchors = np.empty(len(buckets), dtype=np.int64)
+        window = np.timedelta64(self.window)
+        anchor = 0
+        for position in range(len(buckets)):
+            if buckets[position] != buckets[anchor] or started[position] - started[anchor] > window:
+                anchor = position
+            anchors[position] = anchor
+        return anchors
+
+    def result(self):
+        fingerprints = pd.DataFrame({
+            "conversation_id": self.conversation_ids,
+            "requesting_practice_asid": pd.Series(self.requesting_asids, dtype=object).fillna(""),
+            "sending_practice_asid": pd.Series(self.sending_asids, dtype=object).fillna(""),
+            "request_started": pd.to_datetime(pd.Series(self.request_started, dtype=object), utc=True),
+            "bucket": np.array([self.links.find(number) for number in range(len(self.conversation_ids))], dtype=np.int64),
+        })
+        ordered = fingerprints.sort_values(["bucket", "request_started"], kind="stable")
+        anchors = self._cluster_anchors(ordered["bucket"].values, ordered["request_started"].values)
+
+        # A cluster is named after its earliest conversation, and its latest
+        # request is the one that stands for it in deduplicated counts
+        clusters = pd.Series(anchors, index=ordered.index)
+        ordered["duplicate_cluster_id"] = ordered["conversation_id"].values[anchors]
+        ordered["duplicate_cluster_size"] = clusters.groupby(clusters).transform("size").values
+        ordered["is_latest_in_cluster"] = np.append(anchors[1:] != anchors[:-1], True) if len(anchors) else np.array([], dtype=bool)
+        return ordered.sort_index()[DUPLICATE_COLUMNS]
+
+
+def find_duplicate_conversations(
+        file_paths,
+        window=DEFAULT_DUPLICATE_WINDOW,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT,
+        match_practice_pair=True,
+):
+    conversations = read_spine_conversations(file_paths, construct_messages_from_splunk_items, idle_timeout)
+    [duplicates] = run_analyses(conversations, [DuplicateConversations(window, match_practice_pair)])
+    return duplicates
+
+
+def main():
+    # [--idle-timeout-days N] <output csv> <spine files...>
+    idle_timeout, args = pop_idle_timeout(argv[1:])
+    output_file, file_paths = args[0], args[1:]
+    duplicates = find_duplicate_conversations(file_paths, idle_timeout=idle_timeout)
+    duplicates.to_csv(output_file, index=False)
+    clusters = duplicates.drop_duplicates("duplicate_cluster_id")
+    print(f"{len(duplicates)} conversations in {len(clusters)} clusters")
+    print(clusters["duplicate_cluster_size"].value_counts().sort_index().to_string())
+
+
+if __name__ == "__main__":
+    main()
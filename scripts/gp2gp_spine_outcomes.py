@@ -1,18 +1,32 @@
 from gp2gp.service.models import ERROR_SUPPRESSED, Transfer, TransferStatus
 from gp2gp.service.transformers import EIGHT_DAYS_IN_SECONDS, derive_transfers
-from gp2gp.pipeline.dashboard.main import read_spine_csv_gz_files
+from gp2gp.spine.sources import construct_messages_from_splunk_items
 from gp2gp.spine.transformers import parse_conversation, group_into_conversations, ConversationMissingStart
 
 from collections import defaultdict
 
+import pandas as pd
+
+from data.instrumentation import stage
+from data.memoize import memoize
+from data.outcome_cube import OutcomeCube
+from scripts.duplicate_conversations import DEFAULT_DUPLICATE_WINDOW, DuplicateConversations
+from scripts.spine_stream import DEFAULT_IDLE_TIMEOUT, read_spine_conversations, run_analyses
+
 def parse_conversations(messages, time_range):
     for conversation in group_into_conversations(messages):
-        try:
-            gp2gp_conversation = parse_conversation(conversation)
-            if time_range.contains(gp2gp_conversation.request_started.time):
-                yield gp2gp_conversation
-        except ConversationMissingStart:
-            pass
+        gp2gp_conversation = parse_conversation_in(conversation, time_range)
+        if gp2gp_conversation is not None:
+            yield gp2gp_conversation
+
+def parse_conversation_in(conversation, time_range):
+    try:
+        gp2gp_conversation = parse_conversation(conversation)
+    except ConversationMissingStart:
+        return None
+    if time_range.contains(gp2gp_conversation.request_started.time):
+        return gp2gp_conversation
+    return None
 
 def outcome(transfer: Transfer):
     if transfer.status == TransferStatus.FAILED:
@@ -37,17 +51,108 @@ def outcome(transfer: Transfer):
         raise Exception(f"Transfer with unknown status: {transfer.status}")
 
 
-def calculate_counts(month_file_name: str, next_month_file_name: str, time_range):
-  spine_messages = read_spine_csv_gz_files([
-      month_file_name, next_month_file_name
-  ])
+class OutcomeCounts:
+    def __init__(self, time_range):
+        self.time_range = time_range
+        self.counts = defaultdict(int)
+
+    def process(self, conversation):
+        with stage("parse", memory=False):
+            gp2gp_conversation = parse_conversation_in(conversation, self.time_range)
+        if gp2gp_conversation is not None:
+            with stage("derive", memory=False):
+                gp2gp_transfers = list(derive_transfers([gp2gp_conversation]))
+            for gp2gp_transfer in gp2gp_transfers:
+                self.counts[outcome(gp2gp_transfer)] += 1
+
+    def result(self):
+        return self.counts
+
+
+def transfer_outcome_row(transfer: Transfer):
+    # A row in the shape of the transfers parquet files, with outcome() as status,
+    # so Spine-derived transfers can be summarised by OutcomeCube as well
+    return {
+        "conversation_id": transfer.conversation_id,
+        "date_requested": transfer.date_requested,
+        "requesting_practice_asid": transfer.requesting_practice_asid,
+        "sending_practice_asid": transfer.sending_practice_asid,
+        "status": outcome(transfer),
+        "sla_duration": None if transfer.sla_duration is None else transfer.sla_duration.total_seconds(),
+        "intermediate_error_codes": list(transfer.intermediate_error_codes),
+        "final_error_codes": [] if transfer.final_error_code is None else [transfer.final_error_code],
+    }
+
+
+class OutcomeTransfers:
+    def __init__(self, time_range):
+        self.time_range = time_range
+        self.rows = []
 
-  conversations = parse_conversations(spine_messages, time_range=time_range)
-  transfers = derive_transfers(conversations)
+    def process(self, conversation):
+        gp2gp_conversation = parse_conversation_in(conversation, self.time_range)
+        if gp2gp_conversation is not None:
+            for gp2gp_transfer in derive_transfers([gp2gp_conversation]):
+                self.rows.append(transfer_outcome_row(gp2gp_transfer))
 
-  counts = defaultdict(int)
-  for gp2g_transfer in transfers:
-      counts[outcome(gp2g_transfer)] += 1
+    def result(self):
+        return pd.DataFrame(self.rows, columns=[
+            "conversation_id", "date_requested", "requesting_practice_asid", "sending_practice_asid",
+            "status", "sla_duration", "intermediate_error_codes", "final_error_codes",
+        ])
+
+
+@memoize(inputs=["month_file_name", "next_month_file_name"])
+def calculate_counts(month_file_name: str, next_month_file_name: str, time_range, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+  conversations = read_spine_conversations(
+      [month_file_name, next_month_file_name], construct_messages_from_splunk_items, idle_timeout
+  )
+  [counts] = run_analyses(conversations, [OutcomeCounts(time_range)])
 
   return counts
 
+
+@memoize(inputs=["month_file_name", "next_month_file_name"])
+def calculate_outcome_cube(month_file_name: str, next_month_file_name: str, time_range, asid_lookup=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+  conversations = read_spine_conversations(
+      [month_file_name, next_month_file_name], construct_messages_from_splunk_items, idle_timeout
+  )
+  [transfers] = run_analyses(conversations, [OutcomeTransfers(time_range)])
+  if asid_lookup is not None:
+      transfers = asid_lookup.enrich(transfers)
+
+  return OutcomeCube.from_transfers(transfers)
+
+
+def deduplicated_counts(transfers, duplicates):
+  # Outcome counts over every transfer, and over one transfer per duplicate
+  # cluster, side by side. transfers only holds requests inside the time range,
+  # and the latest of a cluster's requests there stands for it, so a transfer
+  # retried after the range ends is still counted in it.
+  # A conversation ID reused after the idle timeout is two transfers, so the
+  # request time is part of the key
+  duplicates = duplicates.rename(columns={"request_started": "date_requested"})
+  transfers = transfers.assign(date_requested=pd.to_datetime(transfers["date_requested"], utc=True)).merge(
+      duplicates[["conversation_id", "date_requested", "duplicate_cluster_id"]],
+      on=["conversation_id", "date_requested"],
+      how="left",
+  )
+  clusters = transfers["duplicate_cluster_id"].fillna(transfers["conversation_id"])
+  representatives = transfers.groupby(clusters, sort=False)["date_requested"].idxmax()
+  counts = pd.DataFrame({
+      "raw": transfers["status"].value_counts(),
+      "deduplicated": transfers.loc[representatives.values, "status"].value_counts(),
+  })
+  return counts.fillna(0).astype(int)
+
+
+@memoize(inputs=["month_file_name", "next_month_file_name"])
+def calculate_deduplicated_counts(month_file_name: str, next_month_file_name: str, time_range, window=DEFAULT_DUPLICATE_WINDOW, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+  # Duplicates are found among all conversations in both files, so retries
+  # that run into the next month's export are still clustered together
+  conversations = read_spine_conversations(
+      [month_file_name, next_month_file_name], construct_messages_from_splunk_items, idle_timeout
+  )
+  [transfers, duplicates] = run_analyses(conversations, [OutcomeTransfers(time_range), DuplicateConversations(window)])
+
+  return deduplicated_counts(transfers, duplicates)
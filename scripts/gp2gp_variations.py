@@ -1,10 +1,11 @@
+import csv
 from collections import Counter
 from datetime import datetime
+from sys import argv
 
 from dateutil.relativedelta import relativedelta
 from dateutil.tz import tzutc
 
-from prmdata.domain.spine.conversation import group_into_conversations
 from prmdata.domain.spine.message import construct_messages_from_splunk_items
 from prmdata.domain.spine.parsed_conversation import (
     EHR_REQUEST_STARTED,
@@ -13,7 +14,14 @@ from prmdata.domain.spine.parsed_conversation import (
     APPLICATION_ACK,
 )
 from prmdata.utils.date.range import DateTimeRange
-from prmdata.utils.io.csv import read_gzip_csv_files
+
+from scripts.spine_stream import (
+    DEFAULT_IDLE_TIMEOUT,
+    pop_idle_timeout,
+    read_spine_csv_chunks,
+    read_spine_conversations,
+    run_analyses,
+)
 
 input_files = [
     "./Jan-2021.csv.gz",
@@ -32,8 +40,17 @@ abbreviations = {
 }
 
 
+def interaction_abbreviation(interaction_id):
+    # Interactions outside the four GP2GP ones keep their own name, e.g.
+    # "urn:nhs:names:services:gp2gp/COPC_IN000001UK02" -> "COPC_IN000001UK02"
+    abbreviation = abbreviations.get(interaction_id)
+    if abbreviation is None:
+        return str(interaction_id).rsplit("/", 1)[-1]
+    return abbreviation
+
+
 def read_spine_csv_gz_files(file_paths):
-    items = read_gzip_csv_files(file_paths)
+    items = read_spine_csv_chunks(file_paths)
     return construct_messages_from_splunk_items(items)
 
 
@@ -48,7 +65,7 @@ def filter_for_full_conversations(conversations, date_range):
 
 def message_code(message, requester):
     party = "R" if message.from_party_asid == requester else "S"
-    interaction = abbreviations[message.interaction_id]
+    interaction = interaction_abbreviation(message.interaction_id)
     error = str(message.error_code) if message.error_code is not None else ""
     return party + ":" + interaction + "[" + error + "]"
 
@@ -58,11 +75,35 @@ def extract_pattern(conversation):
     return "-".join((message_code(m, requester) for m in conversation.messages))
 
 
-spine_messages = read_spine_csv_gz_files(input_files)
-gp2gp_conversations = group_into_conversations(spine_messages)
-full_conversations = filter_for_full_conversations(gp2gp_conversations, date_range)
-counts = Counter((extract_pattern(c) for c in full_conversations))
+class PatternCounts:
+    def __init__(self, date_range):
+        self.date_range = date_range
+        self.counts = Counter()
+
+    def process(self, conversation):
+        if conversation_is_started_in(conversation, self.date_range):
+            self.counts[extract_pattern(conversation)] += 1
+
+    def result(self):
+        return self.counts
+
+
+def count_patterns(file_paths, date_range, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    gp2gp_conversations = read_spine_conversations(file_paths, construct_messages_from_splunk_items, idle_timeout)
+    [counts] = run_analyses(gp2gp_conversations, [PatternCounts(date_range)])
+    return counts
+
+
+def main():
+    idle_timeout, _ = pop_idle_timeout(argv[1:])
+    counts = count_patterns(input_files, date_range, idle_timeout)
+
+    with open("./gp2gp-patterns-jan-21.csv", 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["pattern", "count"])
+        for pattern, count in counts.most_common():
+            writer.writerow([pattern, count])
+
 
-with open("./gp2gp-patterns-jan-21.csv", 'w') as f:
-    for pattern, count in counts.most_common():
-        print(pattern, count)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import argparse
+import csv
+import heapq
+from datetime import datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+from dateutil.tz import tzutc
+from prmdata.domain.spine.message import construct_messages_from_splunk_items
+from prmdata.utils.date.range import DateTimeRange
+
+from scripts.gp2gp_variations import conversation_is_started_in, interaction_abbreviation
+from scripts.spine_stream import DEFAULT_IDLE_TIMEOUT, read_spine_conversations, run_analyses
+
+PATTERN_SEPARATOR = "-"
+# Appended to patterns cut short by max_length
+TRUNCATED_MARKER = "..."
+
+
+class TokenTable:
+    # Interns each distinct (party, interaction, error code) message code as a
+    # small int, so a pattern is a tuple of ints rather than a long string
+    def __init__(self):
+        self.ids = {}
+        self.codes = []
+
+    def __len__(self):
+        return len(self.codes)
+
+    def token(self, party, interaction, error):
+        key = (party, interaction, error)
+        token = self.ids.get(key)
+        if token is None:
+            token = self.ids[key] = len(self.codes)
+            self.codes.append(f"{party}:{interaction}[{error}]")
+        return token
+
+    def conversation_tokens(self, conversation, max_length=None):
+        messages = conversation.messages if max_length is None else conversation.messages[:max_length]
+        requester = conversation.messages[0].from_party_asid
+        return tuple(
+            self.token(
+                "R" if message.from_party_asid == requester else "S",
+                interaction_abbreviation(message.interaction_id),
+                str(message.error_code) if message.error_code is not None else "",
+            )
+            for message in messages
+        )
+
+    def decode(self, tokens, truncated=False):
+        # Same format as gp2gp_variations.extract_pattern
+        pattern = PATTERN_SEPARATOR.join(self.codes[token] for token in tokens)
+        return pattern + PATTERN_SEPARATOR + TRUNCATED_MARKER if truncated else pattern
+
+
+class PatternTrie:
+    # Nodes are held in parallel lists indexed by node number, node 0 being the
+    # empty prefix. passing[n] counts the conversations whose pattern starts with
+    # node n's prefix, ending[n] those whose pattern is exactly that prefix.
+    def __init__(self):
+        self.children = [{}]
+        self.parents = [-1]
+        self.tokens = [-1]
+        self.passing = [0]
+        self.ending = [0]
+        self.truncated = [0]
+
+    def __len__(self):
+        return len(self.passing)
+
+    def add(self, tokens, count=1, truncated=False):
+        node = 0
+        self.passing[0] += count
+        for token in tokens:
+            child = self.children[node].get(token)
+            if child is None:
+                child = len(self.passing)
+                self.children[node][token] = child
+                self.children.append({})
+                self.parents.append(node)
+                self.tokens.append(token)
+                self.passing.append(0)
+                self.ending.append(0)
+                self.truncated.append(0)
+            node = child
+            self.passing[node] += count
+        if truncated:
+            self.truncated[node] += count
+        else:
+            self.ending[node] += count
+
+    def prefix(self, node):
+        tokens = []
+        while node > 0:
+            tokens.append(self.tokens[node])
+            node = self.parents[node]
+        return tuple(reversed(tokens))
+
+    def _nodes(self, max_depth=None):
+        # (node, depth) in depth-first order, children in insertion order
+        stack = [(0, 0)]
+        while stack:
+            node, depth = stack.pop()
+            yield node, depth
+            if max_depth is None or depth < max_depth:
+                stack.extend((child, depth + 1) for child in reversed(list(self.children[node].values())))
+
+    def patterns(self):
+        # (tokens, count, truncated) for every complete or truncated pattern
+        for node, _ in self._nodes():
+            if self.ending[node]:
+                yield self.prefix(node), self.ending[node], False
+            if self.truncated[node]:
+                yield self.prefix(node), self.truncated[node], True
+
+    def prefixes(self, max_depth=None):
+        # (tokens, conversations starting with them, conversations ending there)
+        for node, depth in self._nodes(max_depth):
+            if depth > 0:
+                yield self.prefix(node), self.passing[node], self.ending[node]
+
+    def count(self, tokens):
+        node = 0
+        for token in tokens:
+            node = self.children[node].get(token)
+            if node is None:
+                return 0
+        return self.passing[node]
+
+
+class SpaceSavingCounter:
+    # Metwally et al.'s space-saving heavy hitters: at most capacity keys are
+    # kept, and a new key evicts the smallest, inheriting its count as error.
+    # Any key occurring more than n / capacity times is guaranteed to be kept,
+    # and each kept count overestimates the true count by at most its error.
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # Lazily updated (count, sequence number, key) entries; stale entries are
+        # skipped when popped and the heap is rebuilt when they pile up
+        self.heap = []
+        self.sequence = 0
+        self.total = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _push(self, key):
+        self.sequence += 1
+        heapq.heappush(self.heap, (self.counts[key], self.sequence, key))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, i, key) for i, (key, count) in enumerate(self.counts.items())]
+            heapq.heapify(self.heap)
+            self.sequence = len(self.heap)
+
+    def _pop_minimum(self):
+        while True:
+            count, _, key = heapq.heappop(self.heap)
+            if self.counts.get(key) == count:
+                return key, count
+
+    def add(self, key, count=1):
+        self.total += count
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else:
+            evicted, minimum = self._pop_minimum()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[key] = minimum + count
+            self.errors[key] = minimum
+        self._push(key)
+
+    def most_common(self, n=None):
+        # [(key, estimated count, maximum overestimate)], highest first
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return [(key, count, self.errors[key]) for key, count in ranked[:n]]
+
+
+class MinedPatterns:
+    def __init__(self, tokens, trie=None, top_k=None):
+        self.tokens = tokens
+        self.trie = trie
+        self.top_k = top_k
+
+    @property
+    def exact(self):
+        return self.trie is not None
+
+    def pattern_counts(self, n=None):
+        # [(pattern, count, maximum overestimate)], highest count first. The
+        # overestimate is always 0 for exact counts.
+        if self.exact:
+            ranked = sorted(self.trie.patterns(), key=lambda item: item[1], reverse=True)[:n]
+            return [(self.tokens.decode(tokens, truncated), count, 0) for tokens, count, truncated in ranked]
+        return [
+            (self.tokens.decode(*key), count, error)
+            for key, count, error in self.top_k.most_common(n)
+        ]
+
+    def prefix_counts(self, max_depth=None):
+        # [(prefix, depth, conversations starting with it, conversations ending there)]
+        if not self.exact:
+            raise ValueError("Prefix roll-ups need exact counts, not top-k")
+        return [
+            (self.tokens.decode(tokens), len(tokens), passing, ending)
+            for tokens, passing, ending in self.trie.prefixes(max_depth)
+        ]
+
+    def write_pattern_csv(self, path, n=None):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            if self.exact:
+                writer.writerow(["pattern", "count"])
+                writer.writerows((pattern, count) for pattern, count, _ in self.pattern_counts(n))
+            else:
+                writer.writerow(["pattern", "estimated_count", "max_overcount"])
+                writer.writerows(self.pattern_counts(n))
+
+    def write_prefix_csv(self, path, max_depth=None):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["prefix", "depth", "conversations", "ending_here"])
+            writer.writerows(self.prefix_counts(max_depth))
+
+
+class PatternMining:
+    # Counts the message patterns of conversations started in date_range, exactly
+    # in a trie by default, or only the approximate top_k most common patterns.
+    # Conversations longer than max_length messages are counted by their first
+    # max_length messages, marked as truncated.
+    def __init__(self, date_range, top_k=None, max_length=None):
+        self.date_range = date_range
+        self.max_length = max_length
+        self.tokens = TokenTable()
+        self.trie = PatternTrie() if top_k is None else None
+        self.top_k = SpaceSavingCounter(top_k) if top_k is not None else None
+
+    def process(self, conversation):
+        if not conversation_is_started_in(conversation, self.date_range):
+            return
+        tokens = self.tokens.conversation_tokens(conversation, self.max_length)
+        truncated = self.max_length is not None and len(conversation.messages) > self.max_length
+        if self.trie is not None:
+            self.trie.add(tokens, truncated=truncated)
+        else:
+            self.top_k.add((tokens, truncated))
+
+    def result(self):
+        return MinedPatterns(self.tokens, self.trie, self.top_k)
+
+
+def mine_patterns(file_paths, date_range, top_k=None, max_length=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    conversations = read_spine_conversations(file_paths, construct_messages_from_splunk_items, idle_timeout)
+    [patterns] = run_analyses(conversations, [PatternMining(date_range, top_k, max_length)])
+    return patterns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count GP2GP conversation message patterns")
+    parser.add_argument("month", help="Month the conversations started in, as YYYY-MM")
+    parser.add_argument("output", help="CSV of pattern counts to write")
+    parser.add_argument("files", nargs="+", help="Spine exports for the month and the month after")
+    parser.add_argument("--top-k", type=int, help="Only keep approximate counts of the k most common patterns")
+    parser.add_argument("--max-length", type=int, help="Cut patterns off after this many messages")
+    parser.add_argument("--prefixes", help="CSV of prefix roll-ups to write (exact counts only)")
+    parser.add_argument("--prefix-depth", type=int, help="Deepest prefix to include in the roll-ups")
+    parser.add_argument(
+        "--idle-timeout-days",
+        type=float,
+        default=DEFAULT_IDLE_TIMEOUT.days,
+        help="Release conversations idle for this many days (0 keeps them all until the end)",
+    )
+    args = parser.parse_args()
+
+    metric_month = datetime.strptime(args.month, "%Y-%m").replace(tzinfo=tzutc())
+    date_range = DateTimeRange(metric_month, metric_month + relativedelta(months=1))
+
+    idle_timeout = timedelta(days=args.idle_timeout_days) if args.idle_timeout_days > 0 else None
+    patterns = mine_patterns(args.files, date_range, args.top_k, args.max_length, idle_timeout)
+    patterns.write_pattern_csv(args.output)
+    if args.prefixes:
+        patterns.write_prefix_csv(args.prefixes, args.prefix_depth)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from sys import argv
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from dateutil.tz import tzutc
+from prmdata.utils.date.range import DateTimeRange
+
+from data.memoize import input_fingerprint
+from scripts.gp2gp_spine_outcomes import calculate_counts
+from scripts.spine_stream import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_IDLE_TIMEOUT,
+    SPINE_CSV_COLUMNS,
+    conversation_shards,
+    pop_idle_timeout,
+)
+
+DEFAULT_SHARD_COUNT = os.cpu_count() or 1
+# Shards are only read back once or twice, so favour speed over size
+SHARD_COMPRESS_LEVEL = 1
+_COMPLETE_MARKER = "_COMPLETE"
+
+
+def shard_paths(shard_dir, shard_count):
+    return [Path(shard_dir) / f"shard-{shard:04d}.csv.gz" for shard in range(shard_count)]
+
+
+def shard_dir_name(file_path, month):
+    # Unique per export and month: exports of different months often share a file
+    # name (2021-01/Part1.csv.gz, 2021-02/Part1.csv.gz), so the whole path or URI
+    # is hashed rather than the name used
+    file_path = str(file_path)
+    location = file_path if "://" in file_path else os.path.abspath(file_path)
+    digest = hashlib.sha256(location.encode("utf-8")).hexdigest()[:16]
+    return f"{month.strftime('%Y-%m')}-{digest}"
+
+
+def _shard_marker(file_path, shard_count):
+    return {"shard_count": shard_count, "source": input_fingerprint(file_path)}
+
+
+def _read_shard_marker(shard_dir):
+    try:
+        return json.loads((shard_dir / _COMPLETE_MARKER).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def shard_spine_file(file_path, shard_dir, shard_count=DEFAULT_SHARD_COUNT, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Splits one Splunk export into shard_count files by conversationID, keeping
+    # the export's row order within each shard. Skipped if already done for the
+    # same shard count and the same version of the export.
+    shard_dir = Path(shard_dir)
+    paths = shard_paths(shard_dir, shard_count)
+    marker = _shard_marker(file_path, shard_count)
+    if _read_shard_marker(shard_dir) == marker:
+        return paths
+
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    (shard_dir / _COMPLETE_MARKER).unlink(missing_ok=True)
+    for stale_path in shard_dir.glob("shard-*.csv.gz"):
+        stale_path.unlink()
+    shard_files = [gzip.open(path, "wt", newline="", compresslevel=SHARD_COMPRESS_LEVEL) for path in paths]
+    try:
+        columns = None
+        chunks = pd.read_csv(
+            file_path,
+            compression="gzip",
+            dtype=str,
+            keep_default_na=False,
+            usecols=lambda column: column in SPINE_CSV_COLUMNS,
+            chunksize=chunk_size,
+        )
+        for chunk in chunks:
+            if columns is None:
+                columns = list(chunk.columns)
+                for shard_file in shard_files:
+                    shard_file.write(",".join(columns) + "\n")
+            shards = conversation_shards(chunk["conversationID"], shard_count)
+            for shard, rows in chunk.groupby(shards, sort=False):
+                rows.to_csv(shard_files[shard], header=False, index=False)
+        if columns is None:
+            for shard_file in shard_files:
+                shard_file.write(",".join(SPINE_CSV_COLUMNS) + "\n")
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+
+    (shard_dir / _COMPLETE_MARKER).write_text(json.dumps(marker))
+    return paths
+
+
+def _count_shard(month_shard_path, next_month_shard_path, metric_month, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    time_range = DateTimeRange(metric_month, metric_month + relativedelta(months=1))
+    # Shards are usually temporary, so their counts aren't worth memoizing
+    return dict(calculate_counts.uncached(str(month_shard_path), str(next_month_shard_path), time_range, idle_timeout))
+
+
+def merge_counts(shard_counts):
+    counts = defaultdict(int)
+    for shard_count in shard_counts:
+        for transfer_outcome, count in shard_count.items():
+            counts[transfer_outcome] += count
+    return counts
+
+
+def calculate_counts_sharded(
+        month_file_names,
+        first_metric_month,
+        shard_count=DEFAULT_SHARD_COUNT,
+        max_workers=None,
+        shard_dir=None,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT,
+):
+    # month_file_names are consecutive monthly exports in order. Each one is split
+    # once, even though it is both the "next month" of one run and the "month" of
+    # the next; outcomes are produced for every month except the last file's.
+    # Conversations never cross shards, so the per-shard counts just add up.
+    with tempfile.TemporaryDirectory(prefix="spine-shards-") as temporary_dir, \
+            ProcessPoolExecutor(max_workers=max_workers) as executor:
+        shard_root = Path(shard_dir or temporary_dir)
+        file_months = [first_metric_month + relativedelta(months=i) for i in range(len(month_file_names))]
+        sharded_files = list(executor.map(
+            shard_spine_file,
+            month_file_names,
+            [shard_root / shard_dir_name(file_name, month) for file_name, month in zip(month_file_names, file_months)],
+            [shard_count] * len(month_file_names),
+        ))
+
+        metric_months = file_months[:-1]
+        futures = {
+            metric_month: [
+                executor.submit(_count_shard, month_shard, next_month_shard, metric_month, idle_timeout)
+                for month_shard, next_month_shard in zip(sharded_files[i], sharded_files[i + 1])
+            ]
+            for i, metric_month in enumerate(metric_months)
+        }
+        return {
+            metric_month: merge_counts(future.result() for future in month_futures)
+            for metric_month, month_futures in futures.items()
+        }
+
+
+def main():
+    idle_timeout, args = pop_idle_timeout(argv[1:])
+    first_month, month_file_names = args[0], args[1:]
+    first_metric_month = datetime.strptime(first_month, "%Y-%m").replace(tzinfo=tzutc())
+    counts_by_month = calculate_counts_sharded(month_file_names, first_metric_month, idle_timeout=idle_timeout)
+    for metric_month, counts in counts_by_month.items():
+        print(metric_month.strftime("%Y-%m"))
+        for transfer_outcome, count in counts.items():
+            print(transfer_outcome, count)
+
+
+if __name__ == "__main__":
+    main()
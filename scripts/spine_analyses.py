@@ -0,0 +1,47 @@
+from datetime import datetime
+from sys import argv
+
+from dateutil.relativedelta import relativedelta
+from dateutil.tz import tzutc
+from gp2gp.spine.sources import construct_messages_from_splunk_items
+from prmdata.utils.date.range import DateTimeRange
+
+from scripts.gp2gp_spine_outcomes import OutcomeCounts
+from scripts.gp2gp_variations import PatternCounts
+from scripts.spine_stream import DEFAULT_IDLE_TIMEOUT, pop_idle_timeout, read_spine_conversations, run_analyses
+from scripts.transfers_exceeding_24h import TransfersExceedingThreshold
+
+
+def analyse_month(month_file_name, next_month_file_name, metric_month, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    time_range = DateTimeRange(metric_month, metric_month + relativedelta(months=1))
+    conversations = read_spine_conversations(
+        [month_file_name, next_month_file_name], construct_messages_from_splunk_items, idle_timeout
+    )
+    return run_analyses(conversations, [
+        OutcomeCounts(time_range),
+        PatternCounts(time_range),
+        TransfersExceedingThreshold(),
+    ])
+
+
+def main():
+    idle_timeout, args = pop_idle_timeout(argv[1:])
+    month_file_name, next_month_file_name, month = args[0], args[1], args[2]
+    metric_month = datetime.strptime(month, "%Y-%m").replace(tzinfo=tzutc())
+    outcome_counts, pattern_counts, transfers_exceeding_24h = analyse_month(
+        month_file_name, next_month_file_name, metric_month, idle_timeout
+    )
+
+    print("Outcomes")
+    for transfer_outcome, count in outcome_counts.items():
+        print(transfer_outcome, count)
+
+    print("Patterns")
+    for pattern, count in pattern_counts.most_common():
+        print(pattern, count)
+
+    print(f"Transfers exceeding 24h: {len(transfers_exceeding_24h)}")
+
+
+if __name__ == "__main__":
+    main()
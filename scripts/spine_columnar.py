@@ -0,0 +1,251 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from prmdata.domain.spine.parsed_conversation import (
+    EHR_REQUEST_STARTED,
+    EHR_REQUEST_COMPLETED,
+    COMMON_POINT_TO_POINT,
+)
+
+from scripts.gp2gp_variations import interaction_abbreviation
+from scripts.spine_stream import DEFAULT_CHUNK_SIZE, SPINE_CSV_COLUMNS
+
+SPLUNK_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"
+NO_ERROR_CODE = -1
+NO_TIME = np.iinfo(np.int64).min
+
+# Odd multiplier for the positional pattern hash, arithmetic wraps at 2**64
+PATTERN_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+SpineTable = namedtuple(
+    "SpineTable",
+    [
+        "time",
+        "conversation",
+        "interaction",
+        "from_party",
+        "error_code",
+        "conversation_ids",
+        "interaction_ids",
+        "party_asids",
+    ],
+)
+
+
+class _Encoder:
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, column, dtype):
+        codes, uniques = pd.factorize(column)
+        mapping = np.empty(len(uniques), dtype=dtype)
+        for i, value in enumerate(uniques):
+            code = self.codes.get(value)
+            if code is None:
+                code = len(self.values)
+                self.codes[value] = code
+                self.values.append(value)
+            mapping[i] = code
+        return mapping[codes]
+
+    def categories(self):
+        return np.array(self.values, dtype=object)
+
+
+def _parse_times(column):
+    return pd.to_datetime(column, format=SPLUNK_TIME_FORMAT, utc=True).values.astype(np.int64)
+
+
+def _parse_error_codes(column):
+    return pd.to_numeric(column, errors="coerce").fillna(NO_ERROR_CODE).values.astype(np.int16)
+
+
+def read_spine_table(file_paths, chunk_size=DEFAULT_CHUNK_SIZE):
+    conversations, interactions, parties = _Encoder(), _Encoder(), _Encoder()
+    columns = {"time": [], "conversation": [], "interaction": [], "from_party": [], "error_code": []}
+
+    for file_path in file_paths:
+        chunks = pd.read_csv(
+            file_path,
+            compression="gzip",
+            dtype=str,
+            keep_default_na=False,
+            usecols=lambda column: column in SPINE_CSV_COLUMNS,
+            chunksize=chunk_size,
+        )
+        for chunk in chunks:
+            columns["time"].append(_parse_times(chunk["_time"]))
+            columns["conversation"].append(conversations.encode(chunk["conversationID"], np.int32))
+            columns["interaction"].append(interactions.encode(chunk["interactionID"], np.int16))
+            columns["from_party"].append(parties.encode(chunk["messageSender"], np.int32))
+            columns["error_code"].append(_parse_error_codes(chunk["jdiEvent"]))
+
+    return sort_by_conversation(SpineTable(
+        conversation_ids=conversations.categories(),
+        interaction_ids=interactions.categories(),
+        party_asids=parties.categories(),
+        **{name: np.concatenate(chunks) if chunks else np.array([], dtype=np.int64)
+           for name, chunks in columns.items()},
+    ))
+
+
+def sort_by_conversation(table):
+    order = np.lexsort((table.time, table.conversation))
+    return table._replace(
+        time=table.time[order],
+        conversation=table.conversation[order],
+        interaction=table.interaction[order],
+        from_party=table.from_party[order],
+        error_code=table.error_code[order],
+    )
+
+
+def conversation_segments(table):
+    if len(table.conversation) == 0:
+        return np.array([], dtype=np.int64)
+    boundaries = np.flatnonzero(np.diff(table.conversation)) + 1
+    return np.concatenate(([0], boundaries))
+
+
+def _interaction_code(table, interaction_id):
+    matches = np.flatnonzero(table.interaction_ids == interaction_id)
+    return matches[0] if len(matches) > 0 else -1
+
+
+def _segment_ids(table, starts):
+    lengths = np.diff(np.append(starts, len(table.conversation)))
+    return np.repeat(np.arange(len(starts)), lengths), lengths
+
+
+def _last_time_of(table, starts, interaction_id):
+    is_interaction = table.interaction == _interaction_code(table, interaction_id)
+    times = np.where(is_interaction, table.time, NO_TIME)
+    return np.maximum.reduceat(times, starts)
+
+
+def conversation_metrics(table, starts=None):
+    # Equivalent to transfers_exceeding_24h.transfer_sla: the latest point-to-point
+    # message measured from the latest EHR request completed message.
+    if starts is None:
+        starts = conversation_segments(table)
+    ends = np.append(starts[1:], len(table.conversation)) - 1
+
+    request_completed = _last_time_of(table, starts, EHR_REQUEST_COMPLETED)
+    last_point_to_point = _last_time_of(table, starts, COMMON_POINT_TO_POINT)
+    has_sla = (request_completed != NO_TIME) & (last_point_to_point != NO_TIME)
+    sla = np.where(has_sla, last_point_to_point - request_completed, NO_TIME)
+
+    return pd.DataFrame({
+        "conversation_id": table.conversation_ids[table.conversation[starts]],
+        "message_count": ends - starts + 1,
+        "start_time": pd.to_datetime(table.time[starts], utc=True),
+        "end_time": pd.to_datetime(table.time[ends], utc=True),
+        "first_interaction": table.interaction_ids[table.interaction[starts]],
+        "last_interaction": table.interaction_ids[table.interaction[ends]],
+        "sla_duration": pd.to_timedelta(np.where(has_sla, sla, 0)).where(has_sla),
+    })
+
+
+def conversation_error_codes(table):
+    has_error = table.error_code != NO_ERROR_CODE
+    pairs = pd.DataFrame({
+        "conversation": table.conversation[has_error],
+        "error_code": table.error_code[has_error],
+    }).drop_duplicates()
+    pairs["conversation_id"] = table.conversation_ids[pairs["conversation"].values]
+    return pairs[["conversation_id", "error_code"]].reset_index(drop=True)
+
+
+def _message_tokens(table, starts):
+    segment, _ = _segment_ids(table, starts)
+    requester = table.from_party[starts][segment]
+    is_sender = (table.from_party != requester).astype(np.int64)
+    # 1 bit for the sender, then 16 each for the interaction and error codes
+    interaction = table.interaction.astype(np.int64)
+    error = table.error_code.view(np.uint16).astype(np.int64)
+    return is_sender | (interaction << 1) | (error << 17)
+
+
+def pattern_signatures(table, starts=None):
+    if starts is None:
+        starts = conversation_segments(table)
+    segment, lengths = _segment_ids(table, starts)
+    position = np.arange(len(segment)) - np.repeat(starts, lengths)
+    return _hash_tokens(_message_tokens(table, starts), starts, lengths, position)
+
+
+def _hash_tokens(tokens, starts, lengths, position):
+    tokens = tokens.astype(np.uint64) + np.uint64(1)
+    with np.errstate(over="ignore"):
+        weights = np.power(PATTERN_HASH_MULTIPLIER, position.astype(np.uint64))
+        signatures = np.add.reduceat(tokens * weights, starts)
+    return signatures ^ lengths.astype(np.uint64)
+
+
+def _render_pattern(table, start, end, requester):
+    codes = []
+    for i in range(start, end):
+        party = "R" if table.from_party[i] == requester else "S"
+        interaction = interaction_abbreviation(table.interaction_ids[table.interaction[i]])
+        error = str(table.error_code[i]) if table.error_code[i] != NO_ERROR_CODE else ""
+        codes.append(party + ":" + interaction + "[" + error + "]")
+    return "-".join(codes)
+
+
+def _pattern_keys(tokens, starts, lengths):
+    # Groups conversations by their token sequence. The 64-bit signatures can
+    # collide, so every conversation is compared token by token with the first one
+    # sharing its signature, and any that differ are keyed on their exact sequence.
+    if len(starts) == 0:
+        return np.array([], dtype=np.int64)
+    segment = np.repeat(np.arange(len(starts)), lengths)
+    position = np.arange(len(segment)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    messages = np.repeat(starts, lengths) + position
+    signatures = _hash_tokens(tokens[messages], np.cumsum(lengths) - lengths, lengths, position)
+
+    _, first, keys = np.unique(signatures, return_index=True, return_inverse=True)
+    representative = first[keys]
+    same_length = lengths == lengths[representative]
+    compared = same_length[segment]
+    differs = np.zeros(len(segment), dtype=bool)
+    differs[compared] = (
+        tokens[messages[compared]]
+        != tokens[starts[representative][segment][compared] + position[compared]]
+    )
+    collided = ~same_length | np.logical_or.reduceat(differs, np.cumsum(lengths) - lengths)
+
+    exact_keys = {}
+    for conversation in np.flatnonzero(collided):
+        sequence = tuple(tokens[starts[conversation]:starts[conversation] + lengths[conversation]])
+        keys[conversation] = exact_keys.setdefault(sequence, len(first) + len(exact_keys))
+    return keys
+
+
+def pattern_counts(table, date_range=None):
+    # Vectorised equivalent of counting gp2gp_variations.extract_pattern over
+    # conversations that start with an EHR request inside date_range.
+    starts = conversation_segments(table)
+    ends = np.append(starts[1:], len(table.conversation))
+    selected = table.interaction[starts] == _interaction_code(table, EHR_REQUEST_STARTED)
+    if date_range is not None:
+        start_times = table.time[starts]
+        selected &= start_times >= pd.Timestamp(date_range.start).value
+        selected &= start_times < pd.Timestamp(date_range.end).value
+
+    selected_starts, selected_ends = starts[selected], ends[selected]
+    keys = _pattern_keys(_message_tokens(table, starts), selected_starts, selected_ends - selected_starts)
+    _, first_index, counts = np.unique(keys, return_index=True, return_counts=True)
+
+    patterns = [
+        _render_pattern(
+            table,
+            selected_starts[i],
+            selected_ends[i],
+            table.from_party[selected_starts[i]],
+        )
+        for i in first_index
+    ]
+    return pd.Series(counts, index=patterns, name="count").sort_values(ascending=False)
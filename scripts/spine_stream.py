@@ -0,0 +1,218 @@
+import warnings
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+from itertools import groupby
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from data.instrumentation import instrument_iterable, stage
+
+SPINE_CSV_COLUMNS = [
+    "_time",
+    "conversationID",
+    "GUID",
+    "interactionID",
+    "messageSender",
+    "messageRecipient",
+    "messageRef",
+    "jdiEvent",
+]
+
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Conversations with no messages for the idle timeout are released, so memory is
+# bounded by the conversations active in that window rather than by the whole
+# input. A conversation whose messages resume after a longer gap is split in two
+# (group_into_conversations would keep it whole); pass None to hold everything
+# until the end of the input and match it exactly.
+TRANSFER_CUTOFF = timedelta(days=14)
+DEFAULT_IDLE_TIMEOUT = TRANSFER_CUTOFF
+# Splunk exports are only roughly in time order, so a conversation is held for
+# this much longer than the idle timeout before being released, and a message
+# up to this far behind the latest one seen still reaches its conversation
+DEFAULT_ALLOWED_LATENESS = timedelta(days=1)
+IDLE_TIMEOUT_FLAG = "--idle-timeout-days"
+
+# Typed layout written by scripts/spine_to_parquet.py, partitioned as
+# month=YYYY-MM/bucket=NN/part-<source>.parquet
+SPINE_PARQUET_SCHEMA = pa.schema([
+    ("time", pa.timestamp("ms", tz="UTC")),
+    ("conversation_id", pa.string()),
+    ("guid", pa.string()),
+    ("interaction_id", pa.dictionary(pa.int32(), pa.string())),
+    ("message_sender", pa.int64()),
+    ("message_recipient", pa.int64()),
+    ("message_ref", pa.string()),
+    ("error_code", pa.int16()),
+])
+SPLUNK_NO_ERROR = "NONE"
+SPLUNK_NO_MESSAGE_REF = "NotProvided"
+
+Conversation = namedtuple("Conversation", ["id", "messages"])
+
+
+def conversation_shards(conversation_ids, shard_count):
+    # pandas' hash is keyed with a fixed seed, so shard numbers are stable across
+    # processes and runs
+    return pd.util.hash_pandas_object(conversation_ids, index=False).values % shard_count
+
+
+def read_spine_csv_chunks(file_paths, chunk_size=DEFAULT_CHUNK_SIZE):
+    for file_path in file_paths:
+        chunks = pd.read_csv(
+            file_path,
+            compression="gzip",
+            dtype=str,
+            keep_default_na=False,
+            usecols=lambda column: column in SPINE_CSV_COLUMNS,
+            chunksize=chunk_size,
+        )
+        for chunk in chunks:
+            yield from chunk.to_dict("records")
+
+
+def _close_conversation(conversation_id, messages):
+    return Conversation(conversation_id, sorted(messages, key=lambda m: m.time))
+
+
+class StreamStats:
+    def __init__(self):
+        self.max_open_conversations = 0
+        self.late_messages = 0
+
+
+def stream_conversations(messages, idle_timeout=DEFAULT_IDLE_TIMEOUT, allowed_lateness=DEFAULT_ALLOWED_LATENESS, stats=None):
+    # Expects messages in roughly ascending time order, e.g. consecutive monthly
+    # exports. The watermark is the latest message time seen; a conversation is
+    # released once the watermark is idle_timeout + allowed_lateness past its
+    # last message. Open conversations are kept ordered by last activity, so the
+    # idle ones are always at the front. Messages further behind the watermark
+    # than allowed_lateness are counted in stats.late_messages and, if their
+    # conversation was already released, start a new one.
+    stats = stats if stats is not None else StreamStats()
+    open_conversations = OrderedDict()
+    watermark = None
+
+    for message in messages:
+        if watermark is None or message.time > watermark:
+            watermark = message.time
+        elif message.time < watermark - allowed_lateness:
+            stats.late_messages += 1
+
+        conversation_id = message.conversation_id
+        if conversation_id in open_conversations:
+            open_conversations[conversation_id][1].append(message)
+            open_conversations.move_to_end(conversation_id)
+        else:
+            open_conversations[conversation_id] = [None, [message]]
+        open_conversations[conversation_id][0] = watermark
+        stats.max_open_conversations = max(stats.max_open_conversations, len(open_conversations))
+
+        if idle_timeout is not None:
+            horizon = watermark - idle_timeout - allowed_lateness
+            while open_conversations:
+                oldest_id, (last_active, oldest_messages) = next(iter(open_conversations.items()))
+                if last_active >= horizon:
+                    break
+                del open_conversations[oldest_id]
+                yield _close_conversation(oldest_id, oldest_messages)
+
+    for conversation_id, (_, conversation_messages) in open_conversations.items():
+        yield _close_conversation(conversation_id, conversation_messages)
+
+    if stats.late_messages:
+        warnings.warn(
+            f"{stats.late_messages} messages were more than {allowed_lateness} behind the latest message; "
+            "sort the input or raise the allowed lateness if conversations were split"
+        )
+
+
+def is_spine_parquet(path):
+    # Either a month=YYYY-MM partition directory or a single converted file
+    return Path(path).is_dir() or str(path).endswith(".parquet")
+
+
+def _bucket_files(month_paths):
+    buckets = {}
+    for month_path in map(Path, month_paths):
+        files = [month_path] if month_path.is_file() else sorted(month_path.glob("bucket=*/*.parquet"))
+        for file in files:
+            buckets.setdefault(file.parent.name, []).append(file)
+    return [buckets[bucket] for bucket in sorted(buckets)]
+
+
+def _splunk_items_from_table(table):
+    # The Splunk export layout, so the same message constructors work on both formats
+    columns = {
+        "_time": pc.strftime(table["time"], format="%Y-%m-%dT%H:%M:%S+0000"),
+        "conversationID": table["conversation_id"],
+        "GUID": table["guid"],
+        "interactionID": table["interaction_id"].cast(pa.string()),
+        "messageSender": pc.fill_null(table["message_sender"].cast(pa.string()), ""),
+        "messageRecipient": pc.fill_null(table["message_recipient"].cast(pa.string()), ""),
+        "messageRef": pc.fill_null(table["message_ref"], SPLUNK_NO_MESSAGE_REF),
+        "jdiEvent": pc.fill_null(table["error_code"].cast(pa.string()), SPLUNK_NO_ERROR),
+    }
+    return pa.table(columns).to_pylist()
+
+
+def _split_idle_conversation(conversation_id, messages, idle_timeout):
+    # stream_conversations releases a conversation once nothing has arrived for
+    # idle_timeout (+ the allowed lateness), so a later message with the same ID
+    # starts a new one. Parquet buckets are sorted, so nothing is late here.
+    start = 0
+    for i in range(1, len(messages)):
+        if idle_timeout is not None and messages[i].time - messages[i - 1].time > idle_timeout + DEFAULT_ALLOWED_LATENESS:
+            yield Conversation(conversation_id, messages[start:i])
+            start = i
+    yield Conversation(conversation_id, messages[start:])
+
+
+def read_spine_parquet_conversations(month_paths, construct_messages, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    # Conversations never span buckets, so each bucket of the given months is read,
+    # put in conversation order and grouped on its own
+    for files in _bucket_files(month_paths):
+        with stage("read") as run:
+            table = pa.concat_tables(pq.read_table(file, schema=SPINE_PARQUET_SCHEMA) for file in files)
+            table = table.take(pc.sort_indices(table, [("conversation_id", "ascending"), ("time", "ascending")]))
+            items = _splunk_items_from_table(table)
+            run.rows_out = len(items)
+        messages = instrument_iterable("construct_messages", construct_messages(items))
+        for conversation_id, conversation_messages in groupby(messages, key=lambda message: message.conversation_id):
+            yield from _split_idle_conversation(conversation_id, list(conversation_messages), idle_timeout)
+
+
+def read_spine_conversations(file_paths, construct_messages, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    # Entry points take either gzipped Splunk exports or converted parquet months
+    if all(is_spine_parquet(path) for path in file_paths):
+        return instrument_iterable(
+            "group", read_spine_parquet_conversations(file_paths, construct_messages, idle_timeout)
+        )
+    items = instrument_iterable("read", read_spine_csv_chunks(file_paths))
+    messages = instrument_iterable("construct_messages", construct_messages(items))
+    return instrument_iterable("group", stream_conversations(messages, idle_timeout))
+
+
+def pop_idle_timeout(args):
+    # Takes "--idle-timeout-days N" out of a script's arguments. 0 holds every
+    # conversation until the end of the input.
+    args = list(args)
+    if IDLE_TIMEOUT_FLAG not in args:
+        return DEFAULT_IDLE_TIMEOUT, args
+    position = args.index(IDLE_TIMEOUT_FLAG)
+    days = float(args[position + 1])
+    del args[position:position + 2]
+    return (timedelta(days=days) if days > 0 else None), args
+
+
+def run_analyses(conversations, analyses):
+    stage_names = [type(analysis).__name__ for analysis in analyses]
+    for conversation in conversations:
+        for analysis, stage_name in zip(analyses, stage_names):
+            with stage(stage_name, rows_in=1, memory=False):
+                analysis.process(conversation)
+    return [analysis.result() for analysis in analyses]
@@ -0,0 +1,112 @@
+import tempfile
+from pathlib import Path
+from sys import argv
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from scripts.spine_stream import (
+    DEFAULT_CHUNK_SIZE,
+    SPINE_CSV_COLUMNS,
+    SPINE_PARQUET_SCHEMA,
+    SPLUNK_NO_ERROR,
+    SPLUNK_NO_MESSAGE_REF,
+    conversation_shards,
+)
+
+DEFAULT_BUCKET_COUNT = 16
+ROW_GROUP_SIZE = 100_000
+SPLUNK_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"
+
+
+def typed_spine_frame(chunk):
+    time = pd.to_datetime(chunk["_time"], format=SPLUNK_TIME_FORMAT, utc=True)
+    return pd.DataFrame({
+        "time": time,
+        "conversation_id": chunk["conversationID"],
+        "guid": chunk["GUID"],
+        "interaction_id": chunk["interactionID"].astype("category"),
+        "message_sender": pd.to_numeric(chunk["messageSender"], errors="coerce").astype("Int64"),
+        "message_recipient": pd.to_numeric(chunk["messageRecipient"], errors="coerce").astype("Int64"),
+        "message_ref": chunk["messageRef"].where(chunk["messageRef"] != SPLUNK_NO_MESSAGE_REF),
+        "error_code": pd.to_numeric(chunk["jdiEvent"].where(chunk["jdiEvent"] != SPLUNK_NO_ERROR), errors="coerce").astype("Int16"),
+    })
+
+
+def _month_labels(time):
+    # Formats only the distinct months rather than every row
+    codes, months = pd.factorize(time.dt.tz_localize(None).values.astype("datetime64[M]"))
+    return pd.Index(months).strftime("%Y-%m").values[codes]
+
+
+def partition_path(output_dir, month, bucket):
+    return Path(output_dir) / f"month={month}" / f"bucket={bucket:02d}"
+
+
+def _stage_partitions(file_path, staging_dir, bucket_count, chunk_size):
+    # First pass: append each chunk's rows to an unsorted file per partition
+    writers = {}
+    try:
+        chunks = pd.read_csv(
+            file_path,
+            compression="gzip",
+            dtype=str,
+            keep_default_na=False,
+            usecols=lambda column: column in SPINE_CSV_COLUMNS,
+            chunksize=chunk_size,
+        )
+        for chunk in chunks:
+            frame = typed_spine_frame(chunk)
+            months = _month_labels(frame["time"])
+            buckets = conversation_shards(frame["conversation_id"], bucket_count)
+            for (month, bucket), rows in frame.groupby([months, buckets], sort=False):
+                table = pa.Table.from_pandas(rows, preserve_index=False).cast(SPINE_PARQUET_SCHEMA)
+                if (month, bucket) not in writers:
+                    staged_path = partition_path(staging_dir, month, bucket) / "staged.parquet"
+                    staged_path.parent.mkdir(parents=True, exist_ok=True)
+                    writers[(month, bucket)] = pq.ParquetWriter(staged_path, SPINE_PARQUET_SCHEMA)
+                writers[(month, bucket)].write_table(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return list(writers)
+
+
+def convert_spine_file(file_path, output_dir, bucket_count=DEFAULT_BUCKET_COUNT, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Each export is written as part-<export name>.parquet in every partition it
+    # has rows for, so converting the same export again replaces its parts.
+    part_name = f"part-{Path(file_path).name.split('.')[0]}.parquet"
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+
+    with tempfile.TemporaryDirectory(dir=output_dir, prefix=".staging-") as staging_dir:
+        for month, bucket in _stage_partitions(file_path, staging_dir, bucket_count, chunk_size):
+            # Second pass, one partition at a time: conversations together, in time order
+            table = pq.read_table(partition_path(staging_dir, month, bucket) / "staged.parquet")
+            table = table.take(pc.sort_indices(table, [("conversation_id", "ascending"), ("time", "ascending")]))
+
+            part_path = partition_path(output_dir, month, bucket) / part_name
+            part_path.parent.mkdir(parents=True, exist_ok=True)
+            pq.write_table(table, part_path.with_suffix(".tmp"), row_group_size=ROW_GROUP_SIZE)
+            part_path.with_suffix(".tmp").replace(part_path)
+            written.append(part_path)
+    return written
+
+
+def spine_parquet_months(output_dir, months):
+    # The partitions an analysis needs, e.g. months=["2021-01", "2021-02"]
+    return [Path(output_dir) / f"month={month}" for month in months]
+
+
+def main():
+    output_dir, file_paths = argv[1], argv[2:]
+    for file_path in file_paths:
+        written = convert_spine_file(file_path, output_dir)
+        print(f"Converted {file_path} into {len(written)} partitions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import csv
+import gzip
+import heapq
+import json
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dateutil.tz import tzutc
+
+import data
+from scripts.spine_stream import SPINE_CSV_COLUMNS
+
+EHR_REQUEST_STARTED = "urn:nhs:names:services:gp2gp/RCMR_IN010000UK05"
+EHR_REQUEST_COMPLETED = "urn:nhs:names:services:gp2gp/RCMR_IN030000UK06"
+APPLICATION_ACK = "urn:nhs:names:services:gp2gp/MCCI_IN010000UK13"
+COMMON_POINT_TO_POINT = "urn:nhs:names:services:gp2gp/COPC_IN000001UK01"
+
+SPLUNK_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+DEFAULT_START = datetime(2021, 1, 1, tzinfo=tzutc())
+DEFAULT_PRACTICE_COUNT = 2000
+DEFAULT_SUPPLIERS = ["EMIS", "TPP", "Vision"]
+
+
+class SyntheticConfig:
+    def __init__(
+            self,
+            conversation_count,
+            start=DEFAULT_START,
+            days=59,
+            seed=0,
+            practice_count=DEFAULT_PRACTICE_COUNT,
+            error_rate=0.1,
+            error_code_weights=None,
+            pending_rate=0.1,
+            point_to_point_rate=0.3,
+            long_conversation_rate=0.0005,
+            long_conversation_length=500,
+    ):
+        self.conversation_count = conversation_count
+        self.start = start
+        self.days = days
+        self.seed = seed
+        self.practice_count = practice_count
+        self.error_rate = error_rate
+        self.error_code_weights = error_code_weights or default_error_code_weights()
+        self.pending_rate = pending_rate
+        self.point_to_point_rate = point_to_point_rate
+        self.long_conversation_rate = long_conversation_rate
+        self.long_conversation_length = long_conversation_length
+
+
+def default_error_code_weights():
+    error_codes = data.gp2gp_response_codes.load()["ErrorCode"].dropna().astype(int)
+    return {error_code: 1 for error_code in error_codes}
+
+
+def expected_messages_per_conversation(config):
+    # Mean of what _conversation_messages generates: the request and the EHR, a
+    # mean of 10.5 point-to-point messages in point_to_point_rate of ordinary
+    # conversations, and an acknowledgement unless the transfer is left pending
+    point_to_point = (
+        config.long_conversation_rate * config.long_conversation_length
+        + (1 - config.long_conversation_rate) * config.point_to_point_rate * 10.5
+    )
+    return 2 + point_to_point + (1 - config.pending_rate)
+
+
+def _asid(practice_number):
+    return str(200000000000 + practice_number)
+
+
+def _practice_ods_code(practice_number):
+    return f"P{practice_number:05d}"
+
+
+def _splunk_time(time):
+    return time.strftime(SPLUNK_TIME_FORMAT)[:-3] + "+0000"
+
+
+def _message(time, conversation_id, guid, interaction_id, sender, recipient, message_ref="NotProvided", error_code=None):
+    return (time, {
+        "_time": _splunk_time(time),
+        "conversationID": conversation_id,
+        "GUID": guid,
+        "interactionID": interaction_id,
+        "messageSender": sender,
+        "messageRecipient": recipient,
+        "messageRef": message_ref,
+        "jdiEvent": "NONE" if error_code is None else str(error_code),
+    })
+
+
+def _conversation_messages(rng, config, conversation_number, start_time, error_codes, error_weights):
+    conversation_id = f"{conversation_number:08X}-SYNTHETIC-{config.seed}"
+    requester_number, sender_number = rng.sample(range(config.practice_count), 2)
+    requester, sender = _asid(requester_number), _asid(sender_number)
+
+    def error():
+        if rng.random() < config.error_rate:
+            return rng.choices(error_codes, error_weights)[0]
+        return None
+
+    messages = [_message(start_time, conversation_id, f"{conversation_id}-RQS", EHR_REQUEST_STARTED, requester, sender)]
+
+    time = start_time + timedelta(seconds=rng.randint(1, 600))
+    ehr_guid = f"{conversation_id}-RQC"
+    messages.append(_message(time, conversation_id, ehr_guid, EHR_REQUEST_COMPLETED, sender, requester))
+
+    if rng.random() < config.long_conversation_rate:
+        point_to_point_count = config.long_conversation_length
+    elif rng.random() < config.point_to_point_rate:
+        point_to_point_count = rng.randint(1, 20)
+    else:
+        point_to_point_count = 0
+
+    for i in range(point_to_point_count):
+        time += timedelta(seconds=rng.randint(1, 3600))
+        messages.append(_message(
+            time, conversation_id, f"{conversation_id}-COPC-{i}", COMMON_POINT_TO_POINT, sender, requester,
+            error_code=error(),
+        ))
+
+    if rng.random() >= config.pending_rate:
+        time += timedelta(hours=rng.expovariate(1 / 48))
+        messages.append(_message(
+            time, conversation_id, f"{conversation_id}-ACK", APPLICATION_ACK, requester, sender,
+            message_ref=ehr_guid, error_code=error(),
+        ))
+    return messages
+
+
+def generate_spine_messages(config):
+    # Yields Splunk rows in time order. Messages for conversations that have started
+    # wait in a heap, so memory is bounded by the number of open conversations.
+    rng = random.Random(config.seed)
+    error_codes = list(config.error_code_weights)
+    error_weights = [config.error_code_weights[code] for code in error_codes]
+    mean_gap_seconds = config.days * 86400 / max(config.conversation_count, 1)
+
+    pending = []
+    time = config.start
+    for conversation_number in range(config.conversation_count):
+        time += timedelta(seconds=rng.expovariate(1 / mean_gap_seconds))
+        while pending and pending[0][0] <= time:
+            yield heapq.heappop(pending)[2]
+        for message_number, (message_time, row) in enumerate(
+                _conversation_messages(rng, config, conversation_number, time, error_codes, error_weights)):
+            heapq.heappush(pending, (message_time, (conversation_number, message_number), row))
+
+    while pending:
+        yield heapq.heappop(pending)[2]
+
+
+def write_spine_csv_gz_files(config, output_dir):
+    # One file per calendar month, named like the monthly Splunk exports
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    files, message_counts = [], []
+    current_month, current_file, writer = None, None, None
+
+    for row in generate_spine_messages(config):
+        month = row["_time"][:7]
+        if month != current_month:
+            if current_file is not None:
+                current_file.close()
+            path = output_dir / f"spine_messages_{month}.csv.gz"
+            current_file = gzip.open(path, "wt", newline="")
+            writer = csv.DictWriter(current_file, fieldnames=SPINE_CSV_COLUMNS)
+            writer.writeheader()
+            files.append(path)
+            message_counts.append(0)
+            current_month = month
+        writer.writerow(row)
+        message_counts[-1] += 1
+
+    if current_file is not None:
+        current_file.close()
+    return files, message_counts
+
+
+def write_attachment_csv_files(config, output_dir, mean_attachments_per_ehr=5):
+    rng = random.Random(config.seed)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    content_types = ["application/pdf", "image/jpeg", "text/plain", "image/tiff", "application/msword"]
+    systems = DEFAULT_SUPPLIERS
+
+    with open(output_dir / "attachment_metadata.csv", "w", newline="") as attachments_file, \
+            open(output_dir / "gp2gp_messages.csv", "w", newline="") as messages_file:
+        attachments = csv.writer(attachments_file)
+        messages = csv.writer(messages_file)
+        attachments.writerow([
+            "_time", "attachmentId", "conversationID", "FromSystem", "ToSystem", "attachmentType",
+            "compressed", "contentType", "largeAttachment", "length", "originalBase64", "internalID",
+        ])
+        messages.writerow(["_time", "conversationID", "internalID", "interactionID"])
+
+        attachment_count = 0
+        for conversation_number in range(config.conversation_count):
+            time = config.start + timedelta(seconds=rng.uniform(0, config.days * 86400))
+            conversation_id = f"{conversation_number:08X}-SYNTHETIC-{config.seed}"
+            internal_id = f"{conversation_id}-RQC"
+            from_system, to_system = rng.choice(systems), rng.choice(systems)
+            messages.writerow([_splunk_time(time), conversation_id, internal_id, EHR_REQUEST_COMPLETED])
+
+            for i in range(int(rng.expovariate(1 / mean_attachments_per_ehr))):
+                length = "Unknown" if rng.random() < 0.01 else str(int(rng.lognormvariate(11, 2)))
+                attachments.writerow([
+                    _splunk_time(time), f"{internal_id}-ATT-{i}", conversation_id, from_system, to_system,
+                    rng.choice(["Embedded", "External"]), rng.choice(["Yes", "No"]), rng.choice(content_types),
+                    rng.choice(["Yes", "No"]), length, rng.choice(["Yes", "No", "Unknown"]), internal_id,
+                ])
+                attachment_count += 1
+
+    return output_dir, attachment_count
+
+
+def write_ods_metadata_json(path, practice_count=DEFAULT_PRACTICE_COUNT, ccg_count=100, seed=0, generated_on=DEFAULT_START):
+    # generated_on is fixed rather than the current time, so the same seed always
+    # writes the same file
+    rng = random.Random(seed)
+    practices = [
+        {
+            "ods_code": _practice_ods_code(number),
+            "name": f"Synthetic Practice {number}",
+            "asids": [_asid(number)] + [_asid(practice_count + number * 3 + i) for i in range(rng.randint(0, 2))],
+        }
+        for number in range(practice_count)
+    ]
+    ccgs = [
+        {
+            "ods_code": f"{number:02d}X",
+            "name": f"Synthetic CCG {number}",
+            "practices": [_practice_ods_code(p) for p in range(number, practice_count, ccg_count)],
+        }
+        for number in range(ccg_count)
+    ]
+    with open(path, "w") as f:
+        json.dump({"generated_on": generated_on.isoformat(), "practices": practices, "ccgs": ccgs}, f)
+    return path
@@ -0,0 +1,292 @@
+import re
+import warnings
+from pathlib import Path
+from sys import argv
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from gp2gp.spine.sources import construct_messages_from_splunk_items
+
+from data.instrumentation import stage
+from data.outcome_cube import MISSING_VALUE, sla_seconds
+from data.s3_cache import default_cache
+from data.transfers import load_transfer_files
+from scripts.gp2gp_spine_outcomes import OutcomeTransfers
+from scripts.spine_stream import DEFAULT_IDLE_TIMEOUT, read_spine_conversations, run_analyses
+
+# Daily transfer counts and SLA sums per practice, supplier pair and status. Every
+# transfer is counted twice, once against its requesting practice and once
+# against its sending practice (side), so practice-level series for either role
+# come from the same table; filter on one side for totals.
+SIDES = {
+    "requesting": "requesting_practice_asid",
+    "sending": "sending_practice_asid",
+}
+ROLLUP_DIMENSIONS = ["day", "side", "practice_asid", "requesting_supplier", "sending_supplier", "status"]
+ROLLUP_MEASURES = ["number_of_transfers", "sla_duration_seconds_sum", "sla_duration_count"]
+ROLLUP_TRANSFER_COLUMNS = [
+    "date_requested",
+    "requesting_practice_asid",
+    "sending_practice_asid",
+    "requesting_supplier",
+    "sending_supplier",
+    "status",
+    "sla_duration",
+]
+# Rollups from transfers parquet files and from Spine outcomes are kept apart,
+# as they classify statuses differently
+TRANSFERS_SOURCE = "transfers"
+SPINE_SOURCE = "spine"
+FREQUENCIES = ["day", "week", "month", "quarter", "year"]
+LOOKUP_COLUMNS = ["practice_ods_code", "practice_name", "ccg_ods_code", "ccg_name"]
+# Transfers files are named like data.transfers.TRANSFERS_PATH_TEMPLATE
+TRANSFERS_FILE_MONTH_PATTERN = re.compile(r"(\d{4})-(\d{1,2})-transfers")
+
+CREATE_ROLLUPS_TABLE_STATEMENT = """
+    CREATE TABLE IF NOT EXISTS transfer_daily_rollups (
+            source VARCHAR,
+            month VARCHAR,
+            day DATE,
+            side VARCHAR,
+            practice_asid VARCHAR,
+            requesting_supplier VARCHAR,
+            sending_supplier VARCHAR,
+            status VARCHAR,
+            number_of_transfers BIGINT,
+            sla_duration_seconds_sum DOUBLE,
+            sla_duration_count BIGINT
+    );
+"""
+
+CREATE_ASID_LOOKUP_TABLE_STATEMENT = """
+    CREATE TABLE IF NOT EXISTS asid_lookup (
+            asid VARCHAR,
+            practice_ods_code VARCHAR,
+            practice_name VARCHAR,
+            ccg_ods_code VARCHAR,
+            ccg_name VARCHAR
+    );
+"""
+
+CREATE_ROLLUPS_WITH_PRACTICES_VIEW_STATEMENT = """
+    CREATE OR REPLACE VIEW transfer_daily_rollups_with_practices AS
+    SELECT
+        rollups.*,
+        asid_lookup.practice_ods_code,
+        asid_lookup.practice_name,
+        asid_lookup.ccg_ods_code,
+        asid_lookup.ccg_name
+    FROM transfer_daily_rollups AS rollups
+    LEFT JOIN asid_lookup ON asid_lookup.asid = rollups.practice_asid;
+"""
+
+
+def create_rollups_schema(cursor):
+    cursor.execute(CREATE_ROLLUPS_TABLE_STATEMENT)
+    cursor.execute(CREATE_ASID_LOOKUP_TABLE_STATEMENT)
+    cursor.execute(CREATE_ROLLUPS_WITH_PRACTICES_VIEW_STATEMENT)
+
+
+def _text(values):
+    return pd.Series(values).astype(object).where(pd.Series(values).notna(), MISSING_VALUE).astype(str).values
+
+
+def daily_rollups(transfers, date_column="date_requested"):
+    # One row per month, day, side, practice, supplier pair and status that occurs.
+    # Transfers with no date can't be put in a day or month, so they are left out
+    # and reported, as rollup totals will be below the transfer count by that much.
+    undated = pd.to_datetime(transfers[date_column]).isna()
+    if undated.any():
+        warnings.warn(f"{undated.sum()} transfers without a {date_column} left out of the daily rollups")
+        transfers = transfers[~undated.values]
+
+    with stage("daily_rollups", rows_in=len(transfers)) as run:
+        days = pd.to_datetime(transfers[date_column]).dt.tz_localize(None).values.astype("datetime64[D]")
+        sla_duration_seconds = sla_seconds(transfers["sla_duration"]) if "sla_duration" in transfers else pd.Series(np.nan, index=transfers.index)
+        shared = {
+            "day": days,
+            "requesting_supplier": _text(transfers["requesting_supplier"]) if "requesting_supplier" in transfers else MISSING_VALUE,
+            "sending_supplier": _text(transfers["sending_supplier"]) if "sending_supplier" in transfers else MISSING_VALUE,
+            "status": _text(transfers["status"]),
+            "sla_duration_seconds": sla_duration_seconds.values,
+        }
+        frames = [
+            pd.DataFrame({
+                **shared,
+                "side": side,
+                "practice_asid": _text(transfers[asid_column]) if asid_column in transfers else MISSING_VALUE,
+            })
+            for side, asid_column in SIDES.items()
+        ]
+        rows = pd.concat(frames, ignore_index=True)
+        rollups = rows.groupby(ROLLUP_DIMENSIONS, sort=True).agg(
+            number_of_transfers=("status", "size"),
+            sla_duration_seconds_sum=("sla_duration_seconds", "sum"),
+            sla_duration_count=("sla_duration_seconds", "count"),
+        ).reset_index()
+        rollups.insert(0, "month", pd.Index(rollups["day"].values.astype("datetime64[M]")).strftime("%Y-%m"))
+        run.rows_out = len(rollups)
+    return rollups
+
+
+def replace_months(cursor, rollups, source, months):
+    # Replaces the months (YYYY-MM) that were rebuilt, so re-processing a month, or
+    # processing a corrected copy of it, never double counts. Rollups outside those
+    # months are left out: a file's few transfers from a neighbouring month are
+    # only part of that month, which is rebuilt from its own file.
+    create_rollups_schema(cursor)
+    months = sorted(months)
+    rollups = rollups[rollups["month"].isin(months)]
+    cursor.execute("BEGIN TRANSACTION")
+    try:
+        for month in months:
+            cursor.execute("DELETE FROM transfer_daily_rollups WHERE source = ? AND month = ?", [source, month])
+        cursor.register("new_rollups", rollups)
+        cursor.execute(f"""
+            INSERT INTO transfer_daily_rollups
+            SELECT '{source}', month, day, side, practice_asid, requesting_supplier, sending_supplier, status,
+                number_of_transfers, sla_duration_seconds_sum, sla_duration_count
+            FROM new_rollups
+        """)
+        cursor.unregister("new_rollups")
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    return months
+
+
+def transfers_file_month(path, rollups):
+    # The month a transfers file holds: from its name, or for files named some
+    # other way, the month most of its transfers were requested in
+    match = TRANSFERS_FILE_MONTH_PATTERN.search(Path(str(path)).name)
+    if match:
+        return f"{match.group(1)}-{int(match.group(2)):02d}"
+    return rollups.groupby("month")["number_of_transfers"].sum().idxmax()
+
+
+def update_from_transfer_files(cursor, paths, use_cache=True):
+    # One transfers file (a month) at a time, so memory stays at one month
+    months = []
+    for path in paths:
+        transfers = load_transfer_files([path], columns=_transfer_columns(path, use_cache), use_cache=use_cache)
+        rollups = daily_rollups(transfers)
+        if len(rollups) == 0:
+            continue
+        months.extend(replace_months(cursor, rollups, TRANSFERS_SOURCE, [transfers_file_month(path, rollups)]))
+    return months
+
+
+def _transfer_columns(path, use_cache):
+    # Older transfers versions lack some of the columns; those roll up as N/A
+    local_path = default_cache().local_path(path) if use_cache and path.startswith("s3://") else path
+    available = set(pq.read_schema(local_path).names)
+    return [column for column in ROLLUP_TRANSFER_COLUMNS if column in available]
+
+
+def update_from_spine(cursor, month_file_name, next_month_file_name, time_range, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    conversations = read_spine_conversations(
+        [month_file_name, next_month_file_name], construct_messages_from_splunk_items, idle_timeout
+    )
+    [transfers] = run_analyses(conversations, [OutcomeTransfers(time_range)])
+    return replace_months(cursor, daily_rollups(transfers), SPINE_SOURCE, _months_in(time_range))
+
+
+def _utc_month(time):
+    time = pd.Timestamp(time)
+    if time.tzinfo is not None:
+        time = time.tz_convert("UTC").tz_localize(None)
+    return time.to_period("M")
+
+
+def _months_in(time_range):
+    last = _utc_month(pd.Timestamp(time_range.end) - pd.Timedelta(1, "ns"))
+    return list(pd.period_range(_utc_month(time_range.start), last, freq="M").strftime("%Y-%m"))
+
+
+def store_asid_lookup(cursor, asid_lookup):
+    # asid_lookup as returned by data.practice_metadata.read_asid_metadata
+    create_rollups_schema(cursor)
+    lookup = asid_lookup.reset_index()
+    lookup = pd.DataFrame({
+        "asid": lookup["asid"].astype(str),
+        **{column: lookup[column].astype(object).where(lookup[column].notna(), None) for column in LOOKUP_COLUMNS},
+    })
+    cursor.execute("BEGIN TRANSACTION")
+    try:
+        cursor.execute("DELETE FROM asid_lookup")
+        cursor.register("new_asid_lookup", lookup)
+        cursor.execute("INSERT INTO asid_lookup SELECT * FROM new_asid_lookup")
+        cursor.unregister("new_asid_lookup")
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+
+def rollup_months(cursor, source=TRANSFERS_SOURCE):
+    return [
+        month for (month,) in cursor.execute(
+            "SELECT DISTINCT month FROM transfer_daily_rollups WHERE source = ? ORDER BY month", [source]
+        ).fetchall()
+    ]
+
+
+def time_series(cursor, frequency="day", by=(), side="requesting", source=TRANSFERS_SOURCE, start=None, end=None, **filters):
+    # Transfer counts, SLA sums and mean SLA per period, e.g.
+    # time_series(cursor, "month", by=["status"], ccg_ods_code="03W")
+    # Filtering or grouping on practice_ods_code/ccg_ods_code etc. uses the ASID lookup.
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Unknown frequency: {frequency}")
+    allowed = ROLLUP_DIMENSIONS[1:] + LOOKUP_COLUMNS
+    for column in list(by) + list(filters):
+        if column not in allowed:
+            raise ValueError(f"Unknown rollup column: {column}")
+
+    table = "transfer_daily_rollups_with_practices" if set(LOOKUP_COLUMNS) & (set(by) | set(filters)) else "transfer_daily_rollups"
+    conditions, parameters = ["source = ?", "side = ?"], [source, side]
+    if start is not None:
+        conditions.append("day >= CAST(? AS DATE)")
+        parameters.append(str(start))
+    if end is not None:
+        conditions.append("day < CAST(? AS DATE)")
+        parameters.append(str(end))
+    for column, value in filters.items():
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        conditions.append(f"{column} IN ({', '.join('?' for _ in values)})")
+        parameters.extend(values)
+
+    group_columns = ["period"] + list(by)
+    series = cursor.execute(
+        f"""
+        SELECT
+            CAST(date_trunc('{frequency}', day) AS DATE) AS period,
+            {"".join(f"{column}, " for column in by)}
+            sum(number_of_transfers) AS number_of_transfers,
+            sum(sla_duration_seconds_sum) AS sla_duration_seconds_sum,
+            sum(sla_duration_count) AS sla_duration_count
+        FROM {table}
+        WHERE {" AND ".join(conditions)}
+        GROUP BY {", ".join(group_columns)}
+        ORDER BY {", ".join(group_columns)}
+        """,
+        parameters,
+    ).df()
+    series["mean_sla_duration_seconds"] = series["sla_duration_seconds_sum"] / series["sla_duration_count"].where(series["sla_duration_count"] > 0)
+    return series
+
+
+def main():
+    # <database file> <transfers parquet files...>
+    database_file, paths = argv[1], argv[2:]
+    cursor = duckdb.connect(database_file)
+    months = update_from_transfer_files(cursor, paths)
+    print(f"Rolled up {len(months)} months of transfers")
+    print(time_series(cursor, "month", by=["status"]).to_string())
+    cursor.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,65 @@
 from gp2gp.spine.models import COMMON_POINT_TO_POINT, EHR_REQUEST_COMPLETED
 from sys import argv
-from gp2gp.io.csv import read_gzip_csv_files
 from gp2gp.spine.sources import construct_messages_from_splunk_items
 from gp2gp.spine.transformers import (
     group_into_conversations,
     parse_conversation,
 )
 
+from scripts.spine_stream import DEFAULT_IDLE_TIMEOUT, pop_idle_timeout, read_spine_conversations, run_analyses
+
+TWENTY_FOUR_HOURS_IN_SECONDS = 86400
+
 
 def parse_conversations(conversations):
-    return [parse_conversation(conversation)
-            for conversation in conversations
-            if parse_conversation(conversation) is not None]
+    parsed_conversations = (parse_conversation(conversation) for conversation in conversations)
+    return [parsed for parsed in parsed_conversations if parsed is not None]
 
 
 def process_messages(messages):
     return group_into_conversations(messages)
 
 
+def transfer_sla(conversation):
+    start = None
+    point_to_point_messages_time = []
+
+    for message in conversation.messages:
+        if message.interaction_id == EHR_REQUEST_COMPLETED:
+            start = message.time
+
+        if message.interaction_id == COMMON_POINT_TO_POINT:
+            point_to_point_messages_time.append(message.time)
+
+    if start is not None and len(point_to_point_messages_time) > 0:
+        return max(point_to_point_messages_time) - start
+    return None
+
+
+class TransfersExceedingThreshold:
+    def __init__(self, threshold_in_seconds=TWENTY_FOUR_HOURS_IN_SECONDS):
+        self.threshold_in_seconds = threshold_in_seconds
+        self.conversation_ids = []
+
+    def process(self, conversation):
+        sla = transfer_sla(conversation)
+        if sla is not None and sla.total_seconds() > self.threshold_in_seconds:
+            self.conversation_ids.append(conversation.id)
+
+    def result(self):
+        return self.conversation_ids
+
+
+def find_transfers_exceeding_24h(input_file_names, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    conversations = read_spine_conversations(input_file_names, construct_messages_from_splunk_items, idle_timeout)
+    [transfers_exceeding_24h] = run_analyses(conversations, [TransfersExceedingThreshold()])
+    return transfers_exceeding_24h
+
+
 def main():
-    input_file_name = argv[1]
-    csv_file_content = read_gzip_csv_files([input_file_name])
-    print("Content extracted from gzip file")
-    spine_messages = construct_messages_from_splunk_items(csv_file_content)
-    print("Messages constructed")
-    conversations = process_messages(spine_messages)
-    print("Conversations constructed")
-
-    transfers_exceeding_24h = []
-    for conversation in conversations:
-        sla = None
-        start = None
-        point_to_point_messages_time = []
-
-        for message in conversation.messages:
-            if message.interaction_id == EHR_REQUEST_COMPLETED:
-                start = message.time
-
-            if message.interaction_id == COMMON_POINT_TO_POINT:
-                point_to_point_messages_time.append(message.time)
-
-        if start is not None and len(point_to_point_messages_time) > 0:
-            point_to_point_messages_time.sort()
-            sla = point_to_point_messages_time[-1] - start
-
-        if sla is not None and sla.total_seconds() > 86400:
-            transfers_exceeding_24h.append(conversation.id)
+    idle_timeout, args = pop_idle_timeout(argv[1:])
+    input_file_name = args[0]
+    transfers_exceeding_24h = find_transfers_exceeding_24h([input_file_name], idle_timeout)
 
     return transfers_exceeding_24h
 
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from data.asid_lookup import AsidLookup, CcgMembership
+
+MAPPING = pd.DataFrame({
+    "ODSCode": ["A1", "A1", "B2", "C3", "D4", "E5"],
+    "ParentODSCode": ["00A", "00B", "00C", "00D", "00E", "00F"],
+    "JoinParentDate": ["2019-04-01", "2020-04-01", "2018-01-01", None, "1965-06-01", "2021-01-01"],
+    "LeftParentDate": ["2020-03-31", None, "2020-12-31", None, None, "2021-01-01"],
+})
+
+
+def _parents(practices, dates):
+    membership = CcgMembership.from_gp_ccg_mapping(MAPPING)
+    return list(membership.parent_at(pd.Series(practices), pd.Series(pd.to_datetime(dates))).astype(object))
+
+
+def test_parent_at_follows_membership_dates():
+    assert _parents(
+        ["A1", "A1", "A1", "A1", "B2", "B2", "E5", "E5"],
+        ["2019-03-31", "2019-04-01", "2020-03-31", "2022-01-01", "2020-12-31", "2021-01-01", "2021-01-01", "2021-01-02"],
+    ) == [np.nan, "00A", "00A", "00B", "00C", np.nan, "00F", np.nan]
+
+
+def test_memberships_without_a_join_date_are_left_out():
+    membership = CcgMembership.from_gp_ccg_mapping(MAPPING)
+
+    assert list(membership.parent_ods_codes.astype(object)) == ["00A", "00B", "00C", "00E", "00F"]
+    assert (np.diff(membership.keys) > 0).all()
+    assert _parents(["C3", "B2", "A1"], ["2020-06-01", "2019-06-01", "2019-06-01"]) == [np.nan, "00C", "00A"]
+
+
+def test_join_dates_before_the_epoch():
+    assert _parents(["D4", "D4"], ["1965-05-31", "1990-01-01"]) == [np.nan, "00E"]
+
+
+def test_missing_dates_and_practices_are_not_found():
+    assert _parents(["A1", "Z9"], [None, "2020-06-01"]) == [np.nan, np.nan]
+
+
+def test_asid_lookup_positions():
+    metadata = pd.DataFrame({
+        "asid": ["300", "100", "200"],
+        "practice_ods_code": ["C3", "A1", "B2"],
+        "practice_name": ["C", "A", "B"],
+        "ccg_ods_code": ["00D", "00A", "00C"],
+        "ccg_name": ["D", "A", "C"],
+    }).set_index("asid")
+    transfers = pd.DataFrame({"requesting_practice_asid": ["200", "999"], "sending_practice_asid": [None, "300"]})
+
+    enriched = AsidLookup.from_asid_metadata(metadata).enrich(transfers)
+
+    assert list(enriched["requesting_practice_ods_code"].astype(object)) == ["B2", np.nan]
+    assert list(enriched["sending_ccg_ods_code"].astype(object)) == [np.nan, "00D"]
@@ -0,0 +1,95 @@
+from datetime import datetime
+from pathlib import Path
+
+import duckdb
+import pytest
+
+from scripts.athena_local import (
+    ATHENA_SQL_DIR,
+    attachment_parity,
+    create_mi_views,
+    run_athena_sql_file,
+)
+from scripts.attachments import ingest_attachments_data
+
+FIXTURES = Path(__file__).parent / "fixtures"
+# Two exports of the same month: the second resends rows of the first (one of
+# them without an internal ID), and times carry a +0100 offset as in BST
+ATTACHMENT_EXPORTS = FIXTURES / "attachments"
+MI_FILES = str(FIXTURES / "mi" / "Stats*.dat")
+
+
+@pytest.fixture
+def attachments_db():
+    cursor = duckdb.connect()
+    ingest_attachments_data(cursor, [ATTACHMENT_EXPORTS])
+    yield cursor
+    cursor.close()
+
+
+def test_local_attachment_views_match_the_athena_sql(attachments_db):
+    parity, removed = attachment_parity(attachments_db, [ATTACHMENT_EXPORTS])
+
+    assert parity == {
+        "gp2gp_attachments": {"only_local": 0, "only_athena": 0},
+        "gp2gp_ehr_attachment_summary": {"only_local": 0, "only_athena": 0},
+    }
+    assert removed == {"gp2gp_attachment_metadata": 2, "gp2gp_attachment_messages": 2}
+    assert attachments_db.execute("SELECT count(*) FROM attachment_metadata").fetchone()[0] == 6
+    assert attachments_db.execute("SELECT count(*) FROM gp2gp_messages").fetchone()[0] == 5
+
+
+def test_attachment_outputs(attachments_db):
+    attachment_parity(attachments_db, [ATTACHMENT_EXPORTS])
+
+    summary = attachments_db.execute(
+        "SELECT internal_id, attachment_count FROM gp2gp_ehr_attachment_summary ORDER BY internal_id NULLS FIRST"
+    ).fetchall()
+    attachments = attachments_db.execute(
+        "SELECT attachment_id, time, length, compressed FROM gp2gp_attachments ORDER BY attachment_id"
+    ).fetchall()
+
+    assert summary == [(None, 0), ("ehr-1", 2), ("ehr-2", 1), ("ehr-5", 1)]
+    assert attachments == [
+        ("att-1", datetime(2021, 6, 1, 9, 0), 100, False),
+        ("att-2", datetime(2021, 6, 1, 9, 0, 1), 2000000, True),
+        ("att-3", datetime(2021, 6, 30, 23, 30), None, False),
+        ("att-6", datetime(2021, 7, 1, 0, 15), 20, None),
+    ]
+
+
+def test_parity_reports_rows_missing_locally(attachments_db):
+    attachments_db.execute("DELETE FROM attachment_metadata WHERE attachment_id = 'att-1'")
+
+    parity, _ = attachment_parity(attachments_db, [ATTACHMENT_EXPORTS])
+
+    assert parity["gp2gp_attachments"] == {"only_local": 0, "only_athena": 1}
+    assert parity["gp2gp_ehr_attachment_summary"] == {"only_local": 1, "only_athena": 1}
+
+
+def test_mi_views():
+    cursor = duckdb.connect()
+    create_mi_views(cursor, MI_FILES)
+
+    assert cursor.execute("SELECT count(*) FROM mi_hr").fetchone()[0] == 7
+    assert cursor.execute("SELECT count(*) FROM mi_rr").fetchone()[0] == 1
+    assert sorted(cursor.execute('SELECT "RequestorODS", "ReportTimePeriod" FROM mi_fr').fetchall()) == [
+        ("A12345", "6"), ("C11111", "6"), ("D22222", "7"), ("E33333", "11"),
+    ]
+    assert cursor.execute(
+        'SELECT "ConversationID", "ExtractMessageID", "PlaceholdersUndeterminedReason" FROM mi_sr'
+    ).fetchall() == [("conv-1", "ehr-1", "0")]
+
+
+def test_mi_validation_queries():
+    cursor = duckdb.connect()
+    create_mi_views(cursor, MI_FILES)
+
+    headers = run_athena_sql_file(cursor, "count_number_of_headers.sql")
+    unique_ods_codes = run_athena_sql_file(cursor, "count_unique_ods_codes.sql")
+    cursor.execute((ATHENA_SQL_DIR / "create_view_with_unique_ods_codes.sql").read_text())
+    matching_ods_codes = run_athena_sql_file(cursor, "compare_unique_full_month_ods_codes.sql")
+
+    assert dict(zip(headers["ods_code"], headers["header_count"])) == {"A12345": 2, "C11111": 1}
+    assert unique_ods_codes.iloc[0, 0] == 3
+    assert matching_ods_codes.iloc[0, 0] == 2
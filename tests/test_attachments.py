@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import duckdb
+import pytest
+
+from scripts.attachments import ingest_attachments_data
+
+ATTACHMENT_METADATA_HEADER = (
+    "_time,attachmentId,conversationID,FromSystem,ToSystem,attachmentType,compressed,"
+    "contentType,largeAttachment,length,originalBase64,internalID"
+)
+ATTACHMENT_ROWS = [
+    "2021-06-30T23:30:00.000+0100,att-1,conv-1,EMIS,TPP,External,No,text/plain,Yes,100,No,ehr-1",
+    "2021-01-15T10:00:00.000+0000,att-2,conv-2,TPP,EMIS,External,Yes,text/plain,No,Unknown,Unknown,",
+]
+GP2GP_MESSAGES_HEADER = "_time,conversationID,internalID,interactionID"
+GP2GP_MESSAGE_ROWS = [
+    "2021-06-30T23:29:00.000+0100,conv-1,ehr-1,urn:nhs:names:services:gp2gp/RCMR_IN030000UK06",
+]
+
+
+def _write(directory, name, header, rows):
+    directory.mkdir(exist_ok=True)
+    (directory / name).write_text("\n".join([header] + rows) + "\n")
+
+
+@pytest.fixture
+def export_dir(tmp_path):
+    directory = tmp_path / "exports"
+    _write(directory, "attachment_metadata.csv", ATTACHMENT_METADATA_HEADER, ATTACHMENT_ROWS)
+    _write(directory, "gp2gp_messages.csv", GP2GP_MESSAGES_HEADER, GP2GP_MESSAGE_ROWS)
+    return directory
+
+
+def test_times_keep_the_exported_local_time(export_dir):
+    cursor = duckdb.connect()
+    ingest_attachments_data(cursor, [export_dir])
+
+    times = dict(cursor.execute("SELECT attachment_id, time FROM attachment_metadata").fetchall())
+
+    assert times["att-1"] == datetime(2021, 6, 30, 23, 30)
+    assert times["att-2"] == datetime(2021, 1, 15, 10, 0)
+
+
+def test_rows_without_an_internal_id_are_not_reloaded(export_dir):
+    cursor = duckdb.connect()
+    ingest_attachments_data(cursor, [export_dir])
+    extra_row = "2021-01-16T10:00:00.000+0000,att-3,conv-3,TPP,EMIS,External,No,text/plain,No,5,No,ehr-3"
+    _write(export_dir, "attachment_metadata.csv", ATTACHMENT_METADATA_HEADER, ATTACHMENT_ROWS + [extra_row])
+
+    with pytest.warns(UserWarning, match="has changed since it was ingested"):
+        ingested = ingest_attachments_data(cursor, [export_dir])
+
+    assert ingested == [export_dir / "attachment_metadata.csv"]
+    rows = cursor.execute("SELECT attachment_id, internal_id FROM attachment_metadata ORDER BY attachment_id").fetchall()
+    assert rows == [("att-1", "ehr-1"), ("att-2", None), ("att-3", "ehr-3")]
+
+
+def test_same_contents_under_a_new_path_are_skipped_and_recorded(export_dir, tmp_path):
+    cursor = duckdb.connect()
+    ingest_attachments_data(cursor, [export_dir])
+    copy_dir = tmp_path / "copy"
+    _write(copy_dir, "attachment_metadata.csv", ATTACHMENT_METADATA_HEADER, ATTACHMENT_ROWS)
+
+    assert ingest_attachments_data(cursor, [copy_dir]) == []
+    assert ingest_attachments_data(cursor, [export_dir]) == []
+
+    paths = cursor.execute(
+        "SELECT path FROM ingested_files WHERE table_name = 'attachment_metadata' ORDER BY path"
+    ).fetchall()
+    assert paths == [(str(copy_dir / "attachment_metadata.csv"),), (str(export_dir / "attachment_metadata.csv"),)]
+    assert cursor.execute("SELECT count(*) FROM attachment_metadata").fetchone()[0] == 2
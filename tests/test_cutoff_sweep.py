@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+
+from gp2gp.spine.models import APPLICATION_ACK, EHR_REQUEST_COMPLETED, EHR_REQUEST_STARTED
+from prmdata.domain.spine.message import Message
+from prmdata.utils.date.range import DateTimeRange
+
+from scripts import cutoff_sweep
+from scripts.cutoff_sweep import CutoffSweep, outcomes_at_cutoffs
+from scripts.spine_stream import Conversation, run_analyses
+
+START = datetime(2021, 1, 4, 9, tzinfo=timezone.utc)
+STUCK = "DIDN'T COMPLETE - STUCK"
+
+
+def _conversation(conversation_id, ack_after):
+    return Conversation(conversation_id, [
+        Message(START, conversation_id, f"{conversation_id}-1", EHR_REQUEST_STARTED, "R", "S", None, None),
+        Message(START + timedelta(hours=1), conversation_id, f"{conversation_id}-2", EHR_REQUEST_COMPLETED, "S", "R", None, None),
+        Message(START + ack_after, conversation_id, f"{conversation_id}-3", APPLICATION_ACK, "R", "S", f"{conversation_id}-2", None),
+    ])
+
+
+def test_outcome_at_each_cutoff_only_counts_messages_by_then():
+    conversation = _conversation("late ack", timedelta(days=10))
+    cutoffs = [timedelta(hours=1) - timedelta(microseconds=1), timedelta(days=2), timedelta(days=10), timedelta(days=14)]
+
+    assert outcomes_at_cutoffs(conversation, cutoffs) == [
+        STUCK, STUCK, "COMPLETED - BEYOND 8 DAYS", "COMPLETED - BEYOND 8 DAYS",
+    ]
+
+
+def test_only_distinct_partial_prefixes_are_parsed(monkeypatch):
+    parsed = []
+    parse_conversation = cutoff_sweep.parse_conversation
+
+    def counting_parse(conversation):
+        parsed.append(len(conversation.messages))
+        return parse_conversation(conversation)
+
+    monkeypatch.setattr(cutoff_sweep, "parse_conversation", counting_parse)
+    conversation = _conversation("quick", timedelta(hours=2))
+
+    outcomes = outcomes_at_cutoffs(conversation, [timedelta(minutes=10), timedelta(minutes=30), timedelta(days=2), timedelta(days=14)])
+
+    assert outcomes == [STUCK, STUCK, "COMPLETED - WITHIN 8 DAYS", "COMPLETED - WITHIN 8 DAYS"]
+    assert parsed == [3, 1]
+
+
+def test_sweep_matrix():
+    time_range = DateTimeRange(START - timedelta(days=1), START + timedelta(days=1))
+    conversations = [_conversation("quick", timedelta(hours=2)), _conversation("late ack", timedelta(days=10))]
+
+    [result] = run_analyses(conversations, [CutoffSweep(time_range, [timedelta(days=14), timedelta(days=2)])])
+    matrix = result.outcome_matrix()
+
+    assert list(matrix.columns) == [timedelta(days=2), timedelta(days=14)]
+    assert matrix.loc[STUCK].tolist() == [1, 0]
+    assert matrix.loc["COMPLETED - WITHIN 8 DAYS"].tolist() == [1, 1]
+    assert matrix.loc["COMPLETED - BEYOND 8 DAYS"].tolist() == [0, 1]
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, timezone
+
+from gp2gp.spine.models import EHR_REQUEST_COMPLETED, EHR_REQUEST_STARTED
+from prmdata.domain.spine.message import Message
+
+from scripts.duplicate_conversations import DuplicateConversations
+from scripts.spine_stream import Conversation, run_analyses
+
+START = datetime(2021, 1, 4, 9, tzinfo=timezone.utc)
+
+
+def _conversation(conversation_id, requester, sender, hours, ehr_message_ids=()):
+    started = START + timedelta(hours=hours)
+    messages = [Message(started, conversation_id, f"{conversation_id}-start", EHR_REQUEST_STARTED, requester, sender, None, None)]
+    for number, guid in enumerate(ehr_message_ids, start=1):
+        time = started + timedelta(minutes=number)
+        messages.append(Message(time, conversation_id, guid, EHR_REQUEST_COMPLETED, sender, requester, None, None))
+    return Conversation(conversation_id, messages)
+
+
+def _clusters(conversations, **options):
+    [duplicates] = run_analyses(conversations, [DuplicateConversations(**options)])
+    return {
+        frozenset(cluster["conversation_id"])
+        for _, cluster in duplicates.groupby("duplicate_cluster_id")
+    }, duplicates.set_index("conversation_id")
+
+
+def test_shared_ehr_message_ids_link_transitively():
+    conversations = [
+        _conversation("A", "R1", "S1", 0, ["g1"]),
+        _conversation("B", "R2", "S2", 1, ["g1", "g2"]),
+        _conversation("C", "R3", "S3", 2, ["g2"]),
+        _conversation("D", "R4", "S4", 3, ["g3"]),
+    ]
+
+    clusters, duplicates = _clusters(conversations, match_practice_pair=False)
+
+    assert clusters == {frozenset("ABC"), frozenset("D")}
+    assert duplicates.loc["C", "duplicate_cluster_id"] == "A"
+    assert duplicates.loc["C", "is_latest_in_cluster"]
+    assert duplicates.loc["A", "duplicate_cluster_size"] == 3
+
+
+def test_later_ehr_ids_joining_two_buckets_merges_them():
+    # C arrives before B links its EHR ID to A's
+    conversations = [
+        _conversation("A", "R1", "S1", 0, ["g1"]),
+        _conversation("C", "R3", "S3", 2, ["g2"]),
+        _conversation("B", "R2", "S2", 1, ["g1", "g2"]),
+    ]
+
+    clusters, duplicates = _clusters(conversations, match_practice_pair=False)
+
+    assert clusters == {frozenset("ABC")}
+    assert duplicates.loc["B", "duplicate_cluster_id"] == "A"
+
+
+def test_resent_ehr_with_new_ids_is_matched_on_practice_pair_and_window():
+    conversations = [
+        _conversation("first", "R1", "S1", 0, ["g1"]),
+        _conversation("resent", "R1", "S1", 5, ["g2"]),
+        _conversation("next week", "R1", "S1", 24 * 7, ["g3"]),
+        _conversation("other sender", "R1", "S2", 1, ["g4"]),
+    ]
+
+    clusters, _ = _clusters(conversations)
+    ehr_only_clusters, _ = _clusters(conversations, match_practice_pair=False)
+
+    assert clusters == {frozenset(["first", "resent"]), frozenset(["next week"]), frozenset(["other sender"])}
+    assert len(ehr_only_clusters) == 4
+
+
+def test_clusters_do_not_chain_beyond_the_window():
+    conversations = [_conversation(f"retry {day}", "R1", "S1", 20 * day) for day in range(4)]
+
+    clusters, _ = _clusters(conversations, window=timedelta(days=1))
+
+    assert clusters == {frozenset(["retry 0", "retry 1"]), frozenset(["retry 2", "retry 3"])}
+
+
+def test_conversations_without_a_request_are_ignored():
+    conversation = _conversation("A", "R1", "S1", 0, ["g1"])
+    missing_start = Conversation("B", conversation.messages[1:])
+
+    _, duplicates = _clusters([conversation, missing_start])
+
+    assert list(duplicates.index) == ["A"]
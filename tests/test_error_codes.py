@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data.error_codes import ErrorCodeBitsets, decode_bitset, encode_error_codes
+
+TRANSFERS = pd.DataFrame(
+    {
+        "sender_error_codes": [[], [10], [10, 99], None, [30]],
+        "intermediate_error_codes": [[], [], [29, 29], [6], [6, 64]],
+        "final_error_codes": [[], [30], [], [], [99]],
+        "sending_supplier": ["EMIS", "EMIS", "TPP", "TPP", "EMIS"],
+    },
+    index=[10, 11, 12, 13, 14],
+)
+STAGE_COLUMNS = {"Sender": "sender_error_codes", "COPC": "intermediate_error_codes", "Final": "final_error_codes"}
+
+
+def _codes(row, stages):
+    return {code for stage in stages for code in (TRANSFERS.loc[row, STAGE_COLUMNS[stage]] or [])}
+
+
+@pytest.fixture
+def bitsets():
+    return ErrorCodeBitsets.from_transfers(TRANSFERS)
+
+
+def test_encode_and_decode_round_trip():
+    encoded = encode_error_codes(pd.Series([[0, 63, 64, 127], [], None, [5, 5]]))
+
+    assert [decode_bitset(row) for row in encoded] == [[0, 63, 64, 127], [], [], [5]]
+
+
+def test_single_code_columns_are_encoded():
+    encoded = encode_error_codes(pd.Series([10.0, np.nan, 99.0]))
+
+    assert [decode_bitset(row) for row in encoded] == [[10], [], [99]]
+
+
+def test_codes_outside_the_bitset_are_rejected():
+    with pytest.raises(ValueError, match="128"):
+        encode_error_codes(pd.Series([[1, 128]]))
+
+
+@pytest.mark.parametrize("codes", [[10], [30], [6, 99], [64], [1]])
+@pytest.mark.parametrize("stage", [None, "Sender", "COPC", "Final"])
+def test_membership_matches_scanning_the_lists(bitsets, codes, stage):
+    stages = list(STAGE_COLUMNS) if stage is None else [stage]
+
+    any_expected = [bool(_codes(row, stages) & set(codes)) for row in TRANSFERS.index]
+    all_expected = [set(codes) <= _codes(row, stages) for row in TRANSFERS.index]
+
+    assert bitsets.has_any(codes, stage).tolist() == any_expected
+    assert bitsets.has_all(codes, stage).tolist() == all_expected
+
+
+def test_one_hot_has_a_column_per_code_that_occurs(bitsets):
+    one_hot = bitsets.one_hot()
+
+    assert list(one_hot.columns) == [6, 10, 29, 30, 64, 99]
+    assert list(one_hot.index) == list(TRANSFERS.index)
+    assert one_hot.loc[12].to_dict() == {6: 0, 10: 1, 29: 1, 30: 0, 64: 0, 99: 1}
+
+
+def test_columns_round_trip(bitsets):
+    restored = ErrorCodeBitsets.from_columns(bitsets.to_columns())
+
+    assert list(restored.stages) == list(bitsets.stages)
+    for stage in bitsets.stages:
+        np.testing.assert_array_equal(restored.bits(stage), bitsets.bits(stage))
+    assert list(restored.index) == list(bitsets.index)
+
+
+def test_signatures_label_each_combination_by_stage(bitsets):
+    assert list(bitsets.signatures()) == [
+        "No Error Code",
+        "Sender:10, Final:30",
+        "Sender:10, Sender:99, COPC:29",
+        "COPC:6",
+        "Sender:30, COPC:6, COPC:64, Final:99",
+    ]
+
+
+def test_combinations_count_transfers(bitsets):
+    repeated = ErrorCodeBitsets.from_transfers(pd.concat([TRANSFERS, TRANSFERS.iloc[[1, 3]]], ignore_index=True))
+
+    counts = repeated.combinations()
+    by_supplier = bitsets.combinations(TRANSFERS, by=["sending_supplier"])
+
+    assert counts.iloc[0]["number_of_transfers"] == 2
+    assert dict(zip(counts["error_code_combination"], counts["number_of_transfers"]))["COPC:6"] == 2
+    assert by_supplier["number_of_transfers"].sum() == len(TRANSFERS)
+    assert set(by_supplier.loc[by_supplier["sending_supplier"] == "TPP", "error_code_combination"]) == {
+        "Sender:10, Sender:99, COPC:29", "COPC:6",
+    }
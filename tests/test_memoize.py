@@ -0,0 +1,141 @@
+import os
+
+import pandas as pd
+import pytest
+
+from data import memoize as memoize_module
+from data.memoize import ENABLED_VARIABLE, memoize
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "memo")
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_text("value\n1\n2\n")
+    return str(path)
+
+
+def _counted(cache_dir, calls, **options):
+    @memoize(inputs=["path"], ignore=["verbose"], cache_dir=cache_dir, **options)
+    def total(path, scale=1, verbose=False):
+        calls.append((path, scale))
+        return pd.read_csv(path).assign(value=lambda frame: frame["value"] * scale)
+
+    return total
+
+
+def test_repeated_calls_are_served_from_the_cache(cache_dir, input_file):
+    calls = []
+    total = _counted(cache_dir, calls)
+
+    first = total(input_file)
+    second = total(input_file, verbose=True)
+
+    pd.testing.assert_frame_equal(first, second)
+    assert len(calls) == 1
+    assert (total.stats.hits, total.stats.misses) == (1, 1)
+
+
+def test_different_arguments_are_cached_separately(cache_dir, input_file):
+    calls = []
+    total = _counted(cache_dir, calls)
+
+    total(input_file, scale=1)
+    total(input_file, scale=2)
+    total(input_file, scale=2)
+
+    assert calls == [(input_file, 1), (input_file, 2)]
+
+
+def test_changed_input_file_invalidates(cache_dir, input_file):
+    calls = []
+    total = _counted(cache_dir, calls)
+    total(input_file)
+
+    with open(input_file, "a") as f:
+        f.write("3\n")
+    result = total(input_file)
+
+    assert len(calls) == 2
+    assert result["value"].tolist() == [1, 2, 3]
+
+
+def test_changed_module_source_invalidates(cache_dir, input_file, monkeypatch):
+    calls = []
+    monkeypatch.setattr(memoize_module, "module_source", lambda function: "def total(): version 1")
+    _counted(cache_dir, calls)(input_file)
+    _counted(cache_dir, calls)(input_file)
+
+    monkeypatch.setattr(memoize_module, "module_source", lambda function: "def total(): version 2")
+    _counted(cache_dir, calls)(input_file)
+
+    assert len(calls) == 2
+
+
+def test_version_bump_invalidates(cache_dir, input_file):
+    calls = []
+    _counted(cache_dir, calls, version=1)(input_file)
+    _counted(cache_dir, calls, version=1)(input_file)
+    _counted(cache_dir, calls, version=2)(input_file)
+
+    assert len(calls) == 2
+
+
+def test_invalidate_and_clear(cache_dir, input_file):
+    calls = []
+    total = _counted(cache_dir, calls)
+    total(input_file, scale=1)
+    total(input_file, scale=2)
+
+    assert total.invalidate(input_file, scale=1)
+    assert not total.invalidate(input_file, scale=1)
+    total(input_file, scale=1)
+    total(input_file, scale=2)
+    assert len(calls) == 3
+
+    assert total.clear() == 2
+    total(input_file, scale=2)
+    assert len(calls) == 4
+
+
+def test_unreadable_results_are_recomputed(cache_dir, input_file):
+    calls = []
+    total = _counted(cache_dir, calls)
+    total(input_file)
+    for name in os.listdir(cache_dir):
+        with open(os.path.join(cache_dir, name), "wb") as f:
+            f.write(b"not parquet")
+
+    result = total(input_file)
+
+    assert len(calls) == 2
+    assert result["value"].tolist() == [1, 2]
+
+
+def test_non_frame_results_are_pickled(cache_dir):
+    calls = []
+
+    @memoize(cache_dir=cache_dir)
+    def counts(n):
+        calls.append(n)
+        return {"n": n, "squares": [i * i for i in range(n)]}
+
+    assert counts(3) == counts(3) == {"n": 3, "squares": [0, 1, 4]}
+    assert calls == [3]
+    assert [name.endswith(".pickle") for name in os.listdir(cache_dir)] == [True]
+
+
+def test_disabled_by_environment(cache_dir, input_file, monkeypatch):
+    monkeypatch.setenv(ENABLED_VARIABLE, "0")
+    calls = []
+    total = _counted(cache_dir, calls)
+
+    total(input_file)
+    total(input_file)
+
+    assert len(calls) == 2
+    assert not os.path.exists(cache_dir)
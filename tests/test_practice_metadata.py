@@ -0,0 +1,87 @@
+import json
+
+import pandas as pd
+import pytest
+
+from data import practice_metadata
+from data.json_stream import stream_object_arrays
+
+ODS_METADATA = {
+    "generated_on": "2021-06-01T00:00:00",
+    "version": 12345,
+    "practices": [
+        {"ods_code": "A12345", "name": "Abbey Practice", "asids": ["111111111111", "111111111112"]},
+        {"ods_code": "B67890", "name": "Bryn Meddygfa – Llŷn", "asids": ["222222222222"]},
+        {"ods_code": "C11111", "name": "Cross Street", "asids": []},
+    ],
+    "ccgs": [
+        {"ods_code": "00A", "name": "North CCG", "practices": ["A12345", "C11111"]},
+        {"ods_code": "00B", "name": "South CCG", "practices": ["B67890"]},
+    ],
+}
+
+
+class ShortReadBody:
+    # Like a streamed S3 body, returns at most read_size bytes per read whatever
+    # size is asked for
+    def __init__(self, content, read_size):
+        self.content = content
+        self.read_size = read_size
+        self.position = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.content)
+        end = self.position + min(size, self.read_size)
+        block = self.content[self.position:end]
+        self.position = end
+        return block
+
+
+class FakeS3Resource:
+    def __init__(self, content, read_size):
+        self.content = content
+        self.read_size = read_size
+
+    def Object(self, bucket_name, key):
+        return self
+
+    def get(self):
+        return {"Body": ShortReadBody(self.content, self.read_size)}
+
+
+class FakeBoto3:
+    def __init__(self, content, read_size):
+        self.s3 = FakeS3Resource(content, read_size)
+
+    def resource(self, service_name):
+        return self.s3
+
+
+def _read_asid_metadata(monkeypatch, read_size, streaming):
+    content = json.dumps(ODS_METADATA, ensure_ascii=False).encode("utf-8")
+    monkeypatch.setattr(practice_metadata, "boto3", FakeBoto3(content, read_size))
+    return practice_metadata.read_asid_metadata.uncached("bucket", "ods.json", streaming=streaming)
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 7, 64, 10 ** 6])
+def test_streaming_matches_reading_the_whole_document(monkeypatch, read_size):
+    expected = _read_asid_metadata(monkeypatch, 10 ** 6, streaming=False)
+
+    streamed = _read_asid_metadata(monkeypatch, read_size, streaming=True)
+
+    pd.testing.assert_frame_equal(streamed, expected)
+    assert streamed.loc["222222222222", "ccg_name"] == "South CCG"
+    assert streamed.loc["222222222222", "practice_name"] == "Bryn Meddygfa – Llŷn"
+
+
+@pytest.mark.parametrize("block_size", range(1, 24))
+def test_numbers_cut_at_a_block_boundary_are_read_whole(block_size):
+    document = {"count": 12345, "ratio": -1.5e10, "items": [10, 2.25, 300], "flag": True, "none": None}
+    elements = []
+    content = json.dumps(document).encode("utf-8")
+
+    other_members = stream_object_arrays(ShortReadBody(content, block_size), {"items": elements.append}, block_size)
+
+    assert elements == [10, 2.25, 300]
+    assert other_members == {"count": 12345, "ratio": -1.5e10, "flag": True, "none": None}
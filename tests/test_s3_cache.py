@@ -0,0 +1,92 @@
+import os
+
+import pandas as pd
+import pytest
+
+from data.s3_cache import LocalS3Client, S3Cache
+
+
+class CountingS3Client(LocalS3Client):
+    def __init__(self, root):
+        super().__init__(root)
+        self.downloads = []
+
+    def download_file(self, Bucket, Key, Filename):
+        self.downloads.append(Key)
+        super().download_file(Bucket=Bucket, Key=Key, Filename=Filename)
+
+
+@pytest.fixture
+def s3_client(tmp_path):
+    os.makedirs(tmp_path / "s3" / "bucket")
+    return CountingS3Client(str(tmp_path / "s3"))
+
+
+def _put(s3_client, key, frame):
+    frame.to_csv(os.path.join(s3_client.root, "bucket", key), index=False)
+
+
+def _cache(tmp_path, s3_client, max_bytes=10 ** 9):
+    return S3Cache(str(tmp_path / "cache"), max_bytes, s3_client)
+
+
+def test_miss_downloads_and_converts_to_parquet(tmp_path, s3_client):
+    frame = pd.DataFrame({"asid": ["1", "2"], "practice": ["A", "B"]})
+    _put(s3_client, "lookup.csv", frame)
+
+    result = _cache(tmp_path, s3_client).read("s3://bucket/lookup.csv")
+
+    assert s3_client.downloads == ["lookup.csv"]
+    pd.testing.assert_frame_equal(result, pd.read_csv(os.path.join(s3_client.root, "bucket", "lookup.csv")))
+
+
+def test_hit_reuses_the_cached_copy_and_touches_it(tmp_path, s3_client):
+    _put(s3_client, "lookup.csv", pd.DataFrame({"asid": [1]}))
+    cache = _cache(tmp_path, s3_client)
+    path = cache.local_path("s3://bucket/lookup.csv")
+    os.utime(path, (0, 0))
+
+    assert cache.local_path("s3://bucket/lookup.csv") == path
+    assert s3_client.downloads == ["lookup.csv"]
+    assert os.path.getmtime(path) > 0
+
+
+def test_changed_etag_downloads_again(tmp_path, s3_client):
+    _put(s3_client, "lookup.csv", pd.DataFrame({"asid": [1]}))
+    cache = _cache(tmp_path, s3_client)
+    first_path = cache.local_path("s3://bucket/lookup.csv")
+
+    _put(s3_client, "lookup.csv", pd.DataFrame({"asid": [2]}))
+    second_path = cache.local_path("s3://bucket/lookup.csv")
+
+    assert second_path != first_path
+    assert s3_client.downloads == ["lookup.csv", "lookup.csv"]
+    assert cache.read("s3://bucket/lookup.csv")["asid"].tolist() == [2]
+
+
+def test_least_recently_used_copies_are_evicted(tmp_path, s3_client):
+    for key in ["a.csv", "b.csv", "c.csv"]:
+        _put(s3_client, key, pd.DataFrame({"value": range(100)}))
+    unbounded = _cache(tmp_path, s3_client)
+    a_path = unbounded.local_path("s3://bucket/a.csv")
+    b_path = unbounded.local_path("s3://bucket/b.csv")
+    os.utime(a_path, (1, 1))
+    os.utime(b_path, (2, 2))
+
+    # Room for two copies: reading c evicts a, the least recently used
+    cache = _cache(tmp_path, s3_client, max_bytes=os.path.getsize(a_path) * 2)
+    c_path = cache.local_path("s3://bucket/c.csv")
+
+    assert not os.path.exists(a_path)
+    assert os.path.exists(b_path)
+    assert os.path.exists(c_path)
+
+
+def test_a_copy_larger_than_the_cache_is_kept_until_the_next_read(tmp_path, s3_client):
+    _put(s3_client, "big.csv", pd.DataFrame({"value": range(1000)}))
+    cache = _cache(tmp_path, s3_client, max_bytes=1)
+
+    path = cache.local_path("s3://bucket/big.csv")
+
+    assert os.path.exists(path)
+    assert cache.read("s3://bucket/big.csv")["value"].sum() == sum(range(1000))
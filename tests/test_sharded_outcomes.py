@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+from dateutil.tz import tzutc
+from prmdata.utils.date.range import DateTimeRange
+
+from scripts.gp2gp_spine_outcomes import calculate_counts
+from scripts.sharded_outcomes import calculate_counts_sharded, shard_dir_name
+from scripts.synthetic_data import SyntheticConfig, write_spine_csv_gz_files
+
+JANUARY = datetime(2021, 1, 1, tzinfo=tzutc())
+
+
+def test_shard_dirs_are_unique_per_export_and_month():
+    names = {
+        shard_dir_name("exports/2021-01/Part1.csv.gz", JANUARY),
+        shard_dir_name("exports/2021-02/Part1.csv.gz", JANUARY),
+        shard_dir_name("exports/2021-01/Part1.csv.gz", JANUARY + relativedelta(months=1)),
+        shard_dir_name("s3://bucket/2021-01/Part1.csv.gz", JANUARY),
+    }
+
+    assert len(names) == 4
+    assert shard_dir_name("exports/2021-01/Part1.csv.gz", JANUARY).startswith("2021-01-")
+
+
+def test_exports_with_the_same_file_name_are_sharded_separately(tmp_path):
+    # Monthly exports in their own directories under the same file name
+    files, _ = write_spine_csv_gz_files(SyntheticConfig(300, seed=1), tmp_path / "generated")
+    month_files = []
+    for month, file in zip(["2021-01", "2021-02"], files):
+        month_dir = tmp_path / "exports" / month
+        month_dir.mkdir(parents=True)
+        month_files.append(str(file.rename(month_dir / "Part1.csv.gz")))
+
+    sharded = calculate_counts_sharded(month_files, JANUARY, shard_count=3, max_workers=2, shard_dir=tmp_path / "shards")
+    expected = calculate_counts.uncached(
+        month_files[0], month_files[1], DateTimeRange(JANUARY, JANUARY + relativedelta(months=1))
+    )
+
+    assert dict(sharded[JANUARY]) == dict(expected)
+    assert sum(expected.values()) > 0
+    assert len(list((tmp_path / "shards").iterdir())) == 2
@@ -0,0 +1,89 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from prmdata.domain.spine.conversation import group_into_conversations
+from prmdata.domain.spine.message import Message
+
+from scripts.spine_stream import (
+    DEFAULT_ALLOWED_LATENESS,
+    DEFAULT_IDLE_TIMEOUT,
+    StreamStats,
+    pop_idle_timeout,
+    stream_conversations,
+)
+
+START = datetime(2021, 1, 1, tzinfo=timezone.utc)
+DAYS = 100
+CONVERSATIONS_PER_DAY = 10
+
+
+def _message(conversation_id, number, time):
+    return Message(time, conversation_id, f"{conversation_id}-{number}", "RCMR_IN010000UK05", "A", "B", None, None)
+
+
+def _messages(jitter=timedelta(0)):
+    # Conversations start evenly over DAYS and each lasts up to 3 days; the
+    # export order is by time plus up to jitter of noise, like a Splunk export
+    generator = random.Random(0)
+    messages = []
+    for number in range(DAYS * CONVERSATIONS_PER_DAY):
+        started = START + timedelta(days=number / CONVERSATIONS_PER_DAY)
+        for message_number in range(generator.randint(1, 6)):
+            time = started + timedelta(hours=generator.uniform(0, 72))
+            messages.append(_message(f"conversation-{number}", message_number, time))
+    return sorted(messages, key=lambda message: message.time + jitter * generator.random())
+
+
+def _as_set(conversations):
+    return {(conversation.id, tuple(conversation.messages)) for conversation in conversations}
+
+
+def _open_conversation_limit(idle_timeout):
+    # Conversations started within the release horizon plus one conversation length
+    window = idle_timeout + DEFAULT_ALLOWED_LATENESS + timedelta(days=3)
+    return (window.days + 1) * CONVERSATIONS_PER_DAY
+
+
+@pytest.mark.parametrize("jitter", [timedelta(0), timedelta(hours=12)])
+def test_stream_matches_group_into_conversations_with_bounded_memory(jitter):
+    messages = _messages(jitter)
+    stats = StreamStats()
+
+    streamed = list(stream_conversations(iter(messages), DEFAULT_IDLE_TIMEOUT, stats=stats))
+
+    assert _as_set(streamed) == _as_set(group_into_conversations(messages))
+    assert len(streamed) == DAYS * CONVERSATIONS_PER_DAY
+    assert stats.late_messages == 0
+    assert stats.max_open_conversations <= _open_conversation_limit(DEFAULT_IDLE_TIMEOUT)
+
+
+def test_without_idle_timeout_everything_stays_open():
+    messages = _messages()
+    stats = StreamStats()
+
+    streamed = list(stream_conversations(iter(messages), None, stats=stats))
+
+    assert _as_set(streamed) == _as_set(group_into_conversations(messages))
+    assert stats.max_open_conversations == DAYS * CONVERSATIONS_PER_DAY
+
+
+def test_late_messages_are_counted_and_reported():
+    messages = [
+        _message("early", 0, START),
+        _message("later", 0, START + timedelta(days=30)),
+        _message("early", 1, START + timedelta(days=1)),
+    ]
+    stats = StreamStats()
+
+    with pytest.warns(UserWarning, match="1 messages"):
+        streamed = list(stream_conversations(iter(messages), DEFAULT_IDLE_TIMEOUT, stats=stats))
+
+    assert stats.late_messages == 1
+    assert sorted(len(conversation.messages) for conversation in streamed) == [1, 1, 1]
+
+
+def test_pop_idle_timeout():
+    assert pop_idle_timeout(["a.csv.gz"]) == (DEFAULT_IDLE_TIMEOUT, ["a.csv.gz"])
+    assert pop_idle_timeout(["--idle-timeout-days", "3", "a.csv.gz"]) == (timedelta(days=3), ["a.csv.gz"])
+    assert pop_idle_timeout(["a.csv.gz", "--idle-timeout-days", "0"]) == (None, ["a.csv.gz"])
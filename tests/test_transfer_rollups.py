@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+import duckdb
+import pandas as pd
+import pytest
+
+from scripts.transfer_rollups import SPINE_SOURCE, create_rollups_schema, daily_rollups, replace_months, time_series
+
+TRANSFERS = pd.DataFrame({
+    "date_requested": pd.to_datetime(
+        ["2021-01-04 10:00", "2021-01-04 23:00", "2021-01-31 12:00", None, "2021-02-01 09:00"], utc=True
+    ),
+    "requesting_practice_asid": ["1", "1", "2", "2", "1"],
+    "sending_practice_asid": ["3", "3", "3", "4", None],
+    "status": ["INTEGRATED", "FAILED", "INTEGRATED", "INTEGRATED", "PENDING"],
+    "sla_duration": [timedelta(hours=1), None, timedelta(hours=3), timedelta(hours=2), None],
+})
+
+
+def test_undated_transfers_are_reported():
+    with pytest.warns(UserWarning, match="1 transfers without a date_requested"):
+        rollups = daily_rollups(TRANSFERS)
+
+    requesting = rollups[rollups["side"] == "requesting"]
+    assert requesting["number_of_transfers"].sum() == 4
+    assert requesting.groupby("month")["number_of_transfers"].sum().to_dict() == {"2021-01": 3, "2021-02": 1}
+    assert requesting["sla_duration_seconds_sum"].sum() == 4 * 3600
+
+
+def test_rollups_add_up_to_the_transfers_in_replaced_months():
+    cursor = duckdb.connect()
+    create_rollups_schema(cursor)
+    with pytest.warns(UserWarning):
+        rollups = daily_rollups(TRANSFERS)
+
+    replace_months(cursor, rollups, SPINE_SOURCE, ["2021-01"])
+    replace_months(cursor, rollups, SPINE_SOURCE, ["2021-01"])
+    series = time_series(cursor, "month", by=["status"], source=SPINE_SOURCE)
+
+    assert series["number_of_transfers"].sum() == 3